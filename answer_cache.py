@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# answer_cache.py — Cache sémantique des réponses (questions quasi identiques)
+#
+# Une entrée = (embedding de la question, langue, ids des chunks retrouvés, réponse).
+# Une nouvelle question réutilise la réponse si : cosinus >= seuil, même langue,
+# et ensembles de chunks suffisamment recouvrants (Jaccard). Éviction LRU + TTL ;
+# tout le cache est vidé quand la version de l'index (namespace) change.
+
+import os, time, threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+import numpy as np
+import metrics
+
+# ================= CONFIG =================
+ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+ANSWER_CACHE_SIZE: int = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL: float = float(os.getenv("ANSWER_CACHE_TTL", "21600"))          # 6 h
+ANSWER_CACHE_THRESHOLD: float = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.90"))  # cosinus minimal
+ANSWER_CACHE_MIN_OVERLAP: float = float(os.getenv("ANSWER_CACHE_MIN_OVERLAP", "0.5"))  # Jaccard minimal
+
+def _unit(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    n = np.linalg.norm(v)
+    return v / n if n else v
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+class SemanticAnswerCache:
+    """Cache LRU/TTL de réponses, recherché par similarité cosinus (une seule matrice N×D)."""
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD, min_overlap: float = ANSWER_CACHE_MIN_OVERLAP,
+                 version_fn: Optional[Callable[[], str]] = None):
+        self.maxsize, self.ttl = maxsize, ttl
+        self.threshold, self.min_overlap = threshold, min_overlap
+        self.version_fn = version_fn
+        self._version: Optional[str] = None
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._next_id = 0
+        self._matrix: Optional[np.ndarray] = None   # reconstruite paresseusement après modification
+        self._matrix_ids: List[int] = []
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    # ---- interne (verrou tenu) ----
+    def _check_version(self) -> None:
+        if self.version_fn is None:
+            return
+        v = self.version_fn()
+        if v != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._matrix = None
+            self._version = v
+
+    def _expire(self, now: float) -> None:
+        dead = [eid for eid, e in self._entries.items() if now - e["created"] > self.ttl]
+        for eid in dead:
+            del self._entries[eid]
+            self.evictions += 1
+        if dead:
+            self._matrix = None
+
+    def _rebuild(self) -> None:
+        self._matrix_ids = list(self._entries)
+        self._matrix = (np.stack([self._entries[i]["vec"] for i in self._matrix_ids])
+                        if self._matrix_ids else None)
+
+    # ---- API ----
+    def lookup(self, qvec: List[float], lang: str, chunk_ids: Iterable[str]) -> Optional[Dict]:
+        """Renvoie {"answer", "sources", "similarity", ...} si une question équivalente est en cache."""
+        ids = frozenset(chunk_ids)
+        with self._lock:
+            self._check_version()
+            self._expire(time.time())
+            if self._matrix is None and self._entries:
+                self._rebuild()
+            if self._matrix is None:
+                self.misses += 1
+                metrics.cache_event("answer", False)
+                return None
+            sims = self._matrix @ _unit(qvec)
+            for pos in np.argsort(-sims):
+                if sims[pos] < self.threshold:
+                    break
+                eid = self._matrix_ids[pos]
+                e = self._entries[eid]
+                if e["lang"] == lang and _jaccard(e["chunk_ids"], ids) >= self.min_overlap:
+                    self._entries.move_to_end(eid)
+                    self.hits += 1
+                    metrics.cache_event("answer", True)
+                    return {"answer": e["answer"], "sources": e["sources"],
+                            "similarity": float(sims[pos]), "question": e["question"]}
+            self.misses += 1
+            metrics.cache_event("answer", False)
+            return None
+
+    def put(self, qvec: List[float], lang: str, chunk_ids: Iterable[str], answer: str,
+            sources: Optional[List[str]] = None, question: str = "") -> None:
+        with self._lock:
+            self._check_version()
+            self._entries[self._next_id] = {
+                "vec": _unit(qvec), "lang": lang, "chunk_ids": frozenset(chunk_ids),
+                "answer": answer, "sources": list(sources or []), "question": question,
+                "created": time.time(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "size": len(self._entries), "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
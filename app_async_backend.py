@@ -0,0 +1,424 @@
+# app_async_backend.py — Mode de service asyncio (ASGI) du chat RAG
+#
+# Mêmes endpoints que app_flask_backend.py (/api/chat, /api/chat/stream), mais une
+# seule boucle asyncio sert des centaines de chats sans un thread OS par requête :
+#   - AsyncOpenAI sur un pool de connexions httpx partagé
+#   - Pinecone via IndexAsyncio (aiohttp) ou index local NumPy
+#   - sémaphores qui bornent les appels simultanés vers OpenAI et l'index
+#   - étapes indépendantes lancées en parallèle (retrieval DB + recherche Google)
+#   - questions identiques simultanées coalescées (single_flight) : un embedding, un retrieval, une génération
+#
+# Lancement : uvicorn app_async_backend:app --host 0.0.0.0 --port 5000
+#        ou : gunicorn -k uvicorn.workers.UvicornWorker app_async_backend:app
+import os, json, time, asyncio
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse, Response
+from starlette.routing import Route
+from vector_store import open_index, namespaces_version, VECTOR_BACKEND
+from embedding_cache import get_cache
+from answer_cache import SemanticAnswerCache, ANSWER_CACHE_ENABLED
+from neighbour_index import load_neighbour_index
+from namespace_fanout import search_namespaces, afan_out, merged_matches
+import metrics
+from session_store import (SessionStore, history_messages, render_history, summary_messages,
+                           SUMMARY_MAX_TOKENS)
+from single_flight import AsyncSingleFlight, AsyncStreamFlight, flight_key
+from clients import Readiness, warm_index, warm_local_caches, WARMUP_MODE, WARMUP_TEXT
+from chat_core import MODEL_EMB, MODEL_CHAT, detect_lang, build_prompt, packed_context, output_text
+
+# ------------------------------
+# Charger les variables d'environnement
+# ------------------------------
+load_dotenv("index_key.env")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+PINECONE_ENV = os.getenv("PINECONE_ENV")
+INDEX_NAME = os.getenv("PINECONE_INDEX", "aya-1536")
+INDEX_HOST = os.getenv("INDEX_HOST")
+NAMESPACES = search_namespaces("")  # "" = namespace par défaut de l'index ; SEARCH_NAMESPACES pour le fan-out
+
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+VECTOR_MAX_CONCURRENCY = int(os.getenv("VECTOR_MAX_CONCURRENCY", "64"))
+HTTP_MAX_CONNECTIONS   = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+
+# Une clé manquante ne bloque plus le démarrage : l'erreur sort au warm-up et dans /readyz
+if not OPENAI_API_KEY:
+    print("[Config] OPENAI_API_KEY non trouvé dans index_key.env")
+if not PINECONE_API_KEY and VECTOR_BACKEND != "local":
+    print("[Config] PINECONE_API_KEY non trouvé dans index_key.env")
+
+# ------------------------------
+# Clients (créés dans la boucle au démarrage, fermés à l'arrêt)
+# ------------------------------
+openai: AsyncOpenAI = None
+idx = None
+openai_sem: asyncio.Semaphore = None
+vector_sem: asyncio.Semaphore = None
+neighbours = None
+readiness = Readiness()
+_warmup_task: asyncio.Task = None
+sessions = SessionStore()
+# même cache sémantique que app_flask_backend, vidé dès qu'un namespace interrogé est ré-indexé
+answer_cache = SemanticAnswerCache(version_fn=lambda: namespaces_version(NAMESPACES))
+_background_tasks: set = set()   # références fortes : une tâche non référencée peut être collectée
+embed_flight = AsyncSingleFlight("embed")
+context_flight = AsyncSingleFlight("context")
+answer_flight = AsyncSingleFlight("generate")
+stream_flight = AsyncStreamFlight("generate_stream")
+
+async def _open_async_index():
+    """Index asynchrone : IndexAsyncio (pool aiohttp) pour Pinecone, sinon index local."""
+    if VECTOR_BACKEND == "local":
+        return open_index("local")
+    from pinecone import Pinecone
+    pc = Pinecone(api_key=PINECONE_API_KEY, environment=PINECONE_ENV) if PINECONE_ENV else Pinecone(api_key=PINECONE_API_KEY)
+    host = INDEX_HOST or await asyncio.to_thread(lambda: pc.describe_index(INDEX_NAME).host)
+    return pc.IndexAsyncio(host=host)
+
+@asynccontextmanager
+async def lifespan(_app):
+    global openai, idx, openai_sem, vector_sem, neighbours
+    openai = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS
+        ))
+    )
+    openai_sem = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    vector_sem = asyncio.Semaphore(VECTOR_MAX_CONCURRENCY)
+    neighbours = await asyncio.to_thread(load_neighbour_index, namespaces=NAMESPACES)
+    try:
+        idx = await _open_async_index()
+        print(f"Index connecté ({VECTOR_BACKEND}) :", INDEX_NAME)
+    except Exception as e:
+        print("[Erreur index]", e)
+        idx = None
+    await _start_warm_up()
+    try:
+        yield
+    finally:
+        if _warmup_task is not None and not _warmup_task.done():
+            _warmup_task.cancel()
+        if idx is not None and hasattr(idx, "close"):
+            await idx.close()
+        await openai.close()
+
+# ------------------------------
+# Warm-up : connexions TLS ouvertes, index mappé, caches chargés avant la 1re requête
+# ------------------------------
+async def _warm_openai():
+    await openai.embeddings.create(model=MODEL_EMB, input=WARMUP_TEXT)
+
+async def _warm_index():
+    if idx is None:
+        raise RuntimeError("index non connecté")
+    if VECTOR_BACKEND == "local":
+        await asyncio.to_thread(warm_index, idx, NAMESPACES)
+    else:
+        await idx.describe_index_stats()
+
+async def _warm_local_caches():
+    await asyncio.to_thread(warm_local_caches)
+
+async def _start_warm_up():
+    global _warmup_task
+    steps = [("openai", _warm_openai), ("index", _warm_index), ("local_caches", _warm_local_caches)]
+    if WARMUP_MODE == "off":
+        readiness.ready = True
+    elif WARMUP_MODE == "sync":
+        await readiness.arun(steps)
+    else:
+        _warmup_task = asyncio.create_task(readiness.arun(steps))
+
+# ------------------------------
+# Étapes asynchrones
+# ------------------------------
+async def _aembed_uncached(text):
+    async with openai_sem:
+        with metrics.stage("embed"):
+            resp = await openai.embeddings.create(model=MODEL_EMB, input=text)
+    vec = resp.data[0].embedding
+    await asyncio.to_thread(get_cache().put, MODEL_EMB, text, vec)
+    return vec
+
+async def aembed_many(texts):
+    """Embeddings de plusieurs textes : cache, puis un seul appel (sous openai_sem) pour les absents."""
+    cache = get_cache()
+    out = await asyncio.to_thread(lambda: [cache.get(MODEL_EMB, t) for t in texts])
+    missing = list(dict.fromkeys(t for t, v in zip(texts, out) if v is None))
+    if missing:
+        async with openai_sem:
+            resp = await openai.embeddings.create(model=MODEL_EMB, input=missing)
+        done = {t: d.embedding for t, d in zip(missing, resp.data)}
+        await asyncio.to_thread(lambda: [cache.put(MODEL_EMB, t, v) for t, v in done.items()])
+        out = [v if v is not None else done[t] for t, v in zip(texts, out)]
+    return out
+
+def web_embedder(loop):
+    """embed_fn de web_enrichment (appelé dans son pool de threads) : embeddings des snippets
+    par le client AsyncOpenAI de cette boucle, donc sous le plafond openai_sem."""
+    def embed(texts):
+        return asyncio.run_coroutine_threadsafe(aembed_many(texts), loop).result(timeout=30)
+    return embed
+
+async def aembed(text):
+    # le cache peut lire/écrire SQLite : hors de la boucle d'événements
+    vec = await asyncio.to_thread(get_cache().get, MODEL_EMB, text)
+    if vec is None:
+        vec, _ = await embed_flight.do(text, lambda: _aembed_uncached(text))
+    return vec
+
+async def _aquery_namespace(vector, top_k, include_values, namespace):
+    async with vector_sem:
+        if VECTOR_BACKEND == "local":
+            # index NumPy : produit matriciel bloquant, exécuté dans un thread
+            return await asyncio.to_thread(idx.query, vector=vector, top_k=top_k, include_metadata=True,
+                                           include_values=include_values, namespace=namespace)
+        return await idx.query(vector=vector, top_k=top_k, include_metadata=True,
+                               include_values=include_values, namespace=namespace)
+
+async def aquery(vector, top_k, include_values=False, lang=None):
+    """Requête vectorielle ; avec SEARCH_NAMESPACES, un namespace par langue en parallèle."""
+    with metrics.stage("vector_query"):
+        if len(NAMESPACES) == 1:
+            return await _aquery_namespace(vector, top_k, include_values, NAMESPACES[0] or None)
+        per_ns = await afan_out(lambda ns: _aquery_namespace(vector, top_k, include_values, ns), NAMESPACES)
+        return merged_matches(per_ns, lang, top_k)
+
+async def aretrieve(query, top_k=5, include_values=False):
+    """Renvoie (embedding de la question, résultats bruts de l'index)."""
+    emb = await aembed(query)
+    return emb, await aquery(emb, top_k, include_values=include_values, lang=detect_lang(query))
+
+async def gather_context(question, use_web):
+    """Retrieval DB et recherche web spéculative en parallèle, puis filtre de cohérence ;
+    renvoie (embedding, résultats, contexte, sources).
+
+    Le web n'est attendu que jusqu'à WEB_BUDGET_MS après son lancement : au-delà, contexte DB seul.
+    """
+    if not use_web:
+        emb, results = await aretrieve(question)
+        context, sources = await asyncio.to_thread(packed_context, results, neighbours)
+        return emb, results, context, sources
+    import web_enrichment
+
+    # recherche + embeddings des snippets lancés avant le retrieval (pool de threads de web_enrichment)
+    deadline = web_enrichment.deadline_in()
+    embed_fn = web_embedder(asyncio.get_running_loop())
+    pending = asyncio.wrap_future(web_enrichment.start_web(question, 8, embed_fn=embed_fn))
+    emb, results = await aretrieve(question, include_values=True)
+    t0 = time.perf_counter()
+    try:
+        # shield : une recherche en retard finit quand même et remplit le cache
+        snippets, snippet_vectors = await asyncio.wait_for(asyncio.shield(pending), web_enrichment.time_left(deadline))
+    except asyncio.TimeoutError:
+        web_enrichment.missed_deadline()
+        snippets, snippet_vectors = [], None
+    metrics.record("web_wait", time.perf_counter() - t0)
+    # vecteurs déjà renvoyés par l'index : aucun ré-embedding côté DB
+    vectors = [m['values'] for m in results['matches']]
+    valid = web_enrichment.filter_coherent(snippets, snippet_vectors, vectors, 0.75)
+    web_lines = [f"{s['snippet']} (source: {s['link']})" for s in valid[:3]]
+    # snippets web comptés dans le budget de tokens (part réservée, le reste pour la DB)
+    context, sources = await asyncio.to_thread(packed_context, results, neighbours, web_lines)
+    return emb, results, context, sources
+
+def cache_lookup(question, emb, results, cacheable=True):
+    """Réponse en cache pour une question équivalente, et la clé (langue, ids) pour l'y ranger.
+
+    Clé None si la réponse dépend d'autre chose que des chunks (historique de session, contexte web).
+    """
+    if not ANSWER_CACHE_ENABLED or not cacheable:
+        return None, None
+    key = (detect_lang(question), [m['id'] for m in results['matches']])
+    return answer_cache.lookup(emb, *key), key
+
+async def agenerate(prompt):
+    async with openai_sem:
+        response = await openai.responses.create(model=MODEL_CHAT, input=prompt)
+    metrics.usage_tokens(response)
+    return output_text(response)
+
+async def astream_deltas(prompt):
+    """Deltas de texte d'une génération streamée (lue par la tâche de AsyncStreamFlight)."""
+    async with openai_sem:
+        stream = await openai.responses.create(model=MODEL_CHAT, input=prompt, stream=True)
+        async for event in stream:
+            if event.type == "response.output_text.delta":
+                yield event.delta
+            elif event.type == "response.completed":
+                metrics.usage_tokens(event.response)
+            elif event.type in ("response.failed", "error"):
+                raise RuntimeError(getattr(event, "message", None) or event.type)
+
+async def _read_question(request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    return (data.get("message") or "").strip(), bool(data.get("web", False)), data.get("session_id")
+
+# ------------------------------
+# Sessions : historique compacté dans le prompt, résumé incrémental après la réponse
+# ------------------------------
+async def asummarize(summary, turns):
+    async with openai_sem:
+        with metrics.stage("summarize"):
+            r = await openai.chat.completions.create(model=MODEL_CHAT, temperature=0, max_tokens=SUMMARY_MAX_TOKENS,
+                                                     messages=summary_messages(summary, turns))
+    metrics.usage_tokens(r)
+    return (r.choices[0].message.content or "").strip()
+
+async def remember(session_id, question, answer):
+    # SessionStore lit/écrit SQLite (SESSION_DB) sous un verrou de thread : hors de la boucle
+    await asyncio.to_thread(sessions.append, session_id, question, answer)
+    task = asyncio.create_task(sessions.acompact(session_id, asummarize))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+# ------------------------------
+# Endpoints
+# ------------------------------
+async def chat(request):
+    question, use_web, session_id = await _read_question(request)
+    if not question:
+        return JSONResponse({"error": "Message vide"}, status_code=400)
+    session = await asyncio.to_thread(sessions.get, session_id)
+    session_id = session["id"]
+    try:
+        history = render_history(history_messages(session))
+        flight = flight_key(question, detect_lang(question), use_web, history)
+        (emb, results, context, sources), _ = await context_flight.do(flight, lambda: gather_context(question, use_web))
+        cached, key = await asyncio.to_thread(cache_lookup, question, emb, results,
+                                                cacheable=not history and not use_web)
+        if cached:
+            await remember(session_id, question, cached["answer"])
+            return JSONResponse({"answer": cached["answer"], "sources": list(set(sources)), "cached": True,
+                                 "session_id": session_id})
+        prompt = build_prompt(question, context, history)
+        with metrics.stage("generate"):
+            answer, shared = await answer_flight.do(flight, lambda: agenerate(prompt))
+        if key and not shared:
+            await asyncio.to_thread(answer_cache.put, emb, *key, answer, sources, question)
+        await remember(session_id, question, answer)
+        return JSONResponse({"answer": answer, "sources": list(set(sources)), "session_id": session_id})
+    except Exception as e:
+        print("Erreur:", e)
+        return JSONResponse({"answer": "Erreur serveur: " + str(e), "sources": [], "session_id": session_id})
+
+async def chat_stream(request):
+    question, use_web, session_id = await _read_question(request)
+    if not question:
+        return JSONResponse({"error": "Message vide"}, status_code=400)
+    session = await asyncio.to_thread(sessions.get, session_id)
+    session_id = session["id"]
+
+    async def generate():
+        try:
+            history = render_history(history_messages(session))
+            flight = flight_key(question, detect_lang(question), use_web, history)
+            (emb, results, context, sources), _ = await context_flight.do(flight, lambda: gather_context(question, use_web))
+            yield sse("sources", {"sources": list(set(sources)), "session_id": session_id})
+
+            cached, key = await asyncio.to_thread(cache_lookup, question, emb, results,
+                                                    cacheable=not history and not use_web)
+            if cached:
+                await remember(session_id, question, cached["answer"])
+                yield sse("delta", {"text": cached["answer"]})
+                yield sse("done", {"answer": cached["answer"], "cached": True, "session_id": session_id})
+                return
+
+            parts = []
+            t0 = time.perf_counter()
+            prompt = build_prompt(question, context, history)
+            # clients simultanés sur la même question : un seul flux OpenAI, relayé à chacun
+            deltas, shared = stream_flight.open(flight, lambda: astream_deltas(prompt))
+            async for delta in deltas:
+                if not parts:
+                    metrics.record("first_token", time.perf_counter() - t0)
+                parts.append(delta)
+                yield sse("delta", {"text": delta})
+            metrics.record("generate", time.perf_counter() - t0)
+            answer = "".join(parts)
+            if key and answer and not shared:
+                await asyncio.to_thread(answer_cache.put, emb, *key, answer, sources, question)
+            if answer:
+                await remember(session_id, question, answer)
+            done = {"answer": answer, "session_id": session_id}
+            trace = metrics.current_trace()
+            if trace is not None and metrics.TIMING_HEADER:
+                done["timing"] = trace.to_dict()  # les en-têtes sont déjà partis
+            yield sse("done", done)
+        except Exception as e:
+            print("Erreur stream:", e)
+            yield sse("error", {"error": "Erreur serveur: " + str(e)})
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def delete_session(request):
+    await asyncio.to_thread(sessions.delete, request.path_params["session_id"])
+    return Response(status_code=204)
+
+async def metrics_endpoint(request):
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+async def healthz(request):
+    return JSONResponse({"status": "ok"})
+
+async def readyz(request):
+    return JSONResponse(readiness.status(), status_code=200 if readiness.ready else 503)
+
+UNTRACED_PATHS = ("/metrics", "/healthz", "/readyz")
+
+class TimingMiddleware:
+    """Middleware ASGI pur : trace par requête (ContextVar), histogramme et en-tête X-Timing."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNTRACED_PATHS:
+            return await self.app(scope, receive, send)
+        trace = metrics.start_trace()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                metrics.finish_trace(trace, scope["path"], message["status"])
+                if metrics.TIMING_HEADER:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-timing", trace.header().encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+app = Starlette(
+    routes=[
+        Route("/api/chat", chat, methods=["POST"]),
+        Route("/api/chat/stream", chat_stream, methods=["POST"]),
+        Route("/api/session/{session_id}", delete_session, methods=["DELETE"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/readyz", readyz, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["X-Timing"]),
+        Middleware(TimingMiddleware),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -1,10 +1,20 @@
 # app_flask_backend.py
-import os
+import os, json, time
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-from openai import OpenAI
-from pinecone import Pinecone
+from vector_store import namespaces_version, VECTOR_BACKEND
+from embedding_cache import cached_embedding
+from answer_cache import SemanticAnswerCache, ANSWER_CACHE_ENABLED
+from neighbour_index import load_neighbour_index
+from namespace_fanout import search_namespaces, fan_out, merged_matches
+from batch_query import parse_questions, run_batch, BATCH_MAX_QUESTIONS, BATCH_MAX_TOP_K
+from web_enrichment import start_web, web_context, deadline_in
+from single_flight import SingleFlight, StreamFlight, flight_key
+from session_store import SessionStore, history_messages, render_history, openai_summarizer, compact_in_background
+import metrics
+from clients import Lazy, make_openai, make_index, warm_openai, warm_index, warm_local_caches, Readiness
+from chat_core import MODEL_EMB, MODEL_CHAT, detect_lang, build_prompt, packed_context, output_text
 
 # ------------------------------
 # Charger les variables d'environnement
@@ -15,46 +25,114 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENV = os.getenv("PINECONE_ENV")
 INDEX_NAME = os.getenv("PINECONE_INDEX", "aya-1536")  # ton index serverless
+INDEX_HOST = os.getenv("INDEX_HOST")                  # hôte direct (évite describe_index ; faux Pinecone de load_stubs.py)
+NAMESPACES = search_namespaces("")  # "" = namespace par défaut de l'index ; SEARCH_NAMESPACES pour le fan-out
 
+# Une clé manquante ne bloque plus l'import : l'erreur sort au warm-up et dans /readyz
 if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY non trouvé dans index_key.env")
-if not PINECONE_API_KEY:
-    raise ValueError("PINECONE_API_KEY non trouvé dans index_key.env")
-
-os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
+    print("[Config] OPENAI_API_KEY non trouvé dans index_key.env")
+elif not os.getenv("OPENAI_API_KEY"):
+    os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
+if not PINECONE_API_KEY and VECTOR_BACKEND != "local":
+    print("[Config] PINECONE_API_KEY non trouvé dans index_key.env")
 
 # ------------------------------
-# Flask et OpenAI
+# Flask et clients (paresseux : créés au warm-up ou au premier usage)
 # ------------------------------
 app = Flask(__name__)
-CORS(app)
-openai = OpenAI(api_key=OPENAI_API_KEY)
+CORS(app, expose_headers=["X-Timing"])
+openai = Lazy(lambda: make_openai(OPENAI_API_KEY), "openai")
 
-# ------------------------------
-# Pinecone v2 serverless
-# ------------------------------
-try:
-    pc = Pinecone(api_key=PINECONE_API_KEY, environment=PINECONE_ENV)
-    idx = pc.Index(INDEX_NAME)  # On se connecte directement à l'index existant
-    print("Index connecté :", INDEX_NAME)
-except Exception as e:
-    print("[Erreur Pinecone]", e)
-    idx = None  # Permet de continuer Flask même si l'index est inaccessible
+# Index vectoriel (Pinecone serverless ou index local, via VECTOR_BACKEND)
+idx = Lazy(lambda: make_index(PINECONE_API_KEY, INDEX_NAME, INDEX_HOST, environment=PINECONE_ENV), "index")
+
+# Cache sémantique des réponses, vidé dès qu'un des namespaces interrogés est ré-indexé
+answer_cache = SemanticAnswerCache(version_fn=lambda: namespaces_version(NAMESPACES))
+
+# Adjacence des chunks (chunks.csv), pour ajouter les voisins des hits sans requête de plus
+neighbours = load_neighbour_index(namespaces=NAMESPACES)
+
+# Sessions de conversation (historique compacté) ; SESSION_DB pour les partager entre workers
+sessions = SessionStore()
+summarize = openai_summarizer(openai, MODEL_CHAT)
+
+# Coalescence : la même question posée N fois en même temps = un retrieval et un appel LLM
+context_flight = SingleFlight("context")
+answer_flight = SingleFlight("generate", cross_process=True)   # COALESCE_DIR : aussi entre workers
+stream_flight = StreamFlight("generate_stream")
 
 # ------------------------------
 # Fonction pour récupérer le contexte
 # ------------------------------
+def retrieve(query, top_k=5, include_values=False):
+    """Renvoie (embedding de la question, résultats bruts de l'index)."""
+    with metrics.stage("embed"):
+        emb = cached_embedding(openai, MODEL_EMB, query)
+    with metrics.stage("vector_query"):
+        if len(NAMESPACES) == 1:
+            results = idx.query(vector=emb, top_k=top_k, include_metadata=True, include_values=include_values,
+                                namespace=NAMESPACES[0] or None)
+        else:
+            # une requête par namespace de langue, en parallèle, puis top-k fusionné
+            per_ns = fan_out(lambda ns: idx.query(vector=emb, top_k=top_k, include_metadata=True,
+                                                  include_values=include_values, namespace=ns), NAMESPACES)
+            results = merged_matches(per_ns, detect_lang(query), top_k)
+    return emb, results
+
 def retrieve_context(query, top_k=5):
-    emb = openai.embeddings.create(
-        model="text-embedding-3-small",
-        input=query
-    ).data[0].embedding
+    _, results = retrieve(query, top_k)
+    return packed_context(results, neighbours)
+
+def cache_lookup(question, emb, results, cacheable=True):
+    """Réponse en cache pour une question équivalente, et la clé (langue, ids) pour l'y ranger.
+
+    Clé None si la réponse dépend d'autre chose que des chunks (historique de session, contexte web).
+    """
+    if not ANSWER_CACHE_ENABLED or not cacheable:
+        return None, None
+    key = (detect_lang(question), [m['id'] for m in results['matches']])
+    return answer_cache.lookup(emb, *key), key
+
+def build_context(question, use_web):
+    """(embedding, résultats, contexte, sources). Avec `use_web`, la recherche web part avant le
+    retrieval et n'est attendue que jusqu'à WEB_BUDGET_MS ; au-delà, contexte DB seul."""
+    pending, deadline = (start_web(question), deadline_in()) if use_web else (None, None)
+    emb, results = retrieve(question, include_values=use_web)
+    web_lines = web_context(pending, deadline, [m['values'] for m in results['matches']]) if pending else []
+    # snippets web comptés dans le budget de tokens (part réservée, le reste pour la DB)
+    context, sources = packed_context(results, neighbours, web_lines)
+    return emb, results, context, sources
+
+def generate_answer(prompt):
+    response = openai.responses.create(
+        model=MODEL_CHAT,
+        input=prompt
+    )
+    metrics.usage_tokens(response)
+    return output_text(response)
+
+def stream_deltas(prompt):
+    """Deltas de texte d'une génération streamée (lue par le thread de StreamFlight)."""
+    stream = openai.responses.create(
+        model=MODEL_CHAT,
+        input=prompt,
+        stream=True
+    )
+    for event in stream:
+        if event.type == "response.output_text.delta":
+            yield event.delta
+        elif event.type == "response.completed":
+            metrics.usage_tokens(event.response)
+        elif event.type in ("response.failed", "error"):
+            raise RuntimeError(getattr(event, "message", None) or event.type)
 
-    results = idx.query(vector=emb, top_k=top_k, include_metadata=True)
-    docs = [match['metadata'].get('text', '') for match in results['matches']]
-    sources = [match['metadata'].get('source', '') for match in results['matches']]
-    context = "\n\n".join(docs)
-    return context, sources
+def session_history(session):
+    """Résumé + tours récents de la session, déjà sous budget de tokens, en texte."""
+    return render_history(history_messages(session))
+
+def remember(session_id, question, answer):
+    sessions.append(session_id, question, answer)
+    compact_in_background(sessions, session_id, summarize)
 
 # ------------------------------
 # Endpoint /api/chat
@@ -65,36 +143,204 @@ def chat():
     question = data.get("message", "").strip()
     if not question:
         return jsonify({"error": "Message vide"}), 400
+    use_web = bool(data.get("web", False))
+    session = sessions.get(data.get("session_id"))
+    session_id = session["id"]
 
     try:
-        context, sources = retrieve_context(question)
-
-        prompt = (
-            "You are an AI assistant. Answer the question using ONLY the information below. "
-            "Detect the language of the question automatically and respond in the same language.\n\n"
-            f"CONTEXT:\n{context}\n\n"
-            f"QUESTION: {question}"
-        )
-
-        response = openai.responses.create(
-            model="gpt-4o-mini",
-            input=prompt
-        )
+        history = session_history(session)
+        flight = flight_key(question, detect_lang(question), use_web, history)
+        (emb, results, context, sources), _ = context_flight.do(flight, lambda: build_context(question, use_web))
+        cached, key = cache_lookup(question, emb, results, cacheable=not history and not use_web)
+        if cached:
+            remember(session_id, question, cached["answer"])
+            return jsonify({"answer": cached["answer"], "sources": list(set(sources)), "cached": True,
+                            "session_id": session_id})
 
-        answer = getattr(response, "output_text", None)
-        if not answer:
-            answer = response.output[0].content[0].text
+        prompt = build_prompt(question, context, history)
+        with metrics.stage("generate"):
+            answer, shared = answer_flight.do(flight, lambda: generate_answer(prompt))
+        if key and not shared:
+            answer_cache.put(emb, *key, answer, sources, question)
+        remember(session_id, question, answer)
 
         return jsonify({
             "answer": answer,
-            "sources": list(set(sources))
+            "sources": list(set(sources)),
+            "session_id": session_id
         })
     except Exception as e:
         print("Erreur:", e)
-        return jsonify({"answer": "Erreur serveur: " + str(e), "sources": []})
+        return jsonify({"answer": "Erreur serveur: " + str(e), "sources": [], "session_id": session_id})
+
+# ------------------------------
+# Endpoint /api/chat/stream (Server-Sent Events)
+# Ordre des événements : sources -> delta* -> done (ou error)
+# ------------------------------
+def sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    data = request.json or {}
+    question = data.get("message", "").strip()
+    if not question:
+        return jsonify({"error": "Message vide"}), 400
+    use_web = bool(data.get("web", False))
+    session = sessions.get(data.get("session_id"))
+    session_id = session["id"]
+
+    trace = g.get("trace")
+
+    def generate():
+        # le générateur tourne après after_request : on y rattache la trace de la requête
+        metrics.attach(trace)
+        try:
+            history = session_history(session)
+            flight = flight_key(question, detect_lang(question), use_web, history)
+            (emb, results, context, sources), _ = context_flight.do(flight, lambda: build_context(question, use_web))
+            yield sse("sources", {"sources": list(set(sources)), "session_id": session_id})
+
+            cached, key = cache_lookup(question, emb, results, cacheable=not history and not use_web)
+            if cached:
+                remember(session_id, question, cached["answer"])
+                yield sse("delta", {"text": cached["answer"]})
+                yield sse("done", {"answer": cached["answer"], "cached": True, "session_id": session_id})
+                return
+
+            parts = []
+            t0 = time.perf_counter()
+            prompt = build_prompt(question, context, history)
+            # clients simultanés sur la même question : un seul flux OpenAI, relayé à chacun
+            deltas, shared = stream_flight.open(flight, lambda: stream_deltas(prompt))
+            for delta in deltas:
+                if not parts:
+                    metrics.record("first_token", time.perf_counter() - t0)
+                parts.append(delta)
+                yield sse("delta", {"text": delta})
+            metrics.record("generate", time.perf_counter() - t0)
+            answer = "".join(parts)
+            if key and answer and not shared:
+                answer_cache.put(emb, *key, answer, sources, question)
+            if answer:
+                remember(session_id, question, answer)
+            done = {"answer": answer, "session_id": session_id}
+            if trace is not None and metrics.TIMING_HEADER:
+                done["timing"] = trace.to_dict()  # les en-têtes sont déjà partis
+            yield sse("done", done)
+        except Exception as e:
+            print("Erreur stream:", e)
+            yield sse("error", {"error": "Erreur serveur: " + str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ------------------------------
+# Endpoint /api/chat/batch : JSONL de questions -> JSONL de réponses (en flux)
+# Corps : JSONL brut, ou JSON {"questions": [...], "top_k": 5}
+# ------------------------------
+@app.route("/api/chat/batch", methods=["POST"])
+def chat_batch():
+    data = request.get_json(silent=True)
+    try:
+        if isinstance(data, dict):
+            questions = data.get("questions", [])
+            if not isinstance(questions, list):
+                raise ValueError("questions doit être une liste")
+            items = parse_questions(json.dumps(q, ensure_ascii=False) for q in questions)
+            top_k = data.get("top_k", 5)
+        else:
+            items = parse_questions(request.get_data(as_text=True).splitlines())
+            top_k = request.args.get("top_k", 5)
+    except ValueError as e:
+        return jsonify({"error": f"Entrée invalide : {e}"}), 400
+    try:
+        top_k = int(top_k)
+    except (TypeError, ValueError):
+        top_k = 0
+    if top_k < 1:
+        return jsonify({"error": "top_k doit être un entier positif"}), 400
+    top_k = min(top_k, BATCH_MAX_TOP_K)
+    if not items:
+        return jsonify({"error": "Aucune question"}), 400
+    if len(items) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"Trop de questions (max {BATCH_MAX_QUESTIONS})"}), 413
+
+    def generate():
+        try:
+            for row in run_batch(items, openai, idx, NAMESPACES, top_k, neighbours=neighbours):
+                yield json.dumps(row, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print("Erreur batch:", e)
+            yield json.dumps({"error": "Erreur serveur: " + str(e)}, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ------------------------------
+# Endpoint /api/session/<id> : oublier une conversation ("nouvelle discussion")
+# ------------------------------
+@app.route("/api/session/<session_id>", methods=["DELETE"])
+def delete_session(session_id):
+    sessions.delete(session_id)
+    return "", 204
+
+# ------------------------------
+# Instrumentation : trace par requête, en-tête X-Timing, /metrics (Prometheus)
+# ------------------------------
+@app.before_request
+def start_trace():
+    g.trace = metrics.start_trace()
+
+@app.after_request
+def finish_trace(response):
+    trace = g.get("trace")
+    if trace is not None and request.endpoint not in ("metrics_endpoint", "healthz", "readyz"):
+        route = request.url_rule.rule if request.url_rule else "unknown"
+        metrics.finish_trace(trace, route, response.status_code)
+        if metrics.TIMING_HEADER:
+            response.headers["X-Timing"] = trace.header()
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# ------------------------------
+# Santé / readiness : /healthz = processus vivant, /readyz = warm-up terminé
+# ------------------------------
+def _warm_index():
+    warm_index(idx.get(), NAMESPACES)
+    print(f"Index connecté ({VECTOR_BACKEND}) :", INDEX_NAME)
+
+WARMUP_STEPS = [
+    ("openai", lambda: warm_openai(openai.get(), MODEL_EMB)),
+    ("index", _warm_index),
+    ("local_caches", warm_local_caches),
+]
+readiness = Readiness()
+
+@app.before_request
+def warm_up_worker():
+    # sous gunicorn, le warm-up part au démarrage du worker (gunicorn.conf.py, post_worker_init) ;
+    # ici, repli pour app.run / un autre serveur WSGI : au plus une fois par processus.
+    # Jamais à l'import : avec --preload, il aurait lieu dans le master et ne survivrait pas au fork
+    readiness.start_once(WARMUP_STEPS)
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    return jsonify(readiness.status()), (200 if readiness.ready else 503)
 
 # ------------------------------
 # Lancer le serveur Flask
 # ------------------------------
 if __name__ == "__main__":
+    readiness.start_once(WARMUP_STEPS)
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# auto_chunker.py — Découpage automatique par hiérarchie de sections, à taille en tokens fixe
+#
+# Alternative aux marqueurs [CHUNK:n] manuels : le texte est regroupé par
+# (section, subsection, subsubsection), puis redécoupé en chunks d'environ
+# --target tokens (tiktoken, même encodeur que upsert_openai_simple.py), en
+# coupant de préférence entre paragraphes. Les --overlap derniers tokens du
+# chunk précédent (même section) vont dans la colonne overlap_text, comme pour
+# les exporteurs. Sortie : même schéma CSV que chunks.csv.
+#
+# Usage: python auto_chunker.py --input aya_db_v1.docx [--out chunks_auto.csv]
+#                               [--target 400] [--overlap 60] [--report-only]
+
+import os, csv, sys, argparse
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List
+from chunk_parser import parse_file, write_chunks_csv
+from upsert_openai_simple import enc, count_tokens, TOKENS_PER_REQUEST_MAX
+
+TARGET_TOKENS  = 400
+OVERLAP_TOKENS = 60
+MIN_TOKENS     = 80    # un reliquat plus petit est fusionné au chunk précédent
+
+SECTION_KEYS = ("section", "subsection", "subsubsection")
+
+def read_records(path: str) -> Iterator[Dict]:
+    """Chunks d'entrée : CSV existant, ou DOCX/TXT balisé (via chunk_parser)."""
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+    else:
+        yield from parse_file(path)
+
+def _pack(paragraphs: List[List[int]], target: int) -> List[List[int]]:
+    """Regroupe des paragraphes (ids de tokens) en blocs <= target ; coupe les paragraphes trop longs."""
+    blocks, cur = [], []
+    for para in paragraphs:
+        while len(para) > target:          # paragraphe géant : découpe franche
+            if cur:
+                blocks.append(cur); cur = []
+            blocks.append(para[:target]); para = para[target:]
+        if cur and len(cur) + len(para) > target:
+            blocks.append(cur); cur = []
+        cur = cur + para
+    if cur:
+        blocks.append(cur)
+    return blocks
+
+def split_section(text: str, target: int = TARGET_TOKENS, min_tokens: int = MIN_TOKENS) -> List[List[int]]:
+    """Texte d'une section -> blocs de tokens de ~target, sans reliquat minuscule."""
+    lines = [ln for ln in text.split("\n") if ln.strip()]
+    # le "\n" de séparation est compté avec le paragraphe qu'il précède
+    paragraphs = [enc.encode(("\n" if i else "") + ln) for i, ln in enumerate(lines)]
+    blocks = _pack(paragraphs, target)
+    if len(blocks) > 1 and len(blocks[-1]) < min_tokens and len(blocks[-2]) + len(blocks[-1]) <= target + min_tokens:
+        blocks[-2] = blocks[-2] + blocks.pop()
+    return blocks
+
+def auto_chunk(records: Iterable[Dict], target: int = TARGET_TOKENS, overlap: int = OVERLAP_TOKENS,
+               id_prefix: str = "db_en", min_tokens: int = MIN_TOKENS) -> Iterator[Dict]:
+    """Regroupe les enregistrements consécutifs d'une même section et les redécoupe en chunks réguliers."""
+    if not 0 <= overlap < target:
+        raise ValueError("overlap doit être compris entre 0 et target")
+    n = 0
+    for key, group in groupby(records, key=lambda r: tuple(r.get(k, "") for k in SECTION_KEYS)):
+        group = list(group)
+        text = "\n".join(r["text"] for r in group if (r.get("text") or "").strip())
+        if not text:
+            continue
+        first = group[0]
+        prev: List[int] = []
+        for block in split_section(text, target, min_tokens):
+            n += 1
+            yield {
+                "id": f"{id_prefix}_ch{n:04d}",
+                "text": enc.decode(block).strip(),
+                "section": key[0], "subsection": key[1], "subsubsection": key[2],
+                "chunk_index": n,
+                "language": first.get("language", "en"),
+                "source": first.get("source", ""),
+                "overlap_text": enc.decode(prev[-overlap:]).strip() if prev and overlap else "",
+            }
+            prev = block
+
+# ================= RAPPORT =================
+def token_report(label: str, lengths: List[int]) -> str:
+    if not lengths:
+        return f"{label}: aucun chunk"
+    s = sorted(lengths)
+    pct = lambda p: s[min(len(s) - 1, int(p * len(s)))]
+    edges = [0, 100, 200, 400, 800, 1600, 3200, TOKENS_PER_REQUEST_MAX, float("inf")]
+    hist = []
+    for lo, hi in zip(edges, edges[1:]):
+        c = sum(1 for x in s if lo <= x < hi)
+        if c:
+            hist.append(f"    [{lo:>5}, {hi if hi != float('inf') else '∞':>5}) {c:>5} {'█' * max(1, 40 * c // len(s))}")
+    over = sum(1 for x in s if x > TOKENS_PER_REQUEST_MAX)
+    return "\n".join([
+        f"{label}: n={len(s)} min={s[0]} p50={pct(.5)} p90={pct(.9)} max={s[-1]} "
+        f"moyenne={sum(s)/len(s):.0f} tronqués(>{TOKENS_PER_REQUEST_MAX})={over}",
+        *hist,
+    ])
+
+def main():
+    ap = argparse.ArgumentParser(description="Chunking automatique par tokens (schéma chunks.csv)")
+    ap.add_argument("--input", default="aya_db_v1.docx", help=".docx/.txt balisé ou chunks.csv")
+    ap.add_argument("--out", default="chunks_auto.csv")
+    ap.add_argument("--target", type=int, default=TARGET_TOKENS)
+    ap.add_argument("--overlap", type=int, default=OVERLAP_TOKENS)
+    ap.add_argument("--min-tokens", type=int, default=MIN_TOKENS)
+    ap.add_argument("--id-prefix", default="db_en")
+    ap.add_argument("--report-only", action="store_true", help="n'écrit pas le CSV")
+    args = ap.parse_args()
+
+    if not os.path.exists(args.input):
+        print("❌ Fichier introuvable:", args.input)
+        sys.exit(1)
+
+    source = list(read_records(args.input))
+    chunks = list(auto_chunk(source, args.target, args.overlap, args.id_prefix, args.min_tokens))
+    print("TARS ▶ distribution des tokens (text)")
+    print(token_report("  marqueurs [CHUNK]", [count_tokens(r["text"]) for r in source]))
+    print(token_report(f"  auto (target={args.target}, overlap={args.overlap})", [count_tokens(r["text"]) for r in chunks]))
+    if not args.report_only:
+        n = write_chunks_csv(chunks, args.out)
+        print(f"TARS ✅ {n} chunks exportés -> {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 # backfill_text_metadata.py
 # Ajoute/maj metadata["text"] pour chaque id à partir du CSV (robuste BOM / multi-lignes)
+# Plus nécessaire pour les nouveaux upserts : upsert_openai_simple.py écrit déjà "text"
+# dans les métadonnées. Gardé pour les index remplis avant ce changement.
 
 import csv, time, sys, os
 from pinecone import Pinecone
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# batch_query.py — Réponses en lot : JSONL de questions -> JSONL de réponses (en flux)
+#
+# 1) embeddings de toutes les questions en quelques appels (cache d'abord, puis
+#    paquets sous TOKENS_PER_REQUEST_MAX via upsert_openai_simple.bucketize_by_tokens)
+# 2) retrieval : un seul produit matriciel avec l'index local (query_many), sinon
+#    requêtes Pinecone en parallèle (pool de threads)
+# 3) génération avec au plus BATCH_CONCURRENCY appels OpenAI simultanés ; chaque
+#    résultat est écrit dès qu'il est prêt (champ "index" = ligne d'origine)
+#
+# Entrée : une question par ligne, {"id": "...", "message": "..."} ou {"question": ...},
+# ou simplement une chaîne JSON / du texte brut.
+# Usage: python batch_query.py questions.jsonl [--out answers.jsonl] [--top-k 5] [--concurrency 8]
+# Aussi exposé par app_flask_backend.py : POST /api/chat/batch
+
+import os, sys, json, time, argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional
+from embedding_cache import get_cache
+from chat_core import MODEL_EMB, MODEL_CHAT, detect_lang, build_prompt, matches_to_context, output_text
+from namespace_fanout import merged_matches
+
+BATCH_CONCURRENCY: int = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_QUESTIONS: int = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_MAX_TOP_K: int = int(os.getenv("BATCH_MAX_TOP_K", "20"))   # top_k demandé ramené à 1..BATCH_MAX_TOP_K
+
+def parse_questions(lines: Iterable[str]) -> List[Dict]:
+    """Lignes JSONL (ou texte brut) -> [{"id", "question"}] ; lignes vides ignorées.
+
+    ValueError si une ligne JSON n'est ni un objet ni une chaîne, ou si sa question n'est pas une chaîne.
+    """
+    items = []
+    for n, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            obj = line
+        if isinstance(obj, str):
+            obj = {"question": obj}
+        if not isinstance(obj, dict):
+            raise ValueError(f"ligne {n + 1} : objet JSON ou texte attendu")
+        question = obj.get("question") or obj.get("message") or ""
+        if not isinstance(question, str):
+            raise ValueError(f"ligne {n + 1} : la question doit être une chaîne")
+        question = question.strip()
+        if question:
+            items.append({"id": obj.get("id", str(n + 1)), "question": question})
+    return items
+
+def embed_questions(client, questions: List[str]) -> List[List[float]]:
+    """Embeddings en lot : cache d'abord, puis un appel par paquet de tokens pour les absents."""
+    from upsert_openai_simple import bucketize_by_tokens
+    cache = get_cache()
+    out: List[Optional[List[float]]] = [cache.get(MODEL_EMB, q) for q in questions]
+    missing = list(dict.fromkeys(q for q, v in zip(questions, out) if v is None))
+    done: Dict[str, List[float]] = {}
+    pos = 0
+    for bucket in bucketize_by_tokens(missing):
+        resp = client.embeddings.create(model=MODEL_EMB, input=bucket)
+        for q, d in zip(missing[pos:pos + len(bucket)], resp.data):
+            cache.put(MODEL_EMB, q, d.embedding)
+            done[q] = d.embedding
+        pos += len(bucket)
+    return [v if v is not None else done[q] for q, v in zip(questions, out)]
+
+def query_all(idx, vectors: List[List[float]], top_k: int, namespaces: List[str],
+              langs: List[str], workers: int = BATCH_CONCURRENCY) -> List:
+    """Une réponse idx.query par vecteur ; fusion multi-namespace comme namespace_fanout."""
+    per_ns: Dict[str, List] = {}
+    for ns in namespaces:
+        if hasattr(idx, "query_many"):
+            per_ns[ns] = idx.query_many(vectors, top_k=top_k, include_metadata=True, namespace=ns or None)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                per_ns[ns] = list(pool.map(
+                    lambda v: idx.query(vector=v, top_k=top_k, include_metadata=True, namespace=ns or None), vectors))
+    return [merged_matches({ns: per_ns[ns][i] for ns in namespaces}, langs[i], top_k) for i in range(len(vectors))]
+
+def run_batch(items: List[Dict], client, idx, namespaces: List[str], top_k: int = 5,
+              concurrency: int = BATCH_CONCURRENCY, neighbours=None) -> Iterator[Dict]:
+    """Génère un résultat par question, dans l'ordre de fin (champ "index" pour retrouver l'ordre)."""
+    if not items:
+        return
+    questions = [it["question"] for it in items]
+    t0 = time.perf_counter()
+    vectors = embed_questions(client, questions)
+    results = query_all(idx, vectors, top_k, namespaces, [detect_lang(q) for q in questions], concurrency)
+    retrieval_ms = (time.perf_counter() - t0) * 1000 / len(items)
+
+    def answer_one(i: int) -> Dict:
+        t = time.perf_counter()
+        context, sources = matches_to_context(results[i], neighbours=neighbours)
+        response = client.responses.create(model=MODEL_CHAT, input=build_prompt(questions[i], context))
+        return {"answer": output_text(response), "sources": list(dict.fromkeys(sources)),
+                "generation_ms": round((time.perf_counter() - t) * 1000, 1)}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(answer_one, i): i for i in range(len(items))}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            row = {"index": i, "id": items[i]["id"], "question": questions[i],
+                   "retrieval_ms": round(retrieval_ms, 1)}
+            try:
+                row.update(fut.result())
+            except Exception as e:
+                row.update({"answer": None, "sources": [], "error": str(e)})
+            yield row
+
+def main():
+    ap = argparse.ArgumentParser(description="Réponses en lot (JSONL -> JSONL)")
+    ap.add_argument("input", help="fichier JSONL de questions ('-' = stdin)")
+    ap.add_argument("--out", default="-", help="fichier JSONL de sortie ('-' = stdout)")
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    args = ap.parse_args()
+
+    from dotenv import load_dotenv
+    from openai import OpenAI
+    from vector_store import open_index
+    from namespace_fanout import search_namespaces
+    from neighbour_index import load_neighbour_index
+    load_dotenv("index_key.env")
+    client = OpenAI()
+    idx = open_index(api_key=os.getenv("PINECONE_API_KEY"), name=os.getenv("PINECONE_INDEX", "aya-1536"),
+                     host=os.getenv("INDEX_HOST"), environment=os.getenv("PINECONE_ENV"))
+
+    src = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8-sig")
+    with src:
+        items = parse_questions(src)
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    t0, errors = time.perf_counter(), 0
+    try:
+        namespaces = search_namespaces("")
+        for row in run_batch(items, client, idx, namespaces, args.top_k, args.concurrency,
+                             load_neighbour_index(namespaces=namespaces)):
+            errors += "error" in row
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"TARS ✅ {len(items)} questions en {time.perf_counter() - t0:.1f}s, erreurs={errors}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# bench_chunk_parser.py — Parité + benchmark : chunk_parser (1 passe, flux) vs ancien parseur regex
+# Usage: python bench_chunk_parser.py [--docx aya_db_v1.docx] [--csv chunks.csv] [--scale 50]
+#   1) parité : les chunks de --docx doivent être identiques à ceux de --csv
+#   2) bench  : temps des deux parseurs sur le document répété --scale fois
+
+import re, csv, sys, time, argparse, tempfile, os
+from chunk_parser import parse_file, iter_docx_lines, iter_chunks, FIELDS
+
+# ---- ancien parseur (export_chunks.py avant chunk_parser), gardé comme référence ----
+CHUNK_RE    = re.compile(r"\[\s*CHUNK\s*[:\-]?\s*(\d+)\s*\](.*?)(?=\[\s*CHUNK\s*[:\-]?\s*\d+\s*\]|$)", re.DOTALL|re.IGNORECASE)
+TAG_VAL     = lambda tag: re.compile(r"\[\s*"+tag+r"\s*:\s*(.*?)\]", re.DOTALL|re.IGNORECASE)
+OVERLAP_RE  = re.compile(r"\[\s*OVERLAP\s*\](.*?)\[\s*/\s*OVERLAP\s*\]", re.DOTALL|re.IGNORECASE)
+
+def legacy_parse(data, id_prefix="db_en", language="en", source=""):
+    data = (data.replace("⟦","[").replace("⟧","]")
+                .replace("[[","[").replace("]]","]")
+                .replace("\r\n","\n").replace("\r","\n"))
+    rows = []
+    for num_str, block in CHUNK_RE.findall(data):
+        def grab(tag):
+            m = TAG_VAL(tag).search(block);  return m.group(1).strip() if m else ""
+        m_overlap = OVERLAP_RE.search(block)
+        temp = TAG_VAL("SECTION").sub("", block)
+        temp = TAG_VAL("SUBSECTION").sub("", temp)
+        temp = TAG_VAL("SUBSUBSECTION").sub("", temp)
+        temp = OVERLAP_RE.sub("", temp)
+        rows.append({
+            "id": f"{id_prefix}_ch{int(num_str):04d}",
+            "text": "\n".join(ln.strip() for ln in temp.strip().split("\n") if ln.strip()),
+            "section": grab("SECTION"), "subsection": grab("SUBSECTION"), "subsubsection": grab("SUBSUBSECTION"),
+            "chunk_index": int(num_str.lstrip("0") or "0"), "language": language, "source": source,
+            "overlap_text": m_overlap.group(1).strip() if m_overlap else "",
+        })
+    return rows
+
+def check_parity(docx_path, csv_path):
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        expected = [{k: r[k] for k in FIELDS} for r in csv.DictReader(f)]
+    source = expected[0]["source"] if expected else os.path.basename(docx_path)
+    got = [{k: str(v) for k, v in r.items()} for r in parse_file(docx_path, source=source)]
+    if len(got) != len(expected):
+        print(f"TARS ❌ parité: {len(got)} chunks vs {len(expected)} dans {csv_path}")
+        return False
+    for g, e in zip(got, expected):
+        if g != e:
+            diff = [k for k in FIELDS if g[k] != e[k]]
+            print(f"TARS ❌ parité: {e['id']} diffère sur {diff}")
+            return False
+    print(f"TARS ✅ parité: {len(got)} chunks identiques à {csv_path}")
+    return True
+
+def bench(docx_path, scale):
+    lines = list(iter_docx_lines(docx_path))
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8", delete=False) as f:
+        for _ in range(scale):
+            f.write("\n".join(lines)); f.write("\n")
+        big = f.name
+    try:
+        size = os.path.getsize(big) / 1e6
+        t0 = time.perf_counter()
+        with open(big, "r", encoding="utf-8") as f:
+            n_old = len(legacy_parse(f.read()))
+        t_old = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        n_new = sum(1 for _ in parse_file(big, encoding="utf-8"))
+        t_new = time.perf_counter() - t0
+    finally:
+        os.remove(big)
+    print(f"TARS ▶ bench x{scale} ({size:.1f} Mo, {n_new} chunks)")
+    print(f"  regex (ancien) : {t_old*1000:8.1f} ms")
+    print(f"  1 passe (flux) : {t_new*1000:8.1f} ms   ({t_old/max(t_new,1e-9):.1f}x)")
+    return n_old == n_new
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docx", default="aya_db_v1.docx")
+    ap.add_argument("--csv", default="chunks.csv")
+    ap.add_argument("--scale", type=int, default=50)
+    args = ap.parse_args()
+    ok = check_parity(args.docx, args.csv)
+    ok &= bench(args.docx, args.scale)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# bench_hybrid.py — Rappel@k et latence : vecteur seul vs BM25 seul vs hybride (RRF)
+# Usage: python bench_hybrid.py [--csv chunks.csv] [--k 5] [--offline]
+#
+# Requêtes étiquetées générées depuis chunks.csv :
+#   - "titre" : le titre de section le plus précis -> pertinents = chunks de ce titre
+#   - "termes": les 3 mots les plus rares d'un chunk  -> pertinent = ce chunk
+# Les vecteurs des chunks viennent de l'index local (upsert avec WRITE_LOCAL_INDEX=1)
+# ou, à défaut, sont calculés via le cache d'embeddings (OPENAI_API_KEY requis).
+# --offline remplace les embeddings par un sac de mots haché : utile pour tester
+# le harnais sans réseau, mais les chiffres "vecteur" ne sont PAS représentatifs.
+
+import os, csv, sys, time, zlib, argparse
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+import numpy as np
+from bm25_index import BM25Index, rrf_fuse, tokenize
+from vector_store import load_local_index, DEFAULT_NAMESPACE
+
+MODEL_EMB = "text-embedding-3-small"
+STUB_DIM = 512
+
+def stub_embed(texts: List[str]) -> np.ndarray:
+    """Embedding hors-ligne : sac de mots haché (crc32), normalisé."""
+    out = np.zeros((len(texts), STUB_DIM), dtype=np.float32)
+    for i, t in enumerate(texts):
+        for w in tokenize(t):
+            out[i, zlib.crc32(w.encode("utf-8")) % STUB_DIM] += 1.0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return np.divide(out, norms, out=np.zeros_like(out), where=norms > 0)
+
+def real_embed(texts: List[str]) -> np.ndarray:
+    from openai import OpenAI
+    from embedding_cache import cached_embeddings
+    mat = np.asarray(cached_embeddings(OpenAI(), MODEL_EMB, texts), dtype=np.float32)
+    return mat / np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-12)
+
+def make_queries(rows: List[Dict], terms_per_query: int = 3) -> List[Tuple[str, str, Set[str]]]:
+    by_title: Dict[str, Set[str]] = {}
+    for r in rows:
+        title = r.get("subsubsection") or r.get("subsection") or r.get("section") or ""
+        if title:
+            by_title.setdefault(title, set()).add(r["id"])
+    queries = [("titre", t, ids) for t, ids in by_title.items()]
+
+    df = Counter(w for r in rows for w in set(tokenize(r["text"])))
+    for r in rows:
+        words = [w for w in set(tokenize(r["text"])) if len(w) > 3 and not w.isdigit()]
+        rare = sorted(words, key=lambda w: (df[w], w))[:terms_per_query]
+        if len(rare) == terms_per_query:
+            queries.append(("termes", " ".join(rare), {r["id"]}))
+    return queries
+
+def recall(ranked: List[str], relevant: Set[str], k: int) -> float:
+    return len(set(ranked[:k]) & relevant) / min(len(relevant), k)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--csv", default="chunks.csv")
+    ap.add_argument("--namespace", default=DEFAULT_NAMESPACE)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--offline", action="store_true", help="embeddings factices (pas d'appel OpenAI)")
+    args = ap.parse_args()
+
+    with open(args.csv, "r", encoding="utf-8-sig", newline="") as f:
+        rows = [r for r in csv.DictReader(f) if (r.get("text") or "").strip()]
+    ids = [r["id"] for r in rows]
+    queries = make_queries(rows)
+    embed = stub_embed if args.offline else real_embed
+
+    local = None if args.offline else load_local_index(args.namespace)
+    if local is not None and set(local[0]) >= set(ids):
+        pos = {vid: i for i, vid in enumerate(local[0])}
+        doc_mat = np.asarray(local[1][[pos[i] for i in ids]], dtype=np.float32)
+    else:
+        doc_mat = embed([r["text"] for r in rows])
+    query_mat = embed([q for _, q, _ in queries])
+    bm25 = BM25Index.build(ids, rows)
+    pool = args.k * 2  # même profondeur que rag_chat.search
+
+    def vector(i: int) -> List[str]:
+        scores = doc_mat @ query_mat[i]
+        return [ids[j] for j in np.argsort(-scores, kind="stable")[:pool]]
+
+    def lexical(i: int) -> List[str]:
+        return [d for d, _ in bm25.search(queries[i][1], pool)]
+
+    def hybrid(i: int) -> List[str]:
+        return [d for d, _ in rrf_fuse([vector(i), lexical(i)])]
+
+    label = "stub hors-ligne (vecteur NON représentatif)" if args.offline else MODEL_EMB
+    print(f"TARS ▶ {len(queries)} requêtes, {len(ids)} chunks, k={args.k}, embeddings: {label}")
+    print(f"{'retriever':>10} {'rappel@k titre':>15} {'rappel@k termes':>16} {'global':>8} {'ms/requête':>11}")
+    for name, fn in (("vecteur", vector), ("bm25", lexical), ("hybride", hybrid)):
+        per_kind: Dict[str, List[float]] = {"titre": [], "termes": []}
+        t0 = time.perf_counter()
+        for i, (kind, _, relevant) in enumerate(queries):
+            per_kind[kind].append(recall(fn(i), relevant, args.k))
+        ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        mean = lambda xs: sum(xs) / len(xs) if xs else 0.0
+        overall = mean(per_kind["titre"] + per_kind["termes"])
+        print(f"{name:>10} {mean(per_kind['titre']):>15.3f} {mean(per_kind['termes']):>16.3f} {overall:>8.3f} {ms:>11.3f}")
+    print("TARS ✅ latences hors embedding de la requête (identique pour vecteur et hybride)")
+
+if __name__ == "__main__":
+    main()
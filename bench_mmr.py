@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# bench_mmr.py — Compare l'ancien MMR pur Python et rag_chat.mmr_select (NumPy)
+# Usage: python bench_mmr.py [--dim 1536] [--k 5] [--repeat 3]
+# Vérifie aussi que les deux versions renvoient exactement les mêmes sélections.
+
+import os, sys, time, math, random, argparse
+
+# rag_chat se configure à l'import : index local paresseux, pas de réseau
+os.environ.setdefault("VECTOR_BACKEND", "local")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+from rag_chat import mmr_select, MMR_LAMBDA
+
+POOL_SIZES = (10, 100, 1000)
+
+def _cos(u, v):
+    if not u or not v: return 0.0
+    du = math.sqrt(sum(x*x for x in u))
+    dv = math.sqrt(sum(y*y for y in v))
+    if du == 0 or dv == 0: return 0.0
+    return sum(x*y for x, y in zip(u, v)) / (du*dv)
+
+def mmr_select_legacy(cands, k, lam=MMR_LAMBDA):
+    """Implémentation d'origine (boucle imbriquée + _cos), gardée comme référence."""
+    selected, rest = [], [c for c in cands if c.get("values")]
+    if not rest: return cands[:k]
+    rest.sort(key=lambda x: x["score"], reverse=True)
+    selected.append(rest.pop(0))
+    while rest and len(selected) < k:
+        best, best_val = None, -1e9
+        for c in rest:
+            sim_to_sel = max(_cos(c["values"], s["values"]) for s in selected)
+            val = lam*c["score"] - (1-lam)*sim_to_sel
+            if val > best_val:
+                best_val, best = val, c
+        selected.append(best)
+        rest.remove(best)
+    return selected
+
+def make_pool(n, dim, rng):
+    # quelques quasi-doublons pour que la diversité compte vraiment
+    base = [[rng.gauss(0, 1) for _ in range(dim)] for _ in range(max(1, n // 4))]
+    pool = []
+    for i in range(n):
+        b = base[i % len(base)]
+        pool.append({"id": f"c{i}", "score": rng.uniform(0.2, 0.9),
+                     "values": [x + rng.gauss(0, 0.3) for x in b]})
+    return pool
+
+def timed(fn, pool, k, repeat):
+    best = float("inf"); out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn([dict(c) for c in pool], k)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"TARS ▶ MMR bench dim={args.dim} k={args.k} lambda={MMR_LAMBDA}")
+    print(f"{'pool':>6} {'legacy (ms)':>12} {'numpy (ms)':>12} {'speedup':>8}  parité")
+    ok = True
+    for n in POOL_SIZES:
+        pool = make_pool(n, args.dim, rng)
+        t_old, sel_old = timed(mmr_select_legacy, pool, args.k, args.repeat)
+        t_new, sel_new = timed(mmr_select, pool, args.k, args.repeat)
+        same = [c["id"] for c in sel_old] == [c["id"] for c in sel_new]
+        ok &= same
+        print(f"{n:>6} {t_old*1000:>12.2f} {t_new*1000:>12.2f} {t_old/max(t_new,1e-9):>7.1f}x  {'OK' if same else 'DIFF'}")
+    if not ok:
+        print("TARS ❌ sélections différentes entre legacy et numpy")
+        sys.exit(1)
+    print("TARS ✅ sélections identiques")
+
+if __name__ == "__main__":
+    main()
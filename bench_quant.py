@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# bench_quant.py — Compromis précision / mémoire des niveaux de vector_codes (float16, int8, binaire)
+#
+# Pour chaque niveau : octets par vecteur, gain mémoire, cosinus de reconstruction,
+# erreur sur les similarités entre candidats (ce que voit le MMR) et accord de la
+# sélection rag_chat.mmr_select avec celle calculée en float32. Affiche aussi la
+# taille JSON d'une réponse de requête avec et sans include_values.
+#
+# Requêtes : vecteurs du corpus bruités (pas d'appel d'embedding).
+# Usage: python bench_quant.py [--source index|csv|random] [--n 20000 --dim 1536] [--k 5] [--queries 200]
+
+import os, csv, json, time, argparse
+import numpy as np
+
+# rag_chat se configure à l'import : index local paresseux, pas de réseau
+os.environ.setdefault("VECTOR_BACKEND", "local")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+from rag_chat import mmr_select
+from vector_codes import VectorCodes, QUANT_LEVELS
+
+def load_corpus(args) -> np.ndarray:
+    if args.source == "index":
+        from vector_store import load_local_index, DEFAULT_NAMESPACE
+        loaded = load_local_index(args.namespace or DEFAULT_NAMESPACE)
+        if loaded is None:
+            raise SystemExit("❌ Index local introuvable (VECTOR_BACKEND=local python upsert_openai_simple.py)")
+        return np.asarray(loaded[1], dtype=np.float32)
+    if args.source == "csv":
+        from bench_hybrid import stub_embed
+        with open(args.csv, "r", encoding="utf-8-sig", newline="") as f:
+            texts = [r["text"] for r in csv.DictReader(f) if (r.get("text") or "").strip()]
+        return np.asarray(stub_embed(texts), dtype=np.float32)
+    # corpus synthétique : groupes de quasi-doublons, comme des chunks qui se recouvrent
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((max(1, args.n // 8), args.dim)).astype(np.float32)
+    mat = centers[rng.integers(0, len(centers), args.n)] + 0.5 * rng.standard_normal((args.n, args.dim)).astype(np.float32)
+    return mat / np.linalg.norm(mat, axis=1, keepdims=True)
+
+def payload_bytes(depth: int, dim: int, with_values: bool) -> int:
+    """Taille JSON approximative d'une réponse query Pinecone (ids, scores, métadonnées courtes)."""
+    rng = np.random.default_rng(0)
+    matches = [{"id": f"doc-{i:08d}", "score": 0.8123456, "metadata": {"text": "x" * 600, "section": "Section"},
+                **({"values": rng.standard_normal(dim).astype(np.float32).tolist()} if with_values else {})}
+               for i in range(depth)]
+    return len(json.dumps({"matches": matches, "namespace": "en_v1"}))
+
+def main():
+    ap = argparse.ArgumentParser(description="Précision vs mémoire des vecteurs quantifiés (MMR)")
+    ap.add_argument("--source", choices=("index", "csv", "random"), default="random")
+    ap.add_argument("--namespace", default="")
+    ap.add_argument("--csv", default="chunks.csv")
+    ap.add_argument("--n", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    mat = load_corpus(args)
+    mat = mat / np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-12)
+    n, dim = mat.shape
+    depth = args.k * 2   # taille du pool de candidats de rag_chat.search
+    rng = np.random.default_rng(args.seed)
+    # bruit de norme ~0.5 : la requête ressemble à un chunk sans en être la copie
+    noise = rng.standard_normal((args.queries, dim)).astype(np.float32) * (0.5 / np.sqrt(dim))
+    queries = mat[rng.integers(0, n, args.queries)] + noise
+    scores = queries @ mat.T
+    pools = np.argsort(-scores, axis=1)[:, :depth]
+    ids = [str(i) for i in range(n)]
+
+    print(f"TARS ▶ {n} vecteurs × {dim} dims, {args.queries} requêtes, pool {depth}, MMR k={args.k}")
+    print(f"  {'niveau':<8} {'o/vect':>7} {'gain':>5} {'Mo':>8} {'cos rec.':>9} {'|Δsim| moy':>10} {'|Δsim| p99':>10} "
+          f"{'MMR même ens.':>13} {'MMR même ordre':>14} {'décodage µs':>11}")
+    for level in QUANT_LEVELS:
+        codes = VectorCodes.build(ids, mat, level)
+        t0 = time.perf_counter()
+        for pool in pools:
+            codes.lookup([ids[i] for i in pool])
+        lookup_us = (time.perf_counter() - t0) / len(pools) * 1e6
+        sample = ids[:2000]
+        found = codes.lookup(sample)
+        dec, ref = np.stack([found[i] for i in sample]), mat[:len(sample)]
+        rec = np.sum(dec * ref, axis=1) / np.maximum(np.linalg.norm(dec, axis=1), 1e-12)
+
+        errs, same_set, same_order = [], 0, 0
+        for qi, pool in enumerate(pools):
+            exact = mat[pool]
+            found = codes.lookup([ids[i] for i in pool])
+            approx = np.stack([found[ids[i]] for i in pool])
+            approx = approx / np.maximum(np.linalg.norm(approx, axis=1, keepdims=True), 1e-12)
+            errs.append(np.abs(exact @ exact.T - approx @ approx.T).ravel())
+            cands = [{"id": ids[i], "score": float(scores[qi, i])} for i in pool]
+            a = [c["id"] for c in mmr_select([dict(c, values=exact[j]) for j, c in enumerate(cands)], args.k)]
+            b = [c["id"] for c in mmr_select([dict(c, values=approx[j]) for j, c in enumerate(cands)], args.k)]
+            same_set += set(a) == set(b)
+            same_order += a == b
+        errs = np.concatenate(errs)
+        per_vec = codes.nbytes / n
+        print(f"  {level:<8} {per_vec:>7.0f} {mat.nbytes / codes.nbytes:>4.1f}× {codes.nbytes / 1e6:>8.2f} "
+              f"{rec.mean():>9.4f} {errs.mean():>10.5f} {np.percentile(errs, 99):>10.5f} "
+              f"{same_set / len(pools):>13.1%} {same_order / len(pools):>14.1%} {lookup_us:>11.1f}")
+
+    with_v, without_v = payload_bytes(depth, dim, True), payload_bytes(depth, dim, False)
+    print(f"  réponse query (top_k={depth}) : {with_v / 1024:.1f} Ko avec values, {without_v / 1024:.1f} Ko sans "
+          f"({with_v / without_v:.1f}×)")
+
+if __name__ == "__main__":
+    main()
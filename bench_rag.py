@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# bench_rag.py — Banc qualité + latence du pipeline rag_chat, hors-ligne et reproductible
+#
+# Jeu étiqueté question -> ids de chunks attendus, tiré de chunks.csv (voir
+# bench_hybrid.make_queries) ou fourni en JSONL {"question", "expected_ids"}.
+# Mesure recall@k, MRR et p50/p95/p99 par étape (embed, vector_query, bm25, mmr,
+# prompt_build, generate, total) en appelant les vraies fonctions de rag_chat.
+#
+# Rien ne sort sur le réseau : index local temporaire + client OpenAI factice.
+#   --embeddings stub     sac de mots haché (défaut ; qualité "vecteur" non représentative)
+#   --record F.npz        calcule une fois les vrais embeddings (chunks + questions) et les enregistre
+#   --fixtures F.npz      rejoue ces embeddings enregistrés (hors-ligne, chiffres réalistes)
+# La génération est simulée (--gen-latency-ms) : on mesure notre code, pas gpt-4o-mini.
+#
+# Rerank LLM (llm_rerank, USE_LLM_RERANK) :
+#   --rerank stub         notes par recouvrement de termes question/passage (hors-ligne, qualité indicative)
+#   --rerank record       notes du vrai modèle, enregistrées dans --rerank-fixtures (un appel par question)
+#   --rerank fixtures     rejoue ces notes (hors-ligne, chiffres réalistes pour les mêmes embeddings)
+#   --rerank-latency-ms / --rerank-budget-ms : latence simulée du noteur vs budget (repli MMR)
+# Comparer avec/sans : python bench_rag.py --out off.json ; python bench_rag.py --rerank stub --compare off.json
+#
+# Usage: python bench_rag.py [--k 5] [--repeat 3] [--out bench_results.json] [--compare ancien.json]
+
+import os, sys, csv, json, time, hashlib, tempfile, argparse
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+STAGES = ("embed", "vector_query", "bm25", "mmr", "rerank", "prompt_build", "generate", "total")
+
+# ================= FAUX CLIENT OPENAI =================
+class _Obj:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class StubOpenAI:
+    """Juste ce que rag_chat utilise : embeddings.create et chat.completions.create (+ notes du rerank)."""
+
+    def __init__(self, embed_fn: Callable[[List[str]], np.ndarray], gen_latency_ms: float = 0.0,
+                 grader: Optional[Callable[[List[Dict]], str]] = None, grade_latency_ms: float = 0.0):
+        self.embed_fn = embed_fn
+        self.gen_latency = gen_latency_ms / 1000.0
+        self.grader, self.grade_latency = grader, grade_latency_ms / 1000.0
+        self.embeddings = _Obj(create=self._embed)
+        self.chat = _Obj(completions=_Obj(create=self._complete))
+
+    def _embed(self, model: str, input, **_):
+        texts = [input] if isinstance(input, str) else list(input)
+        vecs = self.embed_fn(texts)
+        return _Obj(data=[_Obj(embedding=v.tolist(), index=i) for i, v in enumerate(vecs)])
+
+    def _complete(self, model: str, messages: List[Dict], response_format=None, **_):
+        if response_format is not None and self.grader is not None:
+            if self.grade_latency:
+                time.sleep(self.grade_latency)
+            return _Obj(choices=[_Obj(message=_Obj(content=self.grader(messages)))], usage=None)
+        if self.gen_latency:
+            time.sleep(self.gen_latency)
+        ctx = messages[-1]["content"]
+        return _Obj(choices=[_Obj(message=_Obj(content=ctx[:200]))])
+
+class FixtureEmbeddings:
+    """Embeddings enregistrés (npz : texts en JSON + matrice) ; une absence est une erreur explicite."""
+
+    def __init__(self, path: str):
+        with np.load(path) as z:
+            texts = json.loads(str(z["texts"]))
+            self.mat = np.asarray(z["vectors"], dtype=np.float32)
+        self.pos = {t: i for i, t in enumerate(texts)}
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        missing = [t for t in texts if t not in self.pos]
+        if missing:
+            raise KeyError(f"{len(missing)} texte(s) absent(s) des fixtures, relancer avec --record: {missing[0][:60]!r}")
+        return self.mat[[self.pos[t] for t in texts]]
+
+def record_fixtures(path: str, texts: List[str], model: str) -> None:
+    from openai import OpenAI
+    from upsert_openai_simple import bucketize_by_tokens
+    client, uniq, vecs = OpenAI(), list(dict.fromkeys(texts)), []
+    for bucket in bucketize_by_tokens(uniq):
+        vecs.extend(d.embedding for d in client.embeddings.create(model=model, input=bucket).data)
+    np.savez(path, texts=np.asarray(json.dumps(uniq, ensure_ascii=False)), vectors=np.asarray(vecs, dtype=np.float32))
+    print(f"TARS ✅ {len(uniq)} embeddings enregistrés -> {path}")
+
+# ================= NOTES DU RERANK =================
+def _grade_key(messages: List[Dict]) -> str:
+    return hashlib.sha256(messages[-1]["content"].encode("utf-8")).hexdigest()
+
+def lexical_grader(messages: List[Dict]) -> str:
+    """Noteur hors-ligne : part des termes de la question présents dans chaque passage, sur 10."""
+    from bench_hybrid import tokenize
+    head, _, body = messages[-1]["content"].partition("\n\nPassages:\n")
+    q_terms = set(tokenize(head[len("Question: "):]))
+    scores = []
+    for block in body.split("\n\n"):
+        pid, _, text = block.partition("] ")
+        overlap = len(q_terms & set(tokenize(text))) / max(len(q_terms), 1)
+        scores.append({"id": int(pid.lstrip("[")), "score": round(10 * overlap)})
+    return json.dumps({"scores": scores})
+
+class FixtureGrader:
+    """Notes enregistrées (--rerank record), par hash du prompt de notation."""
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            self.answers: Dict[str, str] = json.load(f)
+
+    def __call__(self, messages: List[Dict]) -> str:
+        key = _grade_key(messages)
+        if key not in self.answers:
+            raise KeyError("prompt de rerank absent des fixtures (pool différent ?), relancer avec --rerank record")
+        return self.answers[key]
+
+class RecordingGrader:
+    """Vrai modèle (mêmes paramètres que llm_rerank), réponses gardées pour save()."""
+
+    def __init__(self, path: str):
+        from openai import OpenAI
+        self.path, self.client, self.answers = path, OpenAI(), {}
+
+    def __call__(self, messages: List[Dict]) -> str:
+        from llm_rerank import RERANK_MODEL, SCHEMA
+        r = self.client.chat.completions.create(model=RERANK_MODEL, temperature=0, messages=messages,
+                                                response_format={"type": "json_schema", "json_schema": SCHEMA})
+        self.answers[_grade_key(messages)] = r.choices[0].message.content
+        return self.answers[_grade_key(messages)]
+
+    def save(self) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.answers, f)
+        print(f"TARS ✅ {len(self.answers)} notes de rerank enregistrées -> {self.path}")
+
+# ================= CHRONOS =================
+class StageTimer:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {s: [] for s in STAGES}
+
+    def wrap(self, stage: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.samples[stage].append((time.perf_counter() - t0) * 1000)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for stage, xs in self.samples.items():
+            if xs:
+                a = np.asarray(xs)
+                out[stage] = {"n": len(xs), "mean": round(float(a.mean()), 4),
+                              **{f"p{p}": round(float(np.percentile(a, p)), 4) for p in (50, 95, 99)}}
+        return out
+
+class _TimedIndex:
+    def __init__(self, idx, timer: StageTimer):
+        self._idx = idx
+        self.query = timer.wrap("vector_query", idx.query)
+
+    def __getattr__(self, name):
+        return getattr(self._idx, name)
+
+# ================= QUALITÉ =================
+def load_questions(path: Optional[str], rows: List[Dict]) -> List[Dict]:
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    from bench_hybrid import make_queries
+    return [{"question": q, "expected_ids": sorted(ids), "kind": kind} for kind, q, ids in make_queries(rows)]
+
+def recall_at_k(ranked: List[str], expected: List[str], k: int) -> float:
+    return len(set(ranked[:k]) & set(expected)) / min(len(expected), k)
+
+def reciprocal_rank(ranked: List[str], expected: List[str]) -> float:
+    for r, doc_id in enumerate(ranked, 1):
+        if doc_id in expected:
+            return 1.0 / r
+    return 0.0
+
+def compare(current: Dict, previous_path: str) -> None:
+    with open(previous_path, "r", encoding="utf-8") as f:
+        prev = json.load(f)
+    print(f"\nTARS ▶ comparaison avec {previous_path}")
+    for key in ("recall_at_k", "mrr"):
+        a, b = prev["quality"][key], current["quality"][key]
+        print(f"  {key:<14} {a:.3f} -> {b:.3f} ({b - a:+.3f})")
+    for key in ("hits_mean", "prompt_tokens_mean"):
+        a, b = prev.get("context", {}).get(key), current["context"][key]
+        if a is not None:
+            print(f"  {key:<18} {a:.1f} -> {b:.1f} ({b - a:+.1f})")
+    for stage in STAGES:
+        a, b = prev["latency_ms"].get(stage), current["latency_ms"].get(stage)
+        if a and b:
+            print(f"  {stage:<14} p50 {a['p50']:.3f} -> {b['p50']:.3f} ms   p95 {a['p95']:.3f} -> {b['p95']:.3f} ms")
+
+# ================= MAIN =================
+def main():
+    ap = argparse.ArgumentParser(description="Banc recall/MRR + latence par étape de rag_chat (hors-ligne)")
+    ap.add_argument("--csv", default="chunks.csv")
+    ap.add_argument("--questions", help="JSONL {question, expected_ids} (défaut : généré depuis --csv)")
+    ap.add_argument("--export-questions", help="écrit le jeu étiqueté utilisé (JSONL)")
+    ap.add_argument("--embeddings", choices=("stub", "fixtures"), default="stub")
+    ap.add_argument("--fixtures", default="bench_fixtures.npz")
+    ap.add_argument("--record", help="enregistre les vrais embeddings dans ce fichier puis quitte")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--gen-latency-ms", type=float, default=0.0)
+    ap.add_argument("--no-hybrid", action="store_true")
+    ap.add_argument("--quant", choices=("off", "float32", "float16", "int8", "binary"), default="off",
+                    help="vecteurs locaux quantifiés pour le MMR (requêtes sans include_values)")
+    ap.add_argument("--rerank", choices=("off", "stub", "fixtures", "record"), default="off",
+                    help="rerank LLM (USE_LLM_RERANK) avec un noteur simulé, enregistré ou réel")
+    ap.add_argument("--rerank-fixtures", default="bench_rerank.json")
+    ap.add_argument("--rerank-latency-ms", type=float, default=0.0, help="latence simulée du noteur")
+    ap.add_argument("--rerank-budget-ms", type=float, default=1500.0)
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", help="résultats JSON d'un run précédent")
+    args = ap.parse_args()
+
+    # environnement isolé, fixé avant tout import de vector_store / rag_chat (configurés à l'import)
+    workdir = tempfile.mkdtemp(prefix="bench_rag_")
+    os.environ.update({"VECTOR_BACKEND": "local", "LOCAL_INDEX_DIR": workdir,
+                       "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY") or "bench",
+                       "EMB_CACHE_DB": "", "ANSWER_CACHE_ENABLED": "0", "CHUNKS_CSV": args.csv,
+                       "USE_HYBRID": "0" if args.no_hybrid else "1", "SEARCH_NAMESPACES": "",
+                       "USE_LLM_RERANK": "0" if args.rerank == "off" else "1",
+                       "RERANK_BUDGET_MS": str(args.rerank_budget_ms)})
+
+    with open(args.csv, "r", encoding="utf-8-sig", newline="") as f:
+        rows = [r for r in csv.DictReader(f) if (r.get("text") or "").strip()]
+    questions = load_questions(args.questions, rows)
+    if args.export_questions:
+        with open(args.export_questions, "w", encoding="utf-8") as f:
+            for q in questions:
+                f.write(json.dumps(q, ensure_ascii=False) + "\n")
+    if args.record:
+        record_fixtures(args.record, [r["text"] for r in rows] + [q["question"] for q in questions],
+                        "text-embedding-3-small")
+        return
+
+    if args.embeddings == "fixtures":
+        embed_fn = FixtureEmbeddings(args.fixtures)
+    else:
+        from bench_hybrid import stub_embed as embed_fn
+
+    from vector_store import save_local_index, DEFAULT_NAMESPACE
+    from upsert_openai_simple import build_metadata
+    from bm25_index import BM25Index
+    ids, metas = [r["id"] for r in rows], [build_metadata(r) for r in rows]
+    save_local_index(ids, embed_fn([r["text"] for r in rows]), metas, DEFAULT_NAMESPACE, workdir)
+    BM25Index.build(ids, metas).save(DEFAULT_NAMESPACE, workdir)
+    if args.quant != "off":
+        from vector_codes import VectorCodes
+        VectorCodes.build(ids, embed_fn([r["text"] for r in rows]), args.quant).save(DEFAULT_NAMESPACE, workdir)
+
+    import rag_chat
+    import metrics
+    from context_packer import count_tokens
+    grader = None
+    if args.rerank == "stub":
+        grader = lexical_grader
+    elif args.rerank == "fixtures":
+        grader = FixtureGrader(args.rerank_fixtures)
+    elif args.rerank == "record":
+        grader = RecordingGrader(args.rerank_fixtures)
+    timer = StageTimer()
+    rag_chat.client = StubOpenAI(embed_fn, args.gen_latency_ms, grader, args.rerank_latency_ms)
+    rag_chat.embed = timer.wrap("embed", rag_chat.embed)
+    rag_chat.idx = _TimedIndex(rag_chat.idx, timer)
+    rag_chat.mmr_select = timer.wrap("mmr", rag_chat.mmr_select)
+    rag_chat.rerank = timer.wrap("rerank", rag_chat.rerank)
+    for lex in rag_chat.bm25.values():
+        if lex is not None:
+            lex.search = timer.wrap("bm25", lex.search)
+    build_prompt = timer.wrap("prompt_build", rag_chat.build_prompt)
+    compose = timer.wrap("generate", rag_chat.compose_answer)
+
+    recalls, rrs, n_hits, prompt_tokens = [], [], [], []
+    fallbacks = {"rerank_timeouts": 0, "rerank_errors": 0}
+    for rep in range(args.repeat):
+        for q in questions:
+            trace = metrics.start_trace()
+            t0 = time.perf_counter()
+            hits = rag_chat.search(q["question"], top_k=args.k)
+            msgs = build_prompt(q["question"], hits, [])
+            compose(msgs)
+            timer.samples["total"].append((time.perf_counter() - t0) * 1000)
+            for key in fallbacks:
+                fallbacks[key] += int(trace.counters.get(key, 0))
+            if rep == 0:
+                ranked = [h["id"] for h in hits]
+                recalls.append(recall_at_k(ranked, q["expected_ids"], args.k))
+                rrs.append(reciprocal_rank(ranked, q["expected_ids"]))
+                # taille de ce qui part à compose_answer (voisins compris)
+                n_hits.append(len(hits))
+                prompt_tokens.append(sum(count_tokens(m["content"]) for m in msgs))
+    if args.rerank == "record":
+        grader.save()
+
+    results = {
+        "config": {"k": args.k, "repeat": args.repeat, "embeddings": args.embeddings,
+                   "hybrid": not args.no_hybrid, "quant": args.quant, "mmr_lambda": rag_chat.MMR_LAMBDA,
+                   "max_context_tokens": rag_chat.MAX_CONTEXT_TOKENS, "gen_latency_ms": args.gen_latency_ms,
+                   "rerank": args.rerank, "rerank_latency_ms": args.rerank_latency_ms,
+                   "rerank_budget_ms": args.rerank_budget_ms,
+                   "n_chunks": len(rows), "python": sys.version.split()[0], "numpy": np.__version__},
+        "quality": {"n_questions": len(questions), "recall_at_k": round(float(np.mean(recalls)), 4),
+                    "mrr": round(float(np.mean(rrs)), 4)},
+        "context": {"hits_mean": round(float(np.mean(n_hits)), 2),
+                    "prompt_tokens_mean": round(float(np.mean(prompt_tokens)), 1), **fallbacks},
+        "latency_ms": timer.summary(),
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"TARS ▶ {len(questions)} questions × {args.repeat}, k={args.k}, embeddings={args.embeddings}")
+    print(f"  recall@{args.k}={results['quality']['recall_at_k']:.3f}  MRR={results['quality']['mrr']:.3f}")
+    ctx = results["context"]
+    print(f"  prompt : {ctx['hits_mean']:.2f} chunks, {ctx['prompt_tokens_mean']:.0f} tokens en moyenne"
+          + (f"  (rerank {args.rerank} : {ctx['rerank_timeouts']} replis budget, {ctx['rerank_errors']} erreurs)"
+             if args.rerank != "off" else ""))
+    print(f"  {'étape':<14} {'p50':>9} {'p95':>9} {'p99':>9}  (ms)")
+    for stage, s in results["latency_ms"].items():
+        print(f"  {stage:<14} {s['p50']:>9.3f} {s['p95']:>9.3f} {s['p99']:>9.3f}")
+    print(f"TARS ✅ résultats -> {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# bm25_index.py — Index lexical BM25 local + fusion RRF avec la recherche vectorielle
+#
+# Construit à l'indexation (upsert_openai_simple.py) sur le texte des chunks et
+# leurs titres de section, stocké en tableaux compacts (postings CSR) dans
+# <LOCAL_INDEX_DIR>/<namespace>/bm25.npz. Sert à rattraper les requêtes sur des
+# termes exacts (noms d'icaros, de plantes, "arkana") que l'embedding rate.
+#
+# Usage: python bm25_index.py build [--csv chunks.csv] [--namespace en_v1]
+#        python bm25_index.py query "arkana icaro" [--namespace en_v1]
+
+import os, re, json, sys, argparse, unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from vector_store import LOCAL_INDEX_DIR, DEFAULT_NAMESPACE
+
+BM25_FILE = "bm25.npz"
+BM25_K1: float = 1.2
+BM25_B: float = 0.75
+RRF_K: int = 60
+TITLE_WEIGHT: int = 2    # les mots des titres de section comptent double
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    """Minuscules, accents retirés (piñon == pinon), mots de 2 caractères et plus."""
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    t = "".join(ch for ch in t if not unicodedata.combining(ch))
+    return [w for w in _WORD_RE.findall(t) if len(w) > 1]
+
+def document_terms(meta: Dict) -> Counter:
+    tf = Counter(tokenize(meta.get("text", "")))
+    for key in ("section", "subsection", "subsubsection"):
+        for w in tokenize(meta.get(key, "")):
+            tf[w] += TITLE_WEIGHT
+    return tf
+
+class BM25Index:
+    """Postings en CSR : indptr[t]..indptr[t+1] -> (doc, tf) du terme t."""
+
+    def __init__(self, ids: List[str], vocab: Dict[str, int], indptr: np.ndarray, docs: np.ndarray,
+                 tfs: np.ndarray, doc_len: np.ndarray, k1: float = BM25_K1, b: float = BM25_B):
+        self.ids, self.vocab = ids, vocab
+        self.indptr, self.docs, self.tfs, self.doc_len = indptr, docs, tfs, doc_len
+        self.k1, self.b = k1, b
+        n = len(ids)
+        df = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg = float(doc_len.mean()) if n else 0.0
+        # normalisation de longueur précalculée par document
+        self._norm = (k1 * (1 - b + b * doc_len / avg)).astype(np.float32) if avg else np.full(n, k1, np.float32)
+
+    @classmethod
+    def build(cls, ids: Sequence[str], metas: Iterable[Dict]) -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        postings: List[List[Tuple[int, int]]] = []
+        doc_len = []
+        for d, meta in enumerate(metas):
+            tf = document_terms(meta)
+            doc_len.append(sum(tf.values()))
+            for term, c in tf.items():
+                t = vocab.setdefault(term, len(vocab))
+                if t == len(postings):
+                    postings.append([])
+                postings[t].append((d, c))
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        docs = np.fromiter((d for p in postings for d, _ in p), dtype=np.int32, count=int(indptr[-1]))
+        tfs = np.fromiter((c for p in postings for _, c in p), dtype=np.float32, count=int(indptr[-1]))
+        return cls(list(ids), vocab, indptr, docs, tfs, np.asarray(doc_len, dtype=np.float32))
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            lo, hi = self.indptr[t], self.indptr[t + 1]
+            d, tf = self.docs[lo:hi], self.tfs[lo:hi]
+            scores[d] += self.idf[t] * tf * (self.k1 + 1) / (tf + self._norm[d])
+        hit = np.flatnonzero(scores)
+        if hit.size == 0:
+            return []
+        k = min(top_k, hit.size)
+        top = hit[np.argpartition(-scores[hit], k - 1)[:k]] if k < hit.size else hit
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    # ---- persistance ----
+    def save(self, namespace: str = DEFAULT_NAMESPACE, root: str = LOCAL_INDEX_DIR) -> str:
+        folder = os.path.join(root, namespace)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, BM25_FILE)
+        terms = sorted(self.vocab, key=self.vocab.get)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, indptr=self.indptr, docs=self.docs, tfs=self.tfs, doc_len=self.doc_len,
+                 ids=np.asarray(json.dumps(self.ids, ensure_ascii=False)),
+                 terms=np.asarray(json.dumps(terms, ensure_ascii=False)))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, namespace: str = DEFAULT_NAMESPACE, root: str = LOCAL_INDEX_DIR) -> Optional["BM25Index"]:
+        path = os.path.join(root, namespace, BM25_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as z:
+            terms = json.loads(str(z["terms"]))
+            return cls(json.loads(str(z["ids"])), {t: i for i, t in enumerate(terms)},
+                       z["indptr"], z["docs"], z["tfs"], z["doc_len"])
+
+def rrf_fuse(rankings: Sequence[Sequence[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Reciprocal Rank Fusion ; score ramené dans [0, 1] (1 = premier partout)."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    best = len(rankings) / (k + 1)
+    return sorted(((d, s / best) for d, s in fused.items()), key=lambda x: x[1], reverse=True)
+
+def main():
+    ap = argparse.ArgumentParser(description="Index BM25 local")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build"); b.add_argument("--csv", default="chunks.csv")
+    q = sub.add_parser("query"); q.add_argument("text"); q.add_argument("--top-k", type=int, default=5)
+    for p in (b, q):
+        p.add_argument("--namespace", default=DEFAULT_NAMESPACE)
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        from upsert_openai_simple import read_rows, build_metadata
+        rows = read_rows(args.csv)
+        ids = [r.get("id") or f"doc-{i:08d}" for i, r in enumerate(rows)]
+        index = BM25Index.build(ids, (build_metadata(r) for r in rows))
+        print(f"TARS ✅ BM25: {len(ids)} docs, {len(index.vocab)} termes -> {index.save(args.namespace)}")
+    else:
+        index = BM25Index.load(args.namespace)
+        if index is None:
+            print("❌ Index BM25 introuvable, lancer: python bm25_index.py build")
+            sys.exit(1)
+        for doc_id, score in index.search(args.text, args.top_k):
+            print(f"{doc_id} — score: {score:.3f}")
+
+if __name__ == "__main__":
+    main()
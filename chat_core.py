@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# chat_core.py — Logique commune aux backends Flask (sync) et ASGI (async)
+
+from typing import Dict, List, Optional, Tuple
+import metrics
+
+MODEL_EMB  = "text-embedding-3-small"
+MODEL_CHAT = "gpt-4o-mini"
+
+def detect_lang(text: str) -> str:
+    t = (text or "").strip().lower()
+    fr_hint = any(ch in t for ch in ("é", "è", "à", "ç", "ô", "ù", "ï", "â"))
+    es_hint = any(ch in t for ch in ("¿", "¡", "ñ", "á", "é", "í", "ó", "ú"))
+    lang = "en"
+    if fr_hint: lang = "fr"
+    if es_hint: lang = "es"
+    return lang
+
+def build_prompt(question: str, context: str, history: str = "") -> str:
+    """`history` : conversation déjà compactée (session_store.render_history), pour les relances."""
+    conversation = f"CONVERSATION SO FAR:\n{history}\n\n" if history else ""
+    return (
+        "You are an AI assistant. Answer the question using ONLY the information below. "
+        "Detect the language of the question automatically and respond in the same language.\n\n"
+        f"CONTEXT:\n{context}\n\n"
+        f"{conversation}"
+        f"QUESTION: {question}"
+    )
+
+def matches_to_context(results, budget: Optional[int] = None, stats: Optional[Dict] = None,
+                       neighbours=None) -> Tuple[str, List[str]]:
+    """Résultat de idx.query -> (contexte empaqueté sous `budget` tokens, sources retenues).
+
+    `neighbours` (neighbour_index.NamespacedNeighbours) ajoute les chunks adjacents des hits,
+    pris dans le namespace de chaque hit, avant l'empaquetage.
+    `stats`, si fourni, reçoit les compteurs de context_packer (tokens économisés, etc.).
+    """
+    from context_packer import pack_context, hits_from_matches, MAX_CONTEXT_TOKENS
+    hits = hits_from_matches(results)
+    metrics.pool_size("matches", len(hits))
+    with metrics.stage("context_pack"):
+        if neighbours is not None:
+            hits = neighbours.expand(hits)
+        context, passages, info = pack_context(hits, budget or MAX_CONTEXT_TOKENS)
+    metrics.add("context_tokens", info["packed_tokens"])
+    metrics.add("context_tokens_saved", info["saved_tokens"])
+    if stats is not None:
+        stats.update(info)
+    return context, [p["source"] for p in passages]
+
+def packed_context(results, neighbours=None, web_lines: Optional[List[str]] = None) -> Tuple[str, List[str]]:
+    """matches_to_context + une ligne de log avec les tokens économisés pour la requête.
+
+    `web_lines` (snippets web) occupent au plus WEB_CONTEXT_TOKENS du budget, ajoutés après
+    la DB ; le contexte DB reçoit le reste : le total tient dans MAX_CONTEXT_TOKENS.
+    """
+    from context_packer import format_stats, count_tokens, MAX_CONTEXT_TOKENS, WEB_CONTEXT_TOKENS
+    budget, kept = MAX_CONTEXT_TOKENS, []
+    # lignes entières (la source est en fin de ligne), dans l'ordre, tant qu'elles tiennent
+    for line in web_lines or []:
+        if count_tokens("\n".join(kept + [line])) <= min(WEB_CONTEXT_TOKENS, MAX_CONTEXT_TOKENS // 2):
+            kept.append(line)
+    web = "\n".join(kept)
+    if web:
+        budget -= count_tokens("\n\n" + web)
+    stats: Dict = {}
+    context, sources = matches_to_context(results, budget, stats=stats, neighbours=neighbours)
+    print("[Contexte]", format_stats(stats) + (f" + web {count_tokens(web)} tokens" if web else ""))
+    if web:
+        context = f"{context}\n\n{web}" if context else web
+    return context, sources
+
+def output_text(response) -> str:
+    """Texte final d'une réponse openai.responses.create."""
+    answer = getattr(response, "output_text", None)
+    if not answer:
+        answer = response.output[0].content[0].text
+    return answer
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# chunk_parser.py — Parseur de chunks en un seul passage, partagé par les exporteurs
+#
+# Lit les marqueurs [CHUNK:n] / [SECTION:..] / [SUBSECTION:..] / [SUBSUBSECTION:..]
+# / [OVERLAP]..[/OVERLAP] ligne par ligne (paragraphes DOCX ou fichier texte) et
+# produit les chunks au fil de l'eau (générateur), sans concaténer le document
+# ni relancer une regex par tag sur chaque bloc. Sortie identique à l'ancien
+# parseur regex (voir bench_chunk_parser.py pour la parité avec chunks.csv).
+#
+# Limite : un marqueur doit tenir sur une seule ligne (toujours le cas dans nos docs).
+
+import os, re, csv
+from typing import Dict, Iterable, Iterator, List, Optional
+
+FIELDS = ["id","text","section","subsection","subsubsection","chunk_index","language","source","overlap_text"]
+TEXT_ENCODINGS = ("utf-8","utf-8-sig","cp1252","latin-1")
+
+# Un seul motif pour tous les marqueurs : une passe par ligne
+MARKER_RE = re.compile(
+    r"\[\s*(?:"
+    r"CHUNK\s*[:\-]?\s*(?P<num>\d+)\s*"
+    r"|(?P<tag>SUBSUBSECTION|SUBSECTION|SECTION)\s*:\s*(?P<val>[^\]]*)"
+    r"|(?P<close>/\s*)?OVERLAP\s*"
+    r")\]",
+    re.IGNORECASE)
+
+def normalize_line(s: str) -> str:
+    return (s.replace("⟦","[").replace("⟧","]")
+             .replace("[[","[").replace("]]","]"))
+
+# ================= SOURCES DE LIGNES =================
+def iter_docx_lines(path: str) -> Iterator[str]:
+    """Lignes d'un DOCX, paragraphe par paragraphe (python-docx)."""
+    from docx import Document
+    doc = Document(path)
+    for p in doc.paragraphs:
+        yield from p.text.replace("\r\n","\n").replace("\r","\n").split("\n")
+
+def detect_text_encoding(path: str, encodings: Iterable[str] = TEXT_ENCODINGS, block: int = 1 << 20) -> str:
+    """Premier encodage qui décode tout le fichier (lecture par blocs, mémoire constante)."""
+    import codecs
+    for enc in encodings:
+        dec = codecs.getincrementaldecoder(enc)()
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    data = f.read(block)
+                    if not data:
+                        dec.decode(b"", final=True)
+                        return enc
+                    dec.decode(data)
+        except UnicodeDecodeError:
+            continue
+    raise UnicodeDecodeError("unknown", b"", 0, 1, f"aucun encodage parmi {list(encodings)}")
+
+def iter_text_lines(path: str, encoding: Optional[str] = None) -> Iterator[str]:
+    """Lignes d'un fichier texte, en flux (\\r\\n et \\r normalisés)."""
+    encoding = encoding or detect_text_encoding(path)
+    with open(path, "r", encoding=encoding, newline=None) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+def iter_source_lines(path: str, encoding: Optional[str] = None) -> Iterator[str]:
+    if path.lower().endswith(".docx"):
+        return iter_docx_lines(path)
+    return iter_text_lines(path, encoding)
+
+# ================= TOKENIZER =================
+class _ChunkState:
+    __slots__ = ("num", "tags", "lines", "cur", "overlap", "ov_pieces", "ov_clean", "ov_open_raw")
+
+    def __init__(self, num: str):
+        self.num = num
+        self.tags: Dict[str, str] = {}
+        self.lines: List[str] = []          # lignes de texte principal (marqueurs retirés)
+        self.cur = ""                       # ligne principale en cours
+        self.overlap: Optional[str] = None  # premier bloc [OVERLAP] fermé
+        self.ov_pieces: Optional[List[str]] = None  # bloc [OVERLAP] ouvert (texte brut)
+        self.ov_clean: List[str] = []               # idem, tags de section retirés
+        self.ov_open_raw = ""               # texte du marqueur ouvrant (si jamais fermé)
+
+def _finish(st: _ChunkState, id_prefix: str, language: str, source: str) -> Dict:
+    if st.ov_pieces is not None:
+        # [OVERLAP] sans [/OVERLAP] : l'ancien parseur laissait le tout dans le texte
+        st.cur += st.ov_open_raw + "\n".join(st.ov_clean)
+        st.ov_pieces = None
+    st.lines.extend(st.cur.split("\n"))
+    text_main = "\n".join(ln.strip() for ln in st.lines if ln.strip())
+    return {
+        "id": f"{id_prefix}_ch{int(st.num):04d}",
+        "text": text_main,
+        "section": st.tags.get("SECTION", ""),
+        "subsection": st.tags.get("SUBSECTION", ""),
+        "subsubsection": st.tags.get("SUBSUBSECTION", ""),
+        "chunk_index": int(st.num.lstrip("0") or "0"),
+        "language": language,
+        "source": source,
+        "overlap_text": (st.overlap or "").strip(),
+    }
+
+def iter_chunks(lines: Iterable[str], id_prefix: str = "db_en", language: str = "en",
+                source: str = "") -> Iterator[Dict]:
+    """Transforme un flux de lignes en enregistrements de chunks (générateur)."""
+    st: Optional[_ChunkState] = None
+    for raw in lines:
+        line = normalize_line(raw)
+        pos = 0
+        for m in MARKER_RE.finditer(line):
+            before = line[pos:m.start()]
+            pos = m.end()
+            if m.group("num") is not None:
+                if st is not None:
+                    _append(st, before)
+                    yield _finish(st, id_prefix, language, source)
+                st = _ChunkState(m.group("num"))
+                continue
+            if st is None:
+                continue  # texte avant le premier [CHUNK] : ignoré
+            if m.group("tag"):
+                _append(st, before)
+                if st.ov_pieces is not None:
+                    st.ov_pieces[-1] += m.group(0)  # l'overlap garde le texte brut
+                st.tags.setdefault(m.group("tag").upper(), m.group("val").strip())
+            elif m.group("close") is None:   # [OVERLAP]
+                if st.ov_pieces is not None:
+                    _append(st, before + m.group(0))
+                else:
+                    st.cur += before
+                    st.ov_pieces, st.ov_clean, st.ov_open_raw = [""], [""], m.group(0)
+            else:                            # [/OVERLAP]
+                if st.ov_pieces is not None:
+                    st.ov_pieces[-1] += before
+                    if st.overlap is None:
+                        st.overlap = "\n".join(st.ov_pieces)
+                    st.ov_pieces = None
+                else:
+                    st.cur += before + m.group(0)
+        if st is None:
+            continue
+        _append(st, line[pos:])
+        # fin de ligne
+        if st.ov_pieces is not None:
+            st.ov_pieces.append("")
+            st.ov_clean.append("")
+        else:
+            st.lines.append(st.cur)
+            st.cur = ""
+    if st is not None:
+        yield _finish(st, id_prefix, language, source)
+
+def _append(st: _ChunkState, text: str) -> None:
+    if not text:
+        return
+    if st.ov_pieces is not None:
+        st.ov_pieces[-1] += text
+        st.ov_clean[-1] += text
+    else:
+        st.cur += text
+
+def parse_file(path: str, id_prefix: str = "db_en", language: str = "en", source: Optional[str] = None,
+               encoding: Optional[str] = None) -> Iterator[Dict]:
+    """Chunks d'un fichier DOCX ou texte, en flux."""
+    return iter_chunks(iter_source_lines(path, encoding), id_prefix, language,
+                       source if source is not None else os.path.basename(path))
+
+# ================= ECRITURE =================
+def write_chunks_csv(chunks: Iterable[Dict], out_path: str, keep_overlap: bool = True,
+                     encoding: str = "utf-8-sig") -> int:
+    """Écrit les chunks au fil de l'eau ; renvoie le nombre de lignes écrites."""
+    fields = FIELDS if keep_overlap else FIELDS[:-1]
+    n = 0
+    with open(out_path, "w", encoding=encoding, newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        w.writeheader()
+        for row in chunks:
+            w.writerow(row)
+            n += 1
+    return n
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# clients.py — Clients paresseux (OpenAI, index vectoriel) + phase de warm-up / readiness
+#
+# Rien n'est créé à l'import : un worker gunicorn démarre en quelques ms et une
+# variable d'environnement manquante ne lève qu'au premier usage (et apparaît
+# dans /readyz) au lieu de tuer l'import. Le warm-up, lancé au démarrage (en
+# tâche de fond par défaut), crée les clients, ouvre les connexions TLS (un
+# embedding factice, describe_index_stats), mappe l'index local, charge le
+# cache SQLite et l'encodeur tiktoken : la première vraie requête ne paie rien.
+#
+# WARMUP=background (défaut) | sync (bloque le démarrage) | off
+
+import os, time, threading
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+WARMUP_MODE: str = os.getenv("WARMUP", "background").strip().lower()
+HTTP_MAX_CONNECTIONS: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+WARMUP_TEXT = "warm-up"
+
+class Lazy:
+    """Proxy : l'objet est construit au premier accès à un attribut (une seule fois, thread-safe)."""
+
+    def __init__(self, factory: Callable[[], object], name: str):
+        self._factory, self._name = factory, name
+        self._obj = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._obj is None:
+            with self._lock:
+                if self._obj is None:
+                    self._obj = self._factory()
+        return self._obj
+
+    @property
+    def created(self) -> bool:
+        return self._obj is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def __repr__(self) -> str:
+        return f"<Lazy {self._name} {'prêt' if self.created else 'non créé'}>"
+
+# ================= FABRIQUES =================
+def make_openai(api_key: Optional[str] = None):
+    """Client OpenAI synchrone avec pool de connexions httpx (keep-alive)."""
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("❌ OPENAI_API_KEY manquant")
+    return OpenAI(api_key=api_key, http_client=DefaultHttpxClient(limits=httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)))
+
+def make_index(api_key: Optional[str] = None, name: Optional[str] = None, host: Optional[str] = None,
+               environment: Optional[str] = None):
+    from vector_store import open_index, VECTOR_BACKEND
+    if VECTOR_BACKEND != "local":
+        missing = [k for k, v in (("PINECONE_API_KEY", api_key), ("nom d'index", name or host)) if not v]
+        if missing:
+            raise RuntimeError(f"❌ Configuration Pinecone manquante : {', '.join(missing)}")
+    return open_index(api_key=api_key, name=name, host=host, environment=environment)
+
+_openai = Lazy(make_openai, "openai")
+
+def get_openai():
+    """Client OpenAI partagé du processus."""
+    return _openai.get()
+
+# ================= WARM-UP =================
+def warm_openai(client, model: str = "text-embedding-3-small") -> None:
+    """Un embedding factice : DNS + TLS + connexion keep-alive déjà ouverts."""
+    client.embeddings.create(model=model, input=WARMUP_TEXT)
+
+def warm_index(idx, namespaces: Sequence[str]) -> None:
+    """Index local : mmap + lecture des pages ; Pinecone : résolution de l'hôte et connexion."""
+    if hasattr(idx, "_load"):
+        for ns in namespaces:
+            _, mat, _ = idx._load(ns or idx.default_namespace)
+            float(mat.sum())  # force le chargement des pages du fichier mappé
+    else:
+        idx.describe_index_stats()
+
+def warm_local_caches() -> None:
+    """Connexion SQLite du cache d'embeddings + encodeur tiktoken du packer de contexte."""
+    from embedding_cache import get_cache
+    from context_packer import count_tokens
+    get_cache().warm()
+    count_tokens(WARMUP_TEXT)
+
+class Readiness:
+    """État du warm-up, exposé par /readyz."""
+
+    def __init__(self):
+        self.ready = False
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.checks: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started_pid: Optional[int] = None
+
+    def _record(self, name: str, t0: float, error: Optional[Exception] = None) -> None:
+        check = {"ok": error is None, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+        if error is not None:
+            check["error"] = str(error)
+            print(f"[Warm-up] {name} échoué: {error}")
+        self.checks[name] = check
+
+    def _done(self) -> bool:
+        self.ready = all(c["ok"] for c in self.checks.values())
+        self.finished = time.time()
+        return self.ready
+
+    def run(self, steps: List[Tuple[str, Callable[[], None]]]) -> bool:
+        """Exécute les étapes dans l'ordre ; prêt si toutes réussissent. Relançable."""
+        with self._lock:
+            self.started, self.ready = time.time(), False
+            for name, fn in steps:
+                t0 = time.perf_counter()
+                try:
+                    fn()
+                    self._record(name, t0)
+                except Exception as e:
+                    self._record(name, t0, e)
+            return self._done()
+
+    async def arun(self, steps: List[Tuple[str, Callable[[], Awaitable[None]]]]) -> bool:
+        """Variante asyncio de run() (étapes = fonctions coroutines)."""
+        self.started, self.ready = time.time(), False
+        for name, fn in steps:
+            t0 = time.perf_counter()
+            try:
+                await fn()
+                self._record(name, t0)
+            except Exception as e:
+                self._record(name, t0, e)
+        return self._done()
+
+    def start(self, steps: List[Tuple[str, Callable[[], None]]], mode: str = WARMUP_MODE) -> None:
+        if mode == "off":
+            self.ready = True
+        elif mode == "sync":
+            self.run(steps)
+        else:
+            threading.Thread(target=self.run, args=(steps,), name="warm-up", daemon=True).start()
+
+    def start_once(self, steps: List[Tuple[str, Callable[[], None]]], mode: str = WARMUP_MODE) -> None:
+        """start() une seule fois par processus : appelé à la première requête, le warm-up
+        tourne dans le worker et jamais dans le master gunicorn (--preload)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._start_lock:
+            if self._started_pid != pid:
+                self._started_pid = pid
+                self.start(steps, mode)
+
+    def status(self) -> Dict:
+        return {"ready": self.ready, "started": self.started, "finished": self.finished, "checks": self.checks}
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# context_packer.py — Assemblage du contexte RAG sous un budget exact de tokens
+#
+# Étapes : 1) doublons retirés (même id / même texte / texte inclus dans un autre),
+# 2) chunks voisins (même source, chunk_index consécutifs) fusionnés en un passage,
+# l'overlap_text du suivant retiré s'il répète la fin du précédent, 3) passages
+# rangés par score puis empaquetés tant qu'ils tiennent dans le budget ; le reste
+# du budget est comblé par le meilleur passage restant, tronqué au token près.
+# Les tokens sont comptés avec tiktoken pour le modèle de chat (gpt-4o-mini).
+
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import tiktoken
+from chat_core import MODEL_CHAT
+
+MAX_CONTEXT_TOKENS: int = int(os.getenv("MAX_CONTEXT_TOKENS", "1200"))
+WEB_CONTEXT_TOKENS: int = int(os.getenv("WEB_CONTEXT_TOKENS", "300"))   # part max des snippets web dans ce budget
+MIN_FILL_TOKENS: int = 40   # en dessous, on ne tronque pas un passage pour combler le budget
+
+@lru_cache(maxsize=1)
+def _encoder():
+    try:
+        return tiktoken.encoding_for_model(MODEL_CHAT)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str) -> int:
+    return len(_encoder().encode(text or ""))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    toks = _encoder().encode(text or "")
+    return _encoder().decode(toks[:max(max_tokens, 0)]).rstrip()
+
+def hits_from_matches(results) -> List[Dict]:
+    """Résultat brut de idx.query -> liste de hits (même forme que rag_chat.search)."""
+    hits = []
+    for m in results["matches"]:
+        meta = m["metadata"] or {}
+        hits.append({
+            "id": m["id"],
+            "score": m.get("score", 0.0) if isinstance(m, dict) else getattr(m, "score", 0.0),
+            "text": meta.get("text", ""),
+            "section": meta.get("section", ""),
+            "chunk_index": meta.get("chunk_index"),
+            "source": meta.get("source", ""),
+            "overlap_text": meta.get("overlap_text", ""),
+            # fan-out (merged_matches) : namespace d'origine, pour chercher les voisins au bon endroit
+            "namespace": m.get("namespace") if isinstance(m, dict) else getattr(m, "namespace", None),
+        })
+    return hits
+
+# ================= DÉDOUBLONNAGE / FUSION =================
+def _norm(text: str) -> str:
+    return " ".join((text or "").split())
+
+def _dedupe(hits: List[Dict]) -> List[Dict]:
+    seen_ids, seen_texts, out = set(), set(), []
+    for h in hits:
+        key = _norm(h.get("text"))
+        if not key or h.get("id") in seen_ids or key in seen_texts:
+            continue
+        seen_ids.add(h.get("id")); seen_texts.add(key)
+        out.append(h)
+    # un passage entièrement contenu dans un autre n'apporte rien
+    texts = [_norm(h["text"]) for h in out]
+    return [h for i, h in enumerate(out)
+            if not any(i != j and len(texts[i]) < len(texts[j]) and texts[i] in texts[j] for j in range(len(out)))]
+
+def _strip_overlap(prev_text: str, text: str, overlap: str) -> str:
+    """Retire en tête de `text` l'overlap déjà présent à la fin du chunk précédent."""
+    overlap = (overlap or "").strip()
+    if overlap and overlap in prev_text and text.lstrip().startswith(overlap):
+        return text.lstrip()[len(overlap):].lstrip()
+    return text
+
+def merge_neighbours(hits: List[Dict]) -> List[Dict]:
+    """Fusionne les chunks consécutifs d'une même source ; le passage garde le meilleur score."""
+    def index_of(h):
+        try:
+            return int(h.get("chunk_index"))
+        except (TypeError, ValueError):
+            return None
+
+    rank = {id(h): r for r, h in enumerate(hits)}
+    ordered = sorted((h for h in hits if index_of(h) is not None), key=lambda h: (h.get("source", ""), index_of(h)))
+    passages: List[Dict] = []
+    prev: Optional[Dict] = None
+    for h in ordered:
+        if (prev is not None and passages and prev.get("source", "") == h.get("source", "")
+                and index_of(h) == index_of(prev) + 1):
+            p = passages[-1]
+            p["text"] += "\n" + _strip_overlap(prev["text"], h["text"], h.get("overlap_text", ""))
+            p["ids"].append(h["id"])
+            p["score"] = max(p["score"], h.get("score", 0.0))
+            p["rank"] = min(p["rank"], rank[id(h)])
+        else:
+            passages.append({"ids": [h["id"]], "text": h["text"], "section": h.get("section", ""),
+                             "source": h.get("source", ""), "score": h.get("score", 0.0), "rank": rank[id(h)]})
+        prev = h
+    for h in hits:
+        if index_of(h) is None:
+            passages.append({"ids": [h["id"]], "text": h["text"], "section": h.get("section", ""),
+                             "source": h.get("source", ""), "score": h.get("score", 0.0), "rank": rank[id(h)]})
+    passages.sort(key=lambda p: (-p["score"], p["rank"]))
+    return passages
+
+# ================= EMPAQUETAGE =================
+def render(passages: List[Dict], template: str = "{text}", sep: str = "\n\n") -> str:
+    return sep.join(template.format(n=i + 1, text=p["text"]) for i, p in enumerate(passages))
+
+def pack_context(hits: List[Dict], budget: int = MAX_CONTEXT_TOKENS, template: str = "{text}",
+                 sep: str = "\n\n") -> Tuple[str, List[Dict], Dict]:
+    """hits (triés par pertinence) -> (contexte rendu, passages retenus, statistiques).
+
+    Le contexte rendu fait au plus `budget` tokens. `template` reçoit {n} (numéro
+    du passage) et {text}.
+    """
+    raw_tokens = count_tokens(render(hits, template, sep))
+    passages = merge_neighbours(_dedupe(hits))
+    sep_cost = count_tokens(sep)
+
+    kept, left, remaining = [], [], budget
+    for p in passages:
+        cost = count_tokens(template.format(n=len(kept) + 1, text=p["text"])) + (sep_cost if kept else 0)
+        if cost <= remaining:
+            kept.append(p); remaining -= cost
+        else:
+            left.append(p)
+
+    truncated = False
+    if left and remaining >= MIN_FILL_TOKENS:
+        p = dict(left.pop(0))
+        overhead = count_tokens(template.format(n=len(kept) + 1, text="")) + (sep_cost if kept else 0)
+        p["text"] = truncate_tokens(p["text"], remaining - overhead)
+        if p["text"]:
+            kept.append(p); truncated = True
+
+    # les tokens ne s'additionnent pas toujours à la frontière des morceaux : contrôle exact
+    context = render(kept, template, sep)
+    while kept and count_tokens(context) > budget:
+        last = kept[-1]
+        excess = count_tokens(context) - budget
+        shorter = truncate_tokens(last["text"], count_tokens(last["text"]) - excess)
+        truncated = True
+        if not shorter or shorter == last["text"]:
+            kept.pop()
+        else:
+            last["text"] = shorter
+        context = render(kept, template, sep)
+
+    packed_tokens = count_tokens(context)
+    kept_ids = {i for p in kept for i in p["ids"]}
+    stats = {
+        "raw_tokens": raw_tokens,
+        "packed_tokens": packed_tokens,
+        "saved_tokens": raw_tokens - packed_tokens,
+        "budget": budget,
+        "merged": sum(len(p["ids"]) - 1 for p in kept),
+        "dropped": [h["id"] for h in hits if h.get("id") not in kept_ids],
+        "truncated": truncated,
+    }
+    return context, kept, stats
+
+def format_stats(stats: Dict) -> str:
+    return (f"contexte {stats['packed_tokens']}/{stats['budget']} tokens "
+            f"(brut {stats['raw_tokens']}, économisés {stats['saved_tokens']}, "
+            f"fusionnés {stats['merged']}, écartés {len(stats['dropped'])}"
+            f"{', tronqué' if stats['truncated'] else ''})")
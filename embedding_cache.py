@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# embedding_cache.py — Cache d'embeddings partagé (mémoire LRU/TTL + SQLite optionnel)
+#
+# Clé = modèle + sha256 du texte normalisé. Le niveau disque (SQLite, mode WAL)
+# survit aux redémarrages et est partagé entre les workers gunicorn : une connexion
+# par thread (lectures concurrentes sans verrou Python), purge par âge et par taille
+# à la première ouverture de chaque processus.
+
+import os, time, sqlite3, hashlib, threading, unicodedata
+from array import array
+from typing import Callable, Dict, List, Optional
+from cachetools import TTLCache
+import metrics
+
+# ================= CONFIG =================
+EMB_CACHE_SIZE: int = int(os.getenv("EMB_CACHE_SIZE", "4096"))        # entrées en mémoire
+EMB_CACHE_TTL: float = float(os.getenv("EMB_CACHE_TTL", "86400"))     # secondes en mémoire
+EMB_CACHE_DB: str = os.getenv("EMB_CACHE_DB", "emb_cache.sqlite")     # "" = pas de niveau disque
+EMB_CACHE_DB_TTL: float = float(os.getenv("EMB_CACHE_DB_TTL", str(30 * 86400)))  # secondes sur disque (0 = illimité)
+EMB_CACHE_DB_MAX: int = int(os.getenv("EMB_CACHE_DB_MAX", "200000"))  # entrées sur disque (0 = illimité)
+
+def normalize_text(text: str) -> str:
+    t = unicodedata.normalize("NFC", text or "")
+    return " ".join(t.split()).casefold()
+
+def cache_key(model: str, text: str) -> str:
+    return f"{model}:{hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()}"
+
+class EmbeddingCache:
+    """Cache à deux niveaux : TTLCache (LRU + expiration) puis SQLite."""
+
+    def __init__(self, maxsize: int = EMB_CACHE_SIZE, ttl: float = EMB_CACHE_TTL,
+                 db_path: Optional[str] = EMB_CACHE_DB):
+        self._mem: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.db_path = db_path or None
+        self._local = threading.local()
+        self._purged_pid: Optional[int] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ---- niveau disque ----
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        # une connexion par thread et par processus : gunicorn forke après l'import
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL, created REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)")
+            conn.commit()
+            local.conn, local.pid = conn, os.getpid()
+            if self._purged_pid != local.pid:
+                self._purged_pid = local.pid
+                self._purge(conn)
+        return local.conn
+
+    def _purge(self, conn: sqlite3.Connection) -> None:
+        """Supprime les entrées plus vieilles que EMB_CACHE_DB_TTL puis les plus anciennes au-delà de EMB_CACHE_DB_MAX."""
+        try:
+            if EMB_CACHE_DB_TTL > 0:
+                conn.execute("DELETE FROM embeddings WHERE created < ?", (time.time() - EMB_CACHE_DB_TTL,))
+            if EMB_CACHE_DB_MAX > 0:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE created <= (SELECT created FROM embeddings "
+                    "ORDER BY created DESC LIMIT 1 OFFSET ?)", (EMB_CACHE_DB_MAX,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"[EmbCache] purge disque échouée: {e}")
+
+    def _disk_get(self, key: str) -> Optional[List[float]]:
+        try:
+            conn = self._db()
+            if conn is None:
+                return None
+            row = conn.execute("SELECT vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"[EmbCache] lecture disque échouée: {e}")
+            return None
+        if row is None:
+            return None
+        return array("f", row[0]).tolist()
+
+    def _disk_put(self, key: str, vec: List[float]) -> None:
+        try:
+            conn = self._db()
+            if conn is None:
+                return
+            conn.execute("INSERT OR REPLACE INTO embeddings (key, vec, created) VALUES (?, ?, ?)",
+                         (key, array("f", vec).tobytes(), time.time()))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"[EmbCache] écriture disque échouée: {e}")
+
+    # ---- API ----
+    def warm(self) -> None:
+        """Ouvre la connexion SQLite du thread courant et purge le disque (warm-up au démarrage)."""
+        self._db()
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        with self._lock:
+            vec = self._mem.get(key)
+        disk = False
+        if vec is None:
+            # hors verrou : SQLite (connexion du thread) gère la concurrence
+            vec = self._disk_get(key)
+            disk = vec is not None
+        with self._lock:
+            if disk:
+                self._mem[key] = vec
+                self.disk_hits += 1
+            if vec is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.cache_event("embedding", vec is not None)
+        return vec
+
+    def put(self, model: str, text: str, vec: List[float]) -> None:
+        key = cache_key(model, text)
+        with self._lock:
+            self._mem[key] = vec
+        self._disk_put(key, vec)
+
+    def get_or_embed(self, model: str, text: str, embed_fn: Callable[[str], List[float]]) -> List[float]:
+        """Renvoie l'embedding en cache, sinon appelle embed_fn(text) et le mémorise."""
+        vec = self.get(model, text)
+        if vec is None:
+            vec = embed_fn(text)
+            self.put(model, text, vec)
+        return vec
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "mem_size": len(self._mem),
+            }
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_lock = threading.Lock()
+
+def get_cache() -> EmbeddingCache:
+    """Cache partagé du processus (rag_chat, backend Flask, web_enrichment, query_test)."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
+
+def cached_embedding(client, model: str, text: str) -> List[float]:
+    """Embedding OpenAI d'un texte, via le cache partagé."""
+    return get_cache().get_or_embed(
+        model, text, lambda t: client.embeddings.create(model=model, input=t).data[0].embedding)
+
+def cached_embeddings(client, model: str, texts: List[str]) -> List[List[float]]:
+    """Embeddings de plusieurs textes : un seul appel OpenAI pour tous les textes absents du cache."""
+    cache = get_cache()
+    out: List[Optional[List[float]]] = [cache.get(model, t) for t in texts]
+    missing: Dict[str, List[int]] = {}
+    for i, v in enumerate(out):
+        if v is None:
+            missing.setdefault(texts[i], []).append(i)
+    if missing:
+        uniq = list(missing)
+        resp = client.embeddings.create(model=model, input=uniq)
+        for t, d in zip(uniq, resp.data):
+            cache.put(model, t, d.embedding)
+            for i in missing[t]:
+                out[i] = d.embedding
+    return out
@@ -3,8 +3,10 @@
 # Place ton fichier ici:
 #   C:\Users\HONOR\OneDrive\Desktop\Aya_db\aya_db_v1.docx
 # (ou aya_db_v1.txt si tu préfères le .txt)
+# Le parsing (un seul passage, en flux) est dans chunk_parser.py.
 
-import os, re, csv, sys, subprocess
+import os, sys, subprocess
+from chunk_parser import parse_file, write_chunks_csv, detect_text_encoding
 
 BASE = r"C:\Users\HONOR\OneDrive\Desktop\Aya_db\aya_db_v1"
 DOCX = BASE + ".docx"
@@ -18,81 +20,25 @@ SOURCE    = os.path.basename(DOCX if os.path.exists(DOCX) else TXT)
 print("TARS ▶ start")
 print("TARS ▶ source =", SOURCE)
 
-def normalize(s: str) -> str:
-    return (s.replace("⟦","[").replace("⟧","]")
-             .replace("[[","[").replace("]]","]")
-             .replace("\r\n","\n").replace("\r","\n"))
-
-data = ""
+encoding = None
 if os.path.exists(DOCX):
     # Lire DOCX (auto-install python-docx si besoin)
     try:
-        from docx import Document
+        import docx  # noqa: F401
     except ImportError:
         print("TARS ▶ install python-docx…")
         subprocess.check_call([sys.executable, "-m", "pip", "install", "python-docx"])
-        from docx import Document
-    doc = Document(DOCX)
-    data = "\n".join(p.text for p in doc.paragraphs)
+    path = DOCX
 else:
     # Lire TXT avec encodage tolérant
-    for enc in ("utf-8","utf-8-sig","cp1252","latin-1"):
-        try:
-            with open(TXT, "r", encoding=enc) as f:
-                data = f.read()
-                print("TARS ▶ encoding TXT:", enc)
-                break
-        except (FileNotFoundError, UnicodeDecodeError):
-            continue
-    if not data:
+    try:
+        encoding = detect_text_encoding(TXT)
+        print("TARS ▶ encoding TXT:", encoding)
+    except (FileNotFoundError, UnicodeDecodeError):
         print("❌ Ni DOCX ni TXT lisible trouvés.")
         sys.exit(1)
+    path = TXT
 
-data = normalize(data)
-print("TARS ▶ bytes lus:", len(data))
-
-# Regex robustes (espaces/casse tolérés)
-CHUNK_RE    = re.compile(r"\[\s*CHUNK\s*[:\-]?\s*(\d+)\s*\](.*?)(?=\[\s*CHUNK\s*[:\-]?\s*\d+\s*\]|$)", re.DOTALL|re.IGNORECASE)
-TAG_VAL     = lambda tag: re.compile(r"\[\s*"+tag+r"\s*:\s*(.*?)\]", re.DOTALL|re.IGNORECASE)
-OVERLAP_RE  = re.compile(r"\[\s*OVERLAP\s*\](.*?)\[\s*/\s*OVERLAP\s*\]", re.DOTALL|re.IGNORECASE)
-
-chunks = CHUNK_RE.findall(data)
-print("TARS ▶ chunks détectés:", len(chunks))
-
-rows = []
-for num_str, block in chunks:
-    idx = int(num_str.lstrip("0") or "0")
-    def grab(tag):
-        m = TAG_VAL(tag).search(block);  return m.group(1).strip() if m else ""
-    section       = grab("SECTION")
-    subsection    = grab("SUBSECTION")
-    subsubsection = grab("SUBSUBSECTION")
-    m_overlap     = OVERLAP_RE.search(block)
-    overlap_text  = m_overlap.group(1).strip() if m_overlap else ""
-
-    temp = TAG_VAL("SECTION").sub("", block)
-    temp = TAG_VAL("SUBSECTION").sub("", temp)
-    temp = TAG_VAL("SUBSUBSECTION").sub("", temp)
-    temp = OVERLAP_RE.sub("", temp)
-
-    text_main = "\n".join(ln.strip() for ln in temp.strip().split("\n") if ln.strip())
-
-    rows.append({
-        "id": f"{ID_PREFIX}_ch{int(num_str):04d}",
-        "text": text_main,
-        "section": section,
-        "subsection": subsection,
-        "subsubsection": subsubsection,
-        "chunk_index": idx,
-        "language": LANGUAGE,
-        "source": SOURCE,
-        "overlap_text": overlap_text
-    })
-
-# Écriture CSV
-fields = ["id","text","section","subsection","subsubsection","chunk_index","language","source","overlap_text"]
-with open(OUT, "w", encoding="utf-8-sig", newline="") as f:
-    w = csv.DictWriter(f, fieldnames=fields)
-    w.writeheader(); w.writerows(rows)
-
-print(f"TARS ✅ {len(rows)} chunks exportés -> {OUT}")
+# Écriture CSV au fil du parsing
+n = write_chunks_csv(parse_file(path, ID_PREFIX, LANGUAGE, SOURCE, encoding), OUT, encoding="utf-8-sig")
+print(f"TARS ✅ {n} chunks exportés -> {OUT}")
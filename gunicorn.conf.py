@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+# gunicorn.conf.py — Chargé automatiquement par gunicorn lancé depuis ce dossier
+#
+# Warm-up de chaque worker dès son démarrage (et non à sa première requête) :
+# post_worker_init tourne dans le worker, application déjà importée, y compris
+# avec --preload (import dans le master, warm-up après le fork).
+# Le backend ASGI fait son warm-up dans le lifespan de Starlette : rien à faire ici.
+
+import sys
+
+def post_worker_init(worker):
+    app_module = sys.modules.get("app_flask_backend")
+    if app_module is not None:
+        app_module.readiness.start_once(app_module.WARMUP_STEPS)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# llm_rerank.py — Rerank LLM du pool de candidats en UN appel (sortie structurée JSON)
+#
+# Un rerank naïf coûte un appel par candidat. Ici tous les passages (au plus
+# RERANK_MAX_CANDIDATES, tronqués à RERANK_PASSAGE_TOKENS) partent dans un seul
+# prompt ; le modèle renvoie une note 0-10 par passage (json_schema strict).
+# Les passages notés sous RERANK_MIN_SCORE sont écartés : moins de chunks, prompt
+# de compose_answer plus court. rag_chat ajoute les voisins (neighbour_index) avant
+# la note, pour qu'ils soient filtrés eux aussi (au plus RERANK_MAX_EXPANDED passages).
+#
+#   - cache TTL par (question normalisée, ensemble des ids candidats)
+#   - budget RERANK_BUDGET_MS : au-delà, ordre MMR inchangé ; l'appel en retard
+#     finit en tâche de fond et remplit le cache pour la question suivante
+#   - toute erreur (réseau, JSON invalide) -> ordre MMR
+
+import os, json, hashlib, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional
+from cachetools import TTLCache
+from embedding_cache import normalize_text
+import metrics
+
+RERANK_MODEL: str = os.getenv("RERANK_MODEL", "gpt-4o-mini")
+RERANK_MAX_CANDIDATES: int = int(os.getenv("RERANK_MAX_CANDIDATES", "10"))    # passages envoyés au modèle
+RERANK_MAX_EXPANDED: int = int(os.getenv("RERANK_MAX_EXPANDED", "30"))        # idem, voisins compris
+RERANK_PASSAGE_TOKENS: int = int(os.getenv("RERANK_PASSAGE_TOKENS", "200"))   # troncature par passage
+RERANK_MIN_SCORE: int = int(os.getenv("RERANK_MIN_SCORE", "3"))               # note minimale gardée (0-10)
+RERANK_BUDGET_MS: float = float(os.getenv("RERANK_BUDGET_MS", "1500"))
+RERANK_CACHE_SIZE: int = int(os.getenv("RERANK_CACHE_SIZE", "2000"))
+RERANK_CACHE_TTL: float = float(os.getenv("RERANK_CACHE_TTL", "3600"))
+
+SCHEMA = {
+    "name": "passage_scores",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {"scores": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"id": {"type": "integer"}, "score": {"type": "integer"}},
+            "required": ["id", "score"], "additionalProperties": False}}},
+        "required": ["scores"], "additionalProperties": False,
+    },
+}
+
+_cache: TTLCache = TTLCache(maxsize=RERANK_CACHE_SIZE, ttl=RERANK_CACHE_TTL)
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+def cache_key(question: str, ids: List[str]) -> str:
+    raw = normalize_text(question) + "\x1f" + "\x1f".join(sorted(ids))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def rerank_messages(question: str, cands: List[Dict]) -> List[Dict]:
+    """Prompt de notation : un passage numéroté par candidat, tronqué."""
+    from context_packer import truncate_tokens
+    passages = []
+    for i, c in enumerate(cands):
+        title = " > ".join(p for p in (c.get("section"), c.get("subsection")) if p)
+        text = truncate_tokens(c.get("text", ""), RERANK_PASSAGE_TOKENS)
+        passages.append(f"[{i}] {f'({title}) ' if title else ''}{text}")
+    return [
+        {"role": "system", "content": (
+            "You grade passages retrieved for a question. For each passage give an integer score from 0 "
+            "(unrelated) to 10 (directly answers the question); partial or background information scores 3 to 6. "
+            "Judge each passage on its own content. Return one entry per passage id.")},
+        {"role": "user", "content": f"Question: {question}\n\nPassages:\n" + "\n\n".join(passages)},
+    ]
+
+def parse_scores(content: str, n: int) -> Dict[int, int]:
+    """{position: note} ; positions hors bornes ignorées, notes ramenées dans 0-10."""
+    out: Dict[int, int] = {}
+    for item in json.loads(content).get("scores", []):
+        i = int(item["id"])
+        if 0 <= i < n:
+            out[i] = min(max(int(item["score"]), 0), 10)
+    return out
+
+def _score(client, question: str, cands: List[Dict], key: str) -> Dict[str, int]:
+    """Appel unique au modèle -> {id: note}, mis en cache (même s'il arrive après le budget)."""
+    r = client.chat.completions.create(
+        model=RERANK_MODEL,
+        temperature=0,
+        max_tokens=16 * len(cands) + 32,
+        response_format={"type": "json_schema", "json_schema": SCHEMA},
+        messages=rerank_messages(question, cands),
+        timeout=max(RERANK_BUDGET_MS / 1000.0 * 4, 5.0),   # borne le thread de fond
+    )
+    metrics.usage_tokens(r)
+    by_pos = parse_scores(r.choices[0].message.content or "{}", len(cands))
+    scores = {c["id"]: by_pos[i] for i, c in enumerate(cands) if i in by_pos}
+    with _lock:
+        _cache[key] = scores
+    return scores
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rerank")
+        return _executor
+
+def apply_scores(cands: List[Dict], scores: Dict[str, int], top_k: int,
+                 min_score: int = RERANK_MIN_SCORE) -> List[Dict]:
+    """Tri par note (ordre d'entrée en départage), notes < min_score écartées (le meilleur reste)."""
+    ranked = sorted(range(len(cands)), key=lambda i: (-scores.get(cands[i]["id"], -1), i))
+    kept = [dict(cands[i], rerank_score=scores.get(cands[i]["id"])) for i in ranked]
+    good = [c for c in kept if (c["rerank_score"] or 0) >= min_score]
+    return (good or kept[:1])[:top_k]
+
+def rerank(client, question: str, cands: List[Dict], top_k: int, budget_ms: float = RERANK_BUDGET_MS,
+           max_candidates: int = RERANK_MAX_CANDIDATES,
+           fallback: Optional[Callable[[], List[Dict]]] = None) -> List[Dict]:
+    """Candidats (ordre MMR) -> top_k reclassés par le LLM ; si budget dépassé ou erreur,
+    fallback() ou à défaut les top_k premiers (ordre MMR)."""
+    cands = cands[:max_candidates]
+    degrade = fallback or (lambda: cands[:top_k])
+    if len(cands) <= 1:
+        return cands[:top_k]
+    key = cache_key(question, [c["id"] for c in cands])
+    with _lock:
+        scores = _cache.get(key)
+    metrics.cache_event("rerank", scores is not None)
+    if scores is None:
+        pending = _pool().submit(contextvars.copy_context().run, _score, client, question, cands, key)
+        try:
+            with metrics.stage("rerank"):
+                scores = pending.result(timeout=budget_ms / 1000.0)
+        except FutureTimeout:
+            print("[Rerank] budget dépassé, ordre MMR")
+            metrics.add("rerank_timeouts")
+            return degrade()
+        except Exception as e:
+            print(f"[Rerank] échec ({e}), ordre MMR")
+            metrics.add("rerank_errors")
+            return degrade()
+    return apply_scores(cands, scores, top_k)
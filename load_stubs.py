@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+# load_stubs.py — Faux serveurs OpenAI et Pinecone pour les tests de charge hors-ligne (load_test.py)
+#
+# Juste ce que les backends appellent, au format des vraies API (les SDK officiels
+# les parlent sans modification) :
+#   OpenAI   POST /v1/embeddings, /v1/responses (stream ou non), /v1/chat/completions
+#            -> OPENAI_BASE_URL=http://127.0.0.1:8701/v1
+#   Pinecone POST /query, /describe_index_stats, GET /vectors/fetch
+#            -> VECTOR_BACKEND=pinecone INDEX_HOST=http://127.0.0.1:8702
+#
+# Latences tirées d'une distribution par appel : "40" fixe, "40/120" log-normale
+# (p50 40 ms, p99 120 ms). Génération : TTFT puis --gen-tokens deltas espacés de
+# --token-ms (en streaming, le rythme des tokens est celui du vrai flux).
+# 429 injectés : au hasard (--p429) et/ou au-delà d'un débit (--rpm, seau de jetons
+# par modèle), avec Retry-After comme OpenAI : le SDK réessaie, le backend le subit.
+#
+# Embeddings : sac de mots haché (bench_hybrid.stub_embed, complété par des zéros
+# jusqu'à --dim) ; le faux Pinecone indexe chunks.csv avec les mêmes vecteurs, les
+# résultats sont donc cohérents. Tous les namespaces servent le même corpus.
+#
+# GET /stub/stats (compteurs, 429, pic d'appels simultanés), POST /stub/reset.
+# Usage: python load_stubs.py [--openai-port 8701] [--pinecone-port 8702] [--embed-ms 40/120]
+#                             [--ttft-ms 300/900] [--token-ms 15] [--p429 0.01] [--rpm 3000]
+
+import csv, json, time, uuid, random, asyncio, argparse, tempfile
+from typing import Dict, List, Optional
+import numpy as np
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+STUB_TEXT = ("TARS stub answer: this text stands in for a generated reply so that the load test measures "
+             "our serving stack, not the model. ").split(" ")
+
+# ================= DISTRIBUTIONS =================
+class Latency:
+    """Latence en ms : "40" fixe, "40/120" log-normale de p50 40 et p99 120, "0" aucune."""
+
+    Z99 = 2.3263
+
+    def __init__(self, spec: str):
+        self.spec = str(spec)
+        p50, _, p99 = self.spec.partition("/")
+        self.p50 = float(p50)
+        self.sigma = np.log(float(p99) / self.p50) / self.Z99 if p99 and self.p50 > 0 else 0.0
+
+    def sample(self) -> float:
+        """Secondes."""
+        if self.p50 <= 0:
+            return 0.0
+        if not self.sigma:
+            return self.p50 / 1000.0
+        return random.lognormvariate(np.log(self.p50), self.sigma) / 1000.0
+
+    def __repr__(self) -> str:
+        return self.spec
+
+class TokenBucket:
+    """Débit max par minute (0 = illimité) ; take() False = la requête doit recevoir un 429."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(per_minute / 60.0, 1.0)   # une seconde de rafale
+        self.tokens, self.t = self.capacity, time.monotonic()
+
+    def take(self) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+        self.t = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+# ================= ÉTAT =================
+class StubStats:
+    """Compteurs par route : appels, 429, appels simultanés (pic)."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.calls: Dict[str, int] = {}
+        self.throttled: Dict[str, int] = {}
+        self.in_flight: Dict[str, int] = {}
+        self.peak: Dict[str, int] = {}
+        self.since = time.time()
+
+    def enter(self, route: str) -> None:
+        self.calls[route] = self.calls.get(route, 0) + 1
+        n = self.in_flight[route] = self.in_flight.get(route, 0) + 1
+        self.peak[route] = max(self.peak.get(route, 0), n)
+
+    def leave(self, route: str) -> None:
+        self.in_flight[route] -= 1
+
+    def to_dict(self) -> Dict:
+        return {"seconds": round(time.time() - self.since, 3), "calls": self.calls,
+                "throttled": self.throttled, "peak_in_flight": self.peak}
+
+class _Tracked:
+    """async with : compte l'appel dans les stats de la route (pic d'appels simultanés)."""
+
+    def __init__(self, stats: StubStats, route: str):
+        self.stats, self.route = stats, route
+
+    async def __aenter__(self):
+        self.stats.enter(self.route)
+
+    async def __aexit__(self, *exc):
+        self.stats.leave(self.route)
+
+def _stats_routes(stats: StubStats) -> List[Route]:
+    async def get_stats(request: Request):
+        return JSONResponse(stats.to_dict())
+
+    async def reset_stats(request: Request):
+        stats.reset()
+        return JSONResponse({"ok": True})
+
+    return [Route("/stub/stats", get_stats, methods=["GET"]), Route("/stub/reset", reset_stats, methods=["POST"])]
+
+def pad(mat: np.ndarray, dim: int) -> np.ndarray:
+    """Complète par des zéros jusqu'à `dim` (cosinus inchangés, taille des réponses réaliste)."""
+    if mat.shape[1] >= dim:
+        return mat
+    return np.pad(mat, ((0, 0), (0, dim - mat.shape[1])))
+
+# ================= OPENAI =================
+def openai_app(embed_ms: str = "40/120", ttft_ms: str = "300/900", token_ms: float = 15.0,
+               gen_tokens: int = 60, p429: float = 0.0, rpm: float = 0.0, dim: int = 1536) -> Starlette:
+    from bench_hybrid import stub_embed
+    embed_lat, ttft_lat = Latency(embed_ms), Latency(ttft_ms)
+    stats = StubStats()
+    buckets: Dict[str, TokenBucket] = {}
+    words = (STUB_TEXT * (gen_tokens // len(STUB_TEXT) + 1))[:gen_tokens]
+    deltas = [w + " " for w in words]
+
+    def throttled(route: str, model: str) -> Optional[JSONResponse]:
+        bucket = buckets.setdefault(model, TokenBucket(rpm))
+        if random.random() < p429 or not bucket.take():
+            stats.throttled[route] = stats.throttled.get(route, 0) + 1
+            return JSONResponse({"error": {"message": f"Rate limit reached for {model} (stub)", "type": "requests",
+                                           "param": None, "code": "rate_limit_exceeded"}},
+                                status_code=429, headers={"retry-after-ms": "200", "retry-after": "1"})
+        return None
+
+    def usage_in(prompt) -> int:
+        return max(1, len(str(prompt)) // 4)
+
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        refused = throttled("embeddings", body.get("model", ""))
+        if refused is not None:
+            return refused
+        async with _Tracked(stats, "embeddings"):
+            await asyncio.sleep(embed_lat.sample())
+            vecs = pad(stub_embed(texts), dim)
+        n = sum(usage_in(t) for t in texts)
+        return JSONResponse({"object": "list", "model": body.get("model"),
+                             "data": [{"object": "embedding", "index": i, "embedding": v.tolist()}
+                                      for i, v in enumerate(vecs)],
+                             "usage": {"prompt_tokens": n, "total_tokens": n}})
+
+    def response_obj(model: str, text: str, prompt_tokens: int, status: str = "completed") -> Dict:
+        return {"id": "resp_" + uuid.uuid4().hex, "object": "response", "created_at": int(time.time()),
+                "model": model, "status": status, "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+                "output": [{"type": "message", "id": "msg_" + uuid.uuid4().hex, "role": "assistant",
+                            "status": "completed",
+                            "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+                "usage": {"input_tokens": prompt_tokens, "output_tokens": len(deltas),
+                          "total_tokens": prompt_tokens + len(deltas),
+                          "input_tokens_details": {"cached_tokens": 0},
+                          "output_tokens_details": {"reasoning_tokens": 0}}}
+
+    async def responses(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        prompt_tokens = usage_in(body.get("input"))
+        refused = throttled("responses", model)
+        if refused is not None:
+            return refused
+        if not body.get("stream"):
+            async with _Tracked(stats, "responses"):
+                await asyncio.sleep(ttft_lat.sample() + token_ms * len(deltas) / 1000.0)
+            return JSONResponse(response_obj(model, "".join(deltas), prompt_tokens))
+
+        async def events():
+            async with _Tracked(stats, "responses_stream"):
+                seq = 0
+                await asyncio.sleep(ttft_lat.sample())
+                for i, d in enumerate(deltas):
+                    if i:
+                        await asyncio.sleep(token_ms / 1000.0)
+                    seq += 1
+                    yield _sse("response.output_text.delta", {"type": "response.output_text.delta", "delta": d,
+                                                              "item_id": "msg_stub", "output_index": 0,
+                                                              "content_index": 0, "sequence_number": seq})
+                yield _sse("response.completed", {"type": "response.completed", "sequence_number": seq + 1,
+                                                  "response": response_obj(model, "".join(deltas), prompt_tokens)})
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "")
+        refused = throttled("chat", model)
+        if refused is not None:
+            return refused
+        async with _Tracked(stats, "chat"):
+            await asyncio.sleep(ttft_lat.sample() + token_ms * len(deltas) / 1000.0)
+        prompt_tokens = usage_in(body.get("messages"))
+        return JSONResponse({"id": "chatcmpl-" + uuid.uuid4().hex, "object": "chat.completion",
+                             "created": int(time.time()), "model": model,
+                             "choices": [{"index": 0, "finish_reason": "stop",
+                                          "message": {"role": "assistant", "content": "".join(deltas)}}],
+                             "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(deltas),
+                                       "total_tokens": prompt_tokens + len(deltas)}})
+
+    return Starlette(routes=[
+        Route("/v1/embeddings", embeddings, methods=["POST"]),
+        Route("/v1/responses", responses, methods=["POST"]),
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        *_stats_routes(stats),
+    ])
+
+def _sse(event: str, payload: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+# ================= PINECONE =================
+def build_corpus(csv_path: str, dim: int) -> str:
+    """Index local (vector_store) de chunks.csv avec les embeddings du faux OpenAI ; renvoie le dossier."""
+    from bench_hybrid import stub_embed
+    from vector_store import save_local_index, DEFAULT_NAMESPACE
+    from upsert_openai_simple import build_metadata
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = [r for r in csv.DictReader(f) if (r.get("text") or "").strip()]
+    root = tempfile.mkdtemp(prefix="load_stubs_")
+    save_local_index([r["id"] for r in rows], pad(stub_embed([r["text"] for r in rows]), dim),
+                     [build_metadata(r) for r in rows], DEFAULT_NAMESPACE, root)
+    print(f"TARS ✅ faux Pinecone : {len(rows)} chunks de {csv_path} ({dim} dims)")
+    return root
+
+def pinecone_app(root: str, query_ms: str = "25/80", p429: float = 0.0) -> Starlette:
+    from vector_store import LocalIndex
+    idx = LocalIndex(root=root)
+    ids, mat, metas = idx._load(idx.default_namespace)
+    pos = {vid: i for i, vid in enumerate(ids)}
+    query_lat = Latency(query_ms)
+    stats = StubStats()
+
+    def throttled(route: str) -> Optional[JSONResponse]:
+        if random.random() < p429:
+            stats.throttled[route] = stats.throttled.get(route, 0) + 1
+            return JSONResponse({"code": 8, "message": "Request rate limit exceeded (stub)"}, status_code=429)
+        return None
+
+    def search(vector, top_k: int, include_values: bool) -> List[Dict]:
+        res = idx.query(vector=vector, top_k=top_k, include_metadata=True, include_values=include_values)
+        return [{"id": m["id"], "score": float(m["score"]),
+                 "values": [float(x) for x in m["values"]] if include_values else [],
+                 "metadata": m["metadata"] if "metadata" in m else {}} for m in res["matches"]]
+
+    async def query(request: Request):
+        body = await request.json()
+        refused = throttled("query")
+        if refused is not None:
+            return refused
+        async with _Tracked(stats, "query"):
+            await asyncio.sleep(query_lat.sample())
+            matches = await asyncio.to_thread(search, body["vector"], int(body.get("topK", 10)),
+                                              bool(body.get("includeValues")))
+        return JSONResponse({"matches": matches, "namespace": body.get("namespace", ""), "usage": {"readUnits": 5}})
+
+    async def fetch(request: Request):
+        wanted = request.query_params.getlist("ids")
+        async with _Tracked(stats, "fetch"):
+            await asyncio.sleep(query_lat.sample())
+        vectors = {vid: {"id": vid, "values": [float(x) for x in mat[pos[vid]]], "metadata": metas[pos[vid]]}
+                   for vid in wanted if vid in pos}
+        return JSONResponse({"vectors": vectors, "namespace": request.query_params.get("namespace", ""),
+                             "usage": {"readUnits": 1}})
+
+    async def describe_index_stats(request: Request):
+        return JSONResponse({"namespaces": {idx.default_namespace: {"vectorCount": len(ids)}},
+                             "dimension": int(mat.shape[1]), "indexFullness": 0.0, "totalVectorCount": len(ids)})
+
+    return Starlette(routes=[
+        Route("/query", query, methods=["POST"]),
+        Route("/vectors/fetch", fetch, methods=["GET"]),
+        Route("/describe_index_stats", describe_index_stats, methods=["GET", "POST"]),
+        *_stats_routes(stats),
+    ])
+
+# ================= MAIN =================
+async def serve(apps: Dict[int, Starlette], host: str) -> None:
+    import uvicorn
+    servers = [uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning",
+                                             backlog=4096, timeout_keep_alive=30))
+               for port, app in apps.items()]
+    await asyncio.gather(*(s.serve() for s in servers))
+
+def main():
+    ap = argparse.ArgumentParser(description="Faux OpenAI + Pinecone (latences, streaming, 429) pour load_test.py")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--openai-port", type=int, default=8701, help="0 = pas de faux OpenAI")
+    ap.add_argument("--pinecone-port", type=int, default=8702, help="0 = pas de faux Pinecone")
+    ap.add_argument("--csv", default="chunks.csv")
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--embed-ms", default="40/120")
+    ap.add_argument("--query-ms", default="25/80")
+    ap.add_argument("--ttft-ms", default="300/900", help="délai avant le premier token")
+    ap.add_argument("--token-ms", type=float, default=15.0, help="intervalle entre deux deltas")
+    ap.add_argument("--gen-tokens", type=int, default=60)
+    ap.add_argument("--p429", type=float, default=0.0, help="probabilité de 429 par appel OpenAI")
+    ap.add_argument("--rpm", type=float, default=0.0, help="appels/minute par modèle avant 429 (0 = illimité)")
+    ap.add_argument("--pinecone-p429", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    apps: Dict[int, Starlette] = {}
+    if args.openai_port:
+        apps[args.openai_port] = openai_app(args.embed_ms, args.ttft_ms, args.token_ms, args.gen_tokens,
+                                            args.p429, args.rpm, args.dim)
+        print(f"TARS ▶ faux OpenAI   http://{args.host}:{args.openai_port}/v1  (embed {args.embed_ms} ms, "
+              f"TTFT {args.ttft_ms} ms, {args.gen_tokens} tokens × {args.token_ms:g} ms, "
+              f"429 p={args.p429:g} rpm={args.rpm:g})")
+    if args.pinecone_port:
+        apps[args.pinecone_port] = pinecone_app(build_corpus(args.csv, args.dim), args.query_ms, args.pinecone_p429)
+        print(f"TARS ▶ faux Pinecone http://{args.host}:{args.pinecone_port}  (query {args.query_ms} ms)")
+    if not apps:
+        ap.error("aucun serveur à lancer")
+    asyncio.run(serve(apps, args.host))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# load_test.py — Plafond d'un nœud : charge ouverte à RPS cible sur le backend, services externes simulés
+#
+# Lance les faux OpenAI / Pinecone (load_stubs.py), puis pour chaque configuration
+# de service (--configs) démarre le backend avec gunicorn (ou uvicorn), attend /readyz
+# et rejoue un mélange de questions à débit croissant (--rps), arrivées de Poisson :
+# la charge ne ralentit pas quand le serveur sature (pas d'omission coordonnée, la
+# latence compte depuis l'instant d'envoi prévu). Aucun appel payant, aucun réseau.
+#
+# Par palier : débit servi, latence p50/p99, TTFT (streaming), taux d'erreur, et la
+# saturation des workers :
+#   file p99   latence client - durée vue par le serveur (X-Timing / événement done) :
+#              temps passé à attendre un worker ou un thread libre
+#   CPU        cœurs consommés par l'arbre de processus du serveur (/proc, Linux)
+#   appels/req appels OpenAI par requête servie (caches, coalescence) et 429 reçus
+# Plafond = plus haut palier avec p99 ≤ --slo-ms, erreurs ≤ --max-error et débit servi ≥ 90 % du
+# débit envoyé (tirage de Poisson : l'envoyé fluctue autour du cible sur un palier court).
+#
+#   flask:w=2,t=8   gunicorn gthread, 2 workers × 8 threads, app_flask_backend
+#   flask:w=4       gunicorn sync, 4 workers
+#   asgi:w=2        uvicorn, 2 workers, app_async_backend
+#
+# Usage: python load_test.py [--configs "flask:w=2,t=8 asgi:w=2"] [--rps 5,10,20,40] [--duration 20]
+#                            [--stream-ratio 0.5] [--questions q.jsonl] [--slo-ms 3000] [--out load_results.json]
+#        python load_test.py --url http://127.0.0.1:5000 --no-stubs   (serveur déjà lancé)
+#        options des faux services : --stub-args "--ttft-ms 500/1500 --p429 0.02"
+
+import os, re, sys, csv, json, time, random, shlex, asyncio, argparse, tempfile, subprocess
+from typing import Dict, List, Optional
+import numpy as np
+import httpx
+
+OPENAI_PORT, PINECONE_PORT = 8701, 8702
+_TOTAL_RE = re.compile(r"total;dur=([\d.]+)")
+
+# ================= CONFIGURATIONS =================
+def parse_config(spec: str, port: int) -> Dict:
+    """'flask:w=2,t=8' -> nom, commande de lancement, nombre de workers."""
+    kind, _, opts = spec.partition(":")
+    params = dict(kv.split("=", 1) for kv in opts.split(",") if kv)
+    workers, threads = int(params.get("w", 1)), int(params.get("t", 1))
+    bind = f"127.0.0.1:{port}"
+    if kind == "flask":
+        cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread" if threads > 1 else "sync",
+               "--threads", str(threads), "-b", bind, "--timeout", "120", "--backlog", "2048",
+               "app_flask_backend:app"]
+    elif kind == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "app_async_backend:app", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--backlog", "2048", "--log-level", "warning"]
+    else:
+        raise ValueError(f"configuration inconnue: {spec!r} (attendu: flask:w=N,t=M ou asgi:w=N)")
+    return {"name": spec, "kind": kind, "workers": workers, "threads": threads, "cmd": cmd}
+
+def stub_env(workdir: str) -> Dict[str, str]:
+    """Variables du backend : faux services, caches neufs par configuration (runs comparables)."""
+    return {"OPENAI_BASE_URL": f"http://127.0.0.1:{OPENAI_PORT}/v1", "OPENAI_API_KEY": "stub",
+            "VECTOR_BACKEND": "pinecone", "PINECONE_API_KEY": "stub",
+            "INDEX_HOST": f"http://127.0.0.1:{PINECONE_PORT}",
+            "EMB_CACHE_DB": os.path.join(workdir, "emb_cache.sqlite"), "SESSION_DB": "", "COALESCE_DIR": ""}
+
+# ================= PROCESSUS =================
+def wait_http(url: str, proc: subprocess.Popen, timeout: float, log_path: str) -> None:
+    t_end = time.time() + timeout
+    while time.time() < t_end:
+        if proc.poll() is not None:
+            with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError(f"❌ processus arrêté (code {proc.returncode}) :\n{tail}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    raise RuntimeError(f"❌ {url} pas prêt après {timeout:.0f} s (journal : {log_path})")
+
+def spawn(cmd: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen(cmd, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+def stop(proc: Optional[subprocess.Popen]) -> None:
+    if proc is None or proc.poll() is not None:
+        return
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def cpu_seconds(root_pid: int) -> Optional[float]:
+    """CPU (user+sys, s) du processus et de ses descendants, via /proc ; None hors Linux."""
+    if not os.path.isdir("/proc"):
+        return None
+    parents: Dict[int, int] = {}
+    ticks: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+        ticks[int(entry)] = int(fields[11]) + int(fields[12])
+    tree, frontier = {root_pid}, [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        for child, ppid in parents.items():
+            if ppid == pid and child not in tree:
+                tree.add(child)
+                frontier.append(child)
+    return sum(ticks.get(p, 0) for p in tree) / os.sysconf("SC_CLK_TCK")
+
+def stub_stats(reset: bool = False) -> Dict[str, Dict]:
+    out = {}
+    for name, port in (("openai", OPENAI_PORT), ("pinecone", PINECONE_PORT)):
+        try:
+            if reset:
+                httpx.post(f"http://127.0.0.1:{port}/stub/reset", timeout=2)
+            else:
+                out[name] = httpx.get(f"http://127.0.0.1:{port}/stub/stats", timeout=2).json()
+        except httpx.HTTPError:
+            pass
+    return out
+
+# ================= QUESTIONS =================
+def load_questions(path: Optional[str], csv_path: str) -> List[str]:
+    """JSONL {"question"} (compatible bench_rag --export-questions), texte une par ligne, ou généré depuis chunks.csv."""
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        return [json.loads(l)["question"] if l.startswith("{") else l for l in lines]
+    from bench_hybrid import make_queries
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = [r for r in csv.DictReader(f) if (r.get("text") or "").strip()]
+    return [q for _, q, _ in make_queries(rows)]
+
+# ================= CHARGE =================
+async def one_request(client: httpx.AsyncClient, start: float, scheduled: float, question: str, stream: bool) -> Dict:
+    loop = asyncio.get_running_loop()
+    rec = {"stream": stream, "at": scheduled - start, "lag": loop.time() - scheduled, "ok": False, "ttft": None,
+           "server": None}
+    try:
+        if not stream:
+            r = await client.post("/api/chat", json={"message": question})
+            m = _TOTAL_RE.search(r.headers.get("X-Timing", ""))
+            rec["server"] = float(m.group(1)) / 1000.0 if m else None
+            rec["ok"] = r.status_code == 200 and not r.json().get("answer", "").startswith("Erreur serveur")
+            rec["status"] = r.status_code
+        else:
+            async with client.stream("POST", "/api/chat/stream", json={"message": question}) as r:
+                rec["status"], event = r.status_code, None
+                async for line in r.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                        if event == "delta" and rec["ttft"] is None:
+                            rec["ttft"] = loop.time() - scheduled
+                    elif line.startswith("data: ") and event == "done":
+                        timing = json.loads(line[6:]).get("timing") or {}
+                        rec["server"] = timing.get("total_ms", 0) / 1000.0 or None
+                        rec["ok"] = r.status_code == 200
+        rec["latency"] = loop.time() - scheduled
+    except (httpx.HTTPError, ValueError) as e:
+        rec["latency"], rec["status"], rec["error"] = loop.time() - scheduled, 0, type(e).__name__
+    return rec
+
+async def run_step(base_url: str, questions: List[str], rps: float, duration: float, stream_ratio: float,
+                   timeout: float, rng: random.Random) -> List[Dict]:
+    """Arrivées de Poisson à `rps` pendant `duration` s ; attend la fin de toutes les requêtes lancées."""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        loop = asyncio.get_running_loop()
+        start, t, tasks = loop.time(), 0.0, []
+        while True:
+            t += rng.expovariate(rps)
+            if t >= duration:
+                break
+            await asyncio.sleep(max(0.0, start + t - loop.time()))
+            tasks.append(asyncio.create_task(one_request(client, start, start + t, rng.choice(questions),
+                                                         rng.random() < stream_ratio)))
+        return list(await asyncio.gather(*tasks))
+
+def pct(xs: List[float], p: float) -> Optional[float]:
+    return round(float(np.percentile(xs, p)) * 1000, 1) if xs else None
+
+def summarize(records: List[Dict], rps: float, duration: float, cpu: Optional[float], stubs: Dict) -> Dict:
+    ok = [r for r in records if r["ok"]]
+    lat = [r["latency"] for r in ok]
+    # débit servi : réponses / temps jusqu'à la dernière réponse (un serveur en retard le voit baisser)
+    elapsed = max([duration] + [r["at"] + r["latency"] for r in records])
+    queue = [max(r["latency"] - r["lag"] - r["server"], 0.0) for r in ok if r["server"]]
+    openai_stats = stubs.get("openai", {})
+    return {
+        "rps": rps, "offered": round(len(records) / duration, 2), "throughput": round(len(ok) / elapsed, 2),
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else 0.0,
+        "p50_ms": pct(lat, 50), "p99_ms": pct(lat, 99),
+        "ttft_p50_ms": pct([r["ttft"] for r in ok if r["ttft"]], 50),
+        "ttft_p99_ms": pct([r["ttft"] for r in ok if r["ttft"]], 99),
+        "queue_p50_ms": pct(queue, 50), "queue_p99_ms": pct(queue, 99),
+        "driver_lag_p99_ms": pct([r["lag"] for r in records], 99),
+        "cpu_cores": round(cpu / duration, 2) if cpu is not None else None,
+        "openai_calls_per_req": round(sum(openai_stats.get("calls", {}).values()) / len(ok), 2) if ok else None,
+        "openai_429": sum(openai_stats.get("throttled", {}).values()),
+        "stubs": stubs,
+    }
+
+def within_slo(step: Dict, slo_ms: float, max_error: float) -> bool:
+    return (step["p99_ms"] is not None and step["p99_ms"] <= slo_ms and step["error_rate"] <= max_error
+            and step["throughput"] >= 0.9 * step["offered"])
+
+def print_step(step: Dict) -> None:
+    fmt = lambda v: "-" if v is None else f"{v:g}"
+    print(f"  {step['rps']:>6g} {step['offered']:>7.1f} {step['throughput']:>7.1f} {step['error_rate']:>6.1%} {fmt(step['p50_ms']):>8} "
+          f"{fmt(step['p99_ms']):>8} {fmt(step['ttft_p50_ms']):>8} {fmt(step['ttft_p99_ms']):>8} "
+          f"{fmt(step['queue_p99_ms']):>8} {fmt(step['cpu_cores']):>6} {fmt(step['openai_calls_per_req']):>9} "
+          f"{step['openai_429']:>5}")
+    if step["driver_lag_p99_ms"] and step["driver_lag_p99_ms"] > 50:
+        print(f"  ⚠️ retard du générateur p99 {step['driver_lag_p99_ms']:g} ms : le client sature, chiffres pessimistes")
+
+def run_config(base_url: str, root_pid: Optional[int], questions: List[str], args, rng: random.Random) -> List[Dict]:
+    if args.warmup > 0:
+        asyncio.run(run_step(base_url, questions, min(args.rps), args.warmup, args.stream_ratio, args.timeout, rng))
+    print(f"  {'RPS':>6} {'envoyé':>7} {'servi':>7} {'err':>6} {'p50':>8} {'p99':>8} {'TTFT50':>8} {'TTFT99':>8} "
+          f"{'file99':>8} {'CPU':>6} {'appels/r':>9} {'429':>5}   (ms)")
+    steps = []
+    for rps in args.rps:
+        stub_stats(reset=True)
+        cpu0 = cpu_seconds(root_pid) if root_pid else None
+        records = asyncio.run(run_step(base_url, questions, rps, args.duration, args.stream_ratio, args.timeout, rng))
+        cpu1 = cpu_seconds(root_pid) if root_pid else None
+        step = summarize(records, rps, args.duration, cpu1 - cpu0 if cpu0 is not None and cpu1 is not None else None,
+                         stub_stats())
+        steps.append(step)
+        print_step(step)
+        if step["error_rate"] > 0.5:
+            print("  ⛔ plus de 50 % d'erreurs, paliers suivants ignorés")
+            break
+    return steps
+
+# ================= MAIN =================
+def main():
+    ap = argparse.ArgumentParser(description="Test de charge hors-ligne : plafond RPS par configuration de workers")
+    ap.add_argument("--configs", default="flask:w=1 flask:w=2,t=8 asgi:w=2",
+                    help="configurations séparées par des espaces (flask:w=N,t=M, asgi:w=N)")
+    ap.add_argument("--rps", default="2,5,10,20,40", help="paliers de débit cible")
+    ap.add_argument("--duration", type=float, default=20.0, help="secondes par palier")
+    ap.add_argument("--warmup", type=float, default=3.0, help="secondes de chauffe non mesurées par configuration")
+    ap.add_argument("--stream-ratio", type=float, default=0.5)
+    ap.add_argument("--questions", help="JSONL {question} ou une question par ligne (défaut : générées depuis --csv)")
+    ap.add_argument("--csv", default="chunks.csv")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--slo-ms", type=float, default=3000.0, help="p99 maximal pour compter un palier")
+    ap.add_argument("--max-error", type=float, default=0.01)
+    ap.add_argument("--port", type=int, default=5055)
+    ap.add_argument("--url", help="serveur déjà lancé (aucun démarrage, --configs ignoré)")
+    ap.add_argument("--no-stubs", action="store_true", help="ne pas lancer load_stubs.py (services déjà configurés)")
+    ap.add_argument("--stub-args", default="", help="options passées à load_stubs.py")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="load_results.json")
+    args = ap.parse_args()
+    args.rps = [float(x) for x in args.rps.split(",") if x]
+
+    rng = random.Random(args.seed)
+    questions = load_questions(args.questions, args.csv)
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    here = os.path.dirname(os.path.abspath(__file__))
+    stubs = None
+    results = {"config": {k: v for k, v in vars(args).items()}, "runs": []}
+    try:
+        if not args.no_stubs:
+            stub_log = os.path.join(workdir, "stubs.log")
+            stubs = spawn([sys.executable, os.path.join(here, "load_stubs.py"), "--openai-port", str(OPENAI_PORT),
+                           "--pinecone-port", str(PINECONE_PORT), "--csv", args.csv, *shlex.split(args.stub_args)],
+                          {}, stub_log)
+            wait_http(f"http://127.0.0.1:{PINECONE_PORT}/stub/stats", stubs, 120, stub_log)
+            print(f"TARS ✅ faux services prêts ({args.stub_args or 'latences par défaut'})")
+
+        targets = [({"name": args.url, "workers": None}, args.url)] if args.url else \
+                  [(parse_config(spec, args.port), f"http://127.0.0.1:{args.port}") for spec in args.configs.split()]
+        print(f"TARS ▶ {len(questions)} questions, paliers {args.rps} RPS × {args.duration:g} s, "
+              f"{args.stream_ratio:.0%} en streaming, SLO p99 {args.slo_ms:g} ms")
+        for cfg, base_url in targets:
+            print(f"\nTARS ▶ {cfg['name']}")
+            server = None
+            try:
+                if not args.url:
+                    cfg_dir = tempfile.mkdtemp(prefix=cfg["kind"] + "_", dir=workdir)
+                    log_path = os.path.join(cfg_dir, "server.log")
+                    server = spawn(cfg["cmd"], {} if args.no_stubs else stub_env(cfg_dir), log_path)
+                    wait_http(base_url + "/readyz", server, 120, log_path)
+                steps = run_config(base_url, server.pid if server else None, questions, args, rng)
+            except RuntimeError as e:
+                print(e)
+                results["runs"].append({"server": cfg["name"], "error": str(e)})
+                continue
+            finally:
+                stop(server)
+            passing = [s["rps"] for s in steps if within_slo(s, args.slo_ms, args.max_error)]
+            ceiling = max(passing) if passing else None
+            print(f"  plafond : {ceiling:g} RPS" if ceiling else "  plafond : aucun palier dans le SLO")
+            results["runs"].append({"server": cfg["name"], "workers": cfg["workers"], "steps": steps,
+                                    "ceiling_rps": ceiling})
+    finally:
+        stop(stubs)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nTARS ✅ résultats -> {args.out} (journaux : {workdir})")
+    for run in results["runs"]:
+        if "ceiling_rps" in run:
+            print(f"  {run['server']:<24} plafond {run['ceiling_rps'] or 0:g} RPS")
+
+if __name__ == "__main__":
+    main()
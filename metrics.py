@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# metrics.py — Trace par requête (durées par étape, tokens, caches, taille des pools)
+#              + histogrammes agrégés exposés au format texte Prometheus (/metrics)
+#
+# Coût : deux perf_counter() et un append sous verrou par étape, pas d'allocation
+# en dehors d'une requête tracée. La trace courante vit dans un ContextVar :
+# propre à chaque thread Flask et à chaque tâche asyncio (copiée par asyncio.to_thread).
+#
+#   with metrics.stage("embed"): ...            # histogramme + trace de la requête
+#   metrics.tokens(prompt=n, completion=m)      # compteur global + trace de la requête
+#   metrics.cache_event("embedding", hit=True)
+
+import os, time, threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+TIMING_HEADER: bool = os.getenv("TIMING_HEADER", "1") == "1"   # en-tête X-Timing sur les réponses
+
+# secondes ; couvre cache mémoire (~µs) jusqu'à une génération longue
+LATENCY_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                                      0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS: Tuple[float, ...] = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], label: str):
+        self.name, self.help, self.buckets, self.label = name, help_text, buckets, label
+        self._series: Dict[str, List[float]] = {}   # valeur du label -> [compteurs..., somme, total]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_value)
+            if s is None:
+                s = self._series[label_value] = [0.0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for lv, s in sorted(series.items()):
+            cum = 0.0
+            for b, c in zip(self.buckets, s):
+                cum += c
+                lines.append(f'{self.name}_bucket{{{self.label}="{lv}",le="{b:g}"}} {cum:g}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{lv}",le="+Inf"}} {s[-1]:g}')
+            lines.append(f'{self.name}_sum{{{self.label}="{lv}"}} {s[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{lv}"}} {s[-1]:g}')
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: Tuple[str, ...], amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for lv, v in sorted(values.items()):
+            labels = ",".join(f'{k}="{x}"' for k, x in zip(self.labels, lv))
+            lines.append(f"{self.name}{{{labels}}} {v:g}")
+        return lines
+
+STAGE_SECONDS = Histogram("tars_stage_seconds", "Durée de chaque étape du pipeline RAG", LATENCY_BUCKETS, "stage")
+REQUEST_SECONDS = Histogram("tars_request_seconds", "Durée des requêtes HTTP (jusqu'aux en-têtes pour le streaming)",
+                            LATENCY_BUCKETS, "endpoint")
+POOL_SIZE = Histogram("tars_candidate_pool_size", "Taille des pools de candidats", SIZE_BUCKETS, "pool")
+TOKENS = Counter("tars_tokens_total", "Tokens consommés (prompt / completion)", ("kind",))
+CACHE = Counter("tars_cache_events_total", "Accès aux caches", ("cache", "result"))
+REQUESTS = Counter("tars_requests_total", "Requêtes HTTP par endpoint et statut", ("endpoint", "status"))
+
+# ================= TRACE PAR REQUÊTE =================
+class Trace:
+    __slots__ = ("t0", "stages", "counters")
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages: Dict[str, float] = {}      # secondes cumulées par étape
+        self.counters: Dict[str, float] = {}    # tokens, hits/misses, tailles de pools
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def to_dict(self) -> Dict:
+        return {"total_ms": round(self.elapsed() * 1000, 2),
+                "stages_ms": {k: round(v * 1000, 2) for k, v in self.stages.items()},
+                **self.counters}
+
+    def header(self) -> str:
+        """Format Server-Timing : 'embed;dur=12.3, vector_query;dur=4.1, total;dur=850.0'."""
+        parts = [f"{k};dur={v * 1000:.1f}" for k, v in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+_current: ContextVar[Optional[Trace]] = ContextVar("tars_trace", default=None)
+
+def start_trace() -> Trace:
+    trace = Trace()
+    _current.set(trace)
+    return trace
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+def attach(trace: Optional[Trace]) -> None:
+    """Rattache une trace au contexte courant sans la détacher ensuite (générateur WSGI)."""
+    _current.set(trace)
+
+@contextmanager
+def use_trace(trace: Optional[Trace]):
+    """Réactive une trace dans un autre contexte (générateur de streaming, thread)."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+def record(name: str, seconds: float) -> None:
+    """Durée d'une étape déjà mesurée par l'appelant."""
+    STAGE_SECONDS.observe(name, seconds)
+    trace = _current.get()
+    if trace is not None:
+        trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+def add(name: str, amount: float = 1) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + amount
+
+def tokens(prompt: Optional[int], completion: Optional[int]) -> None:
+    if prompt:
+        TOKENS.inc(("prompt",), prompt); add("prompt_tokens", prompt)
+    if completion:
+        TOKENS.inc(("completion",), completion); add("completion_tokens", completion)
+
+def usage_tokens(response) -> None:
+    """Tokens d'une réponse OpenAI (chat.completions ou responses), si l'usage est fourni."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    tokens(getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None),
+           getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None))
+
+def cache_event(cache: str, hit: bool) -> None:
+    CACHE.inc((cache, "hit" if hit else "miss"))
+    add(f"{cache}_cache_{'hits' if hit else 'misses'}")
+
+def pool_size(pool: str, n: int) -> None:
+    POOL_SIZE.observe(pool, n)
+    add(f"{pool}_pool", n)
+
+def finish_trace(trace: Trace, endpoint: str, status: int) -> None:
+    REQUEST_SECONDS.observe(endpoint, trace.elapsed())
+    REQUESTS.inc((endpoint, str(status)))
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in (REQUEST_SECONDS, STAGE_SECONDS, POOL_SIZE, TOKENS, CACHE, REQUESTS):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
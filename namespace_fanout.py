@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# namespace_fanout.py — Recherche sur plusieurs namespaces de langue en parallèle
+#
+# SEARCH_NAMESPACES="en_v1,fr_v1,es_v1" : la même requête part sur chaque
+# namespace en même temps (pool de threads, ou asyncio.gather côté ASGI), donc
+# la latence totale ≈ celle du namespace le plus lent. Les scores sont
+# normalisés par namespace (divisés par le meilleur score du namespace) puis
+# pondérés : le namespace de la langue détectée garde 1.0, les autres
+# OTHER_LANG_WEIGHT. Le top-k fusionné est trié sur ce score.
+
+import os, asyncio, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+from vector_store import Match
+
+SEARCH_NAMESPACES_ENV: str = os.getenv("SEARCH_NAMESPACES", "")
+LANG_MATCH_WEIGHT: float = float(os.getenv("LANG_MATCH_WEIGHT", "1.0"))
+OTHER_LANG_WEIGHT: float = float(os.getenv("OTHER_LANG_WEIGHT", "0.75"))
+FANOUT_WORKERS: int = int(os.getenv("FANOUT_WORKERS", "8"))
+
+KNOWN_LANGS = ("en", "fr", "es")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def search_namespaces(default: str) -> List[str]:
+    """Namespaces interrogés : SEARCH_NAMESPACES (liste séparée par des virgules) ou `default`."""
+    names = [ns.strip() for ns in SEARCH_NAMESPACES_ENV.split(",") if ns.strip()]
+    return names or [default]
+
+def namespace_lang(namespace: str) -> Optional[str]:
+    """'fr_v1' -> 'fr', 'db_es' -> 'es' ; None si aucune langue connue dans le nom."""
+    for part in (namespace or "").lower().replace("-", "_").split("_"):
+        if part in KNOWN_LANGS:
+            return part
+    return None
+
+def namespace_weight(namespace: str, lang: Optional[str]) -> float:
+    ns_lang = namespace_lang(namespace)
+    if lang is None or ns_lang is None or ns_lang == lang:
+        return LANG_MATCH_WEIGHT
+    return OTHER_LANG_WEIGHT
+
+def _score(item: Any) -> float:
+    if isinstance(item, dict):
+        return float(item.get("score") or 0.0)
+    return float(getattr(item, "score", 0.0) or 0.0)
+
+def merge_namespaces(per_ns: Dict[str, Sequence[Any]], lang: Optional[str],
+                     top_k: Optional[int] = None) -> List[Tuple[str, Any, float]]:
+    """{namespace: résultats triés} -> [(namespace, résultat, score normalisé pondéré)] trié.
+
+    Un seul namespace : scores inchangés (pas de renormalisation).
+    """
+    if len(per_ns) == 1:
+        (ns, items), = per_ns.items()
+        merged = [(ns, it, _score(it)) for it in items]
+        return merged[:top_k] if top_k else merged
+    merged = []
+    for ns, items in per_ns.items():
+        best = max((_score(it) for it in items), default=0.0)
+        w = namespace_weight(ns, lang)
+        for it in items:
+            merged.append((ns, it, w * (_score(it) / best if best > 0 else 0.0)))
+    merged.sort(key=lambda x: x[2], reverse=True)
+    return merged[:top_k] if top_k else merged
+
+# ================= EXÉCUTION =================
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+        return _executor
+
+def fan_out(fn: Callable[[str], Sequence[Any]], namespaces: Sequence[str]) -> Dict[str, Sequence[Any]]:
+    """Appelle fn(namespace) sur chaque namespace en parallèle ; un namespace en erreur est ignoré."""
+    if len(namespaces) == 1:
+        return {namespaces[0]: fn(namespaces[0])}
+    # contexte copié : la trace de la requête (metrics) suit dans les threads
+    futures = {ns: _pool().submit(contextvars.copy_context().run, fn, ns) for ns in namespaces}
+    out = {}
+    for ns, fut in futures.items():
+        try:
+            out[ns] = fut.result()
+        except Exception as e:
+            print(f"[Fan-out] namespace {ns} ignoré: {e}")
+    if not out:
+        raise RuntimeError("aucun namespace n'a répondu")
+    return out
+
+async def afan_out(fn: Callable[[str], Awaitable[Sequence[Any]]], namespaces: Sequence[str]) -> Dict[str, Sequence[Any]]:
+    """Version asyncio de fan_out (asyncio.gather)."""
+    results = await asyncio.gather(*(fn(ns) for ns in namespaces), return_exceptions=True)
+    out = {}
+    for ns, res in zip(namespaces, results):
+        if isinstance(res, Exception):
+            print(f"[Fan-out] namespace {ns} ignoré: {res}")
+        else:
+            out[ns] = res
+    if not out:
+        raise RuntimeError("aucun namespace n'a répondu")
+    return out
+
+def merged_matches(per_ns: Dict[str, Any], lang: Optional[str], top_k: int) -> Dict[str, List]:
+    """Réponses idx.query par namespace -> {"matches": [...]} fusionné (forme d'une réponse idx.query)."""
+    per_ns = {ns: list(res["matches"]) for ns, res in per_ns.items()}
+    if len(per_ns) == 1:
+        return {"matches": next(iter(per_ns.values()))[:top_k]}
+    matches = []
+    for ns, m, score in merge_namespaces(per_ns, lang, top_k):
+        values = m.get("values") if isinstance(m, dict) else getattr(m, "values", None)
+        matches.append(Match(id=m["id"], score=score, metadata=m["metadata"], values=values or None, namespace=ns))
+    return {"matches": matches}
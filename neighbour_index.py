@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# neighbour_index.py — Index d'adjacence des chunks (voisins / sous-section) en mémoire
+#
+# Construit une fois au démarrage depuis chunks.csv (ou, à défaut, les métadonnées
+# de l'index local) : pour chaque id, le chunk précédent/suivant de la même source
+# (chunk_index consécutifs) et la liste ordonnée des chunks de sa sous-section.
+# expand() ajoute ces chunks aux hits par simples lookups de dict : aucun appel
+# supplémentaire au vector store. context_packer fusionne ensuite les voisins.
+#
+# Avec SEARCH_NAMESPACES (un namespace par langue), un index par namespace :
+# chunks.csv pour le namespace par défaut, chunks_{namespace}.csv (ou l'index
+# local du namespace) pour les autres ; les voisins d'un hit sont cherchés dans
+# son propre namespace (champ "namespace" du hit, défaut sinon).
+
+import os, csv
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from vector_store import load_local_index, DEFAULT_NAMESPACE
+
+CHUNKS_CSV: str = os.getenv("CHUNKS_CSV", "chunks.csv")
+CHUNKS_CSV_NS: str = os.getenv("CHUNKS_CSV_NS", "chunks_{namespace}.csv")   # autres namespaces
+NEIGHBOUR_WINDOW: int = int(os.getenv("NEIGHBOUR_WINDOW", "1"))   # 0 = pas d'expansion
+EXPAND_MODE: str = os.getenv("EXPAND_MODE", "neighbours")         # "neighbours" | "subsection"
+SUBSECTION_MAX_CHUNKS: int = 6
+NEIGHBOUR_DECAY: float = 0.9   # score d'un voisin = score du hit × decay
+
+RECORD_KEYS = ("text", "section", "subsection", "subsubsection", "chunk_index", "source", "overlap_text")
+
+class NeighbourIndex:
+    def __init__(self, records: Dict[str, Dict]):
+        self.records = records
+        self.prev: Dict[str, str] = {}
+        self.next: Dict[str, str] = {}
+        self.sections: Dict[Tuple[str, str, str, str], List[str]] = {}
+        by_pos: Dict[Tuple[str, int], str] = {}
+        for vid, r in records.items():
+            idx = _as_int(r.get("chunk_index"))
+            if idx is not None:
+                by_pos[(r.get("source", ""), idx)] = vid
+        for (source, idx), vid in by_pos.items():
+            before = by_pos.get((source, idx - 1))
+            if before is not None:
+                self.prev[vid], self.next[before] = before, vid
+        for (source, idx), vid in sorted(by_pos.items()):
+            self.sections.setdefault(self.section_key(vid), []).append(vid)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict]) -> "NeighbourIndex":
+        return cls({r["id"]: {k: r.get(k, "") for k in RECORD_KEYS} for r in rows if r.get("id")})
+
+    @classmethod
+    def from_csv(cls, path: str = CHUNKS_CSV) -> "NeighbourIndex":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            return cls.from_rows(csv.DictReader(f))
+
+    @classmethod
+    def from_local_index(cls, namespace: str = DEFAULT_NAMESPACE) -> Optional["NeighbourIndex"]:
+        loaded = load_local_index(namespace)
+        if loaded is None:
+            return None
+        ids, _, metas = loaded
+        return cls.from_rows(dict(m, id=vid) for vid, m in zip(ids, metas))
+
+    def section_key(self, vid: str) -> Tuple[str, str, str, str]:
+        r = self.records.get(vid, {})
+        return (r.get("source", ""), r.get("section", ""), r.get("subsection", ""), r.get("subsubsection", ""))
+
+    # ---- lookups ----
+    def neighbours(self, vid: str, window: int = NEIGHBOUR_WINDOW) -> List[str]:
+        """Ids des `window` chunks avant et après `vid` (ordre du document, `vid` exclu)."""
+        before, after = [], []
+        cur = vid
+        for _ in range(window):
+            cur = self.prev.get(cur)
+            if cur is None: break
+            before.append(cur)
+        cur = vid
+        for _ in range(window):
+            cur = self.next.get(cur)
+            if cur is None: break
+            after.append(cur)
+        return before[::-1] + after
+
+    def subsection(self, vid: str, limit: int = SUBSECTION_MAX_CHUNKS) -> List[str]:
+        """Chunks de la même sous-section, centrés sur `vid` si elle dépasse `limit`."""
+        ids = self.sections.get(self.section_key(vid), [])
+        if vid not in ids or len(ids) <= limit:
+            return [i for i in ids if i != vid]
+        pos = ids.index(vid)
+        start = max(0, min(pos - limit // 2, len(ids) - limit))
+        return [i for i in ids[start:start + limit] if i != vid]
+
+    def expand(self, hits: List[Dict], window: int = NEIGHBOUR_WINDOW, mode: str = EXPAND_MODE) -> List[Dict]:
+        """Ajoute aux hits leurs voisins (ou leur sous-section) sous forme de hits dérivés."""
+        if window <= 0 and mode != "subsection":
+            return hits
+        seen = {h.get("id") for h in hits}
+        out = list(hits)
+        for h in hits:
+            vid = h.get("id")
+            extra = self.subsection(vid) if mode == "subsection" else self.neighbours(vid, window)
+            for nid in extra:
+                if nid in seen or nid not in self.records:
+                    continue
+                seen.add(nid)
+                out.append(dict(self.records[nid], id=nid, score=h.get("score", 0.0) * NEIGHBOUR_DECAY,
+                                expanded_from=vid, is_db=True))
+        return out
+
+class NamespacedNeighbours:
+    """Un NeighbourIndex par namespace ; même API expand() que NeighbourIndex."""
+
+    def __init__(self, indexes: Dict[str, NeighbourIndex], default: str = DEFAULT_NAMESPACE):
+        self.indexes = indexes
+        self.default = default
+
+    def get(self, namespace: Optional[str]) -> Optional[NeighbourIndex]:
+        return self.indexes.get(namespace or self.default)
+
+    def expand(self, hits: List[Dict], window: int = NEIGHBOUR_WINDOW, mode: str = EXPAND_MODE) -> List[Dict]:
+        """Voisins de chaque hit pris dans le namespace du hit (un id peut exister dans plusieurs namespaces)."""
+        groups: Dict[str, List[Dict]] = {}
+        for h in hits:
+            groups.setdefault(h.get("namespace") or self.default, []).append(h)
+        out = list(hits)
+        for ns, group in groups.items():
+            index = self.get(ns)
+            if index is None:
+                continue
+            out.extend(dict(extra, namespace=ns) for extra in index.expand(group, window, mode)[len(group):])
+        return out
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _load_one(csv_path: str, namespace: str) -> Optional[NeighbourIndex]:
+    if os.path.exists(csv_path):
+        return NeighbourIndex.from_csv(csv_path)
+    return NeighbourIndex.from_local_index(namespace)
+
+def load_neighbour_index(csv_path: str = CHUNKS_CSV, namespace: str = DEFAULT_NAMESPACE,
+                         namespaces: Optional[Sequence[str]] = None) -> Optional[NamespacedNeighbours]:
+    """Un index par namespace de `namespaces` (défaut : `namespace` seul) ; `csv_path` est celui de
+    `namespace`, CHUNKS_CSV_NS celui des autres, sinon métadonnées de l'index local. None si aucune source."""
+    if NEIGHBOUR_WINDOW <= 0 and EXPAND_MODE != "subsection":
+        return None
+    default = namespace or DEFAULT_NAMESPACE
+    indexes: Dict[str, NeighbourIndex] = {}
+    for ns in dict.fromkeys(ns or default for ns in (namespaces or [default])):
+        index = _load_one(csv_path if ns == default else CHUNKS_CSV_NS.format(namespace=ns), ns)
+        if index is not None:
+            indexes[ns] = index
+    return NamespacedNeighbours(indexes, default) if indexes else None
@@ -2,6 +2,7 @@
 
 from openai import OpenAI
 from pinecone import Pinecone
+from embedding_cache import cached_embedding
 
 # --- Clés (doivent être dans index_key.env)
 env_file = "index_key.env"
@@ -21,7 +22,7 @@ idx    = pc.Index("aya-1536")
 query_text = "Comment se déroule une cérémonie d'Ayahuasca ?"
 
 # --- Embedding
-embedding = client.embeddings.create(model="text-embedding-3-small", input=[query_text]).data[0].embedding
+embedding = cached_embedding(client, "text-embedding-3-small", query_text)
 
 # --- Requête Pinecone
 results = idx.query(vector=embedding, top_k=3, include_metadata=True)
@@ -1,10 +1,22 @@
 # -*- coding: utf-8 -*-
 # rag_chat.py — TARS RAG multilingue (FR/ES/EN)
 
-import os, math, time
+import os, time
 from typing import List, Dict, Tuple
-from openai import OpenAI
-from pinecone import Pinecone
+import numpy as np
+from vector_store import namespaces_version, VECTOR_BACKEND
+from bm25_index import BM25Index, rrf_fuse
+from vector_codes import VectorCodes
+from llm_rerank import rerank, RERANK_MAX_CANDIDATES, RERANK_MAX_EXPANDED
+from embedding_cache import get_cache
+from answer_cache import SemanticAnswerCache, ANSWER_CACHE_ENABLED
+from chat_core import detect_lang
+import metrics
+from clients import Lazy, make_openai, make_index, warm_openai, warm_index, warm_local_caches, Readiness
+from context_packer import pack_context, format_stats, MAX_CONTEXT_TOKENS
+from neighbour_index import load_neighbour_index
+from namespace_fanout import search_namespaces, fan_out, merge_namespaces
+from session_store import SessionStore, new_session_id, history_messages, openai_summarizer, compact_in_background
 
 # ================= CONFIG =================
 # Lecture sécurisée des clés depuis les variables d'environnement
@@ -13,139 +25,223 @@ PINECONE_API_KEY: str = os.getenv("PINECONE_API_KEY")
 INDEX_HOST: str = os.getenv("INDEX_HOST")
 INDEX_NAME: str = os.getenv("INDEX_NAME")
 
-if not all([OPENAI_API_KEY, PINECONE_API_KEY, INDEX_HOST, INDEX_NAME]):
-    raise RuntimeError("❌ Une ou plusieurs variables d'environnement sont manquantes !")
-
 NAMESPACE: str = "en_v1"
+NAMESPACES: List[str] = search_namespaces(NAMESPACE)  # SEARCH_NAMESPACES="en_v1,fr_v1,es_v1"
 MODEL_EMB: str = "text-embedding-3-small"
 MODEL_CHAT: str = "gpt-4o-mini"
 
 TOP_K: int = 5
-USE_LLM_RERANK: bool = False
+USE_LLM_RERANK: bool = os.getenv("USE_LLM_RERANK", "0") == "1"   # un appel LLM note tout le pool (llm_rerank)
 MMR_LAMBDA: float = 0.7
+USE_HYBRID: bool = os.getenv("USE_HYBRID", "1") == "1"   # BM25 + vecteur, fusion RRF
 
 SHOW_SOURCES: bool = False
 MAX_OUTPUT_TOKENS: int = 400
-MAX_CONTEXT_CHARS: int = 5000
-MEMORY_TURNS: int = 1
+SHOW_CONTEXT_STATS: bool = os.getenv("SHOW_CONTEXT_STATS", "0") == "1"
 
 # ================= INITIALISATION =================
-client: OpenAI = OpenAI(api_key=OPENAI_API_KEY)
-pc: Pinecone = Pinecone(api_key=PINECONE_API_KEY)
-idx = pc.Index(name=INDEX_NAME, host=INDEX_HOST)
+# clients paresseux : une variable manquante lève au premier usage, pas à l'import
+client = Lazy(lambda: make_openai(OPENAI_API_KEY), "openai")
+idx = Lazy(lambda: make_index(PINECONE_API_KEY, INDEX_NAME, INDEX_HOST), "index")
+readiness = Readiness()
+answer_cache = SemanticAnswerCache(version_fn=lambda: namespaces_version(NAMESPACES))
+# index BM25 par namespace ; None -> recherche vectorielle seule sur ce namespace
+bm25: Dict[str, BM25Index] = {ns: BM25Index.load(ns) for ns in NAMESPACES} if USE_HYBRID else {}
+neighbours = load_neighbour_index(namespace=NAMESPACE, namespaces=NAMESPACES)   # voisins des hits, par namespace
+# vecteurs quantifiés par namespace (vector_codes.npz) : requêtes sans include_values, MMR sur ces vecteurs
+vector_codes: Dict[str, VectorCodes] = {ns: VectorCodes.load(ns) for ns in NAMESPACES}
 
 # ================= UTILITAIRES =================
-_emb_cache: Dict[str, List[float]] = {}
-
-def embed(text: str) -> List[float]:
-    """Renvoie le vecteur embedding d'un texte, avec cache."""
-    if text in _emb_cache:
-        return _emb_cache[text]
+def _embed_remote(text: str) -> List[float]:
     for attempt in range(1, 4):
         try:
-            v = client.embeddings.create(model=MODEL_EMB, input=text).data[0].embedding
-            _emb_cache[text] = v
-            return v
+            return client.embeddings.create(model=MODEL_EMB, input=text).data[0].embedding
         except Exception as e:
             print(f"[Embed] Tentative {attempt} échouée: {e}")
             time.sleep(1.5 * attempt)
     raise RuntimeError("Embedding failed")
 
-def detect_lang(text: str) -> str:
-    t = (text or "").strip().lower()
-    fr_hint = any(ch in t for ch in ("é", "è", "à", "ç", "ô", "ù", "ï", "â"))
-    es_hint = any(ch in t for ch in ("¿", "¡", "ñ", "á", "é", "í", "ó", "ú"))
-    lang = "en"
-    if fr_hint: lang = "fr"
-    if es_hint: lang = "es"
-    return lang
-
-def _cos(u, v):
-    if not u or not v: return 0.0
-    du = math.sqrt(sum(x*x for x in u))
-    dv = math.sqrt(sum(y*y for y in v))
-    if du == 0 or dv == 0: return 0.0
-    return sum(x*y for x, y in zip(u, v)) / (du*dv)
+def embed(text: str) -> List[float]:
+    """Renvoie le vecteur embedding d'un texte, avec cache partagé (mémoire + disque)."""
+    return get_cache().get_or_embed(MODEL_EMB, text, _embed_remote)
 
 def mmr_select(cands: List[Dict], k: int, lam: float = MMR_LAMBDA) -> List[Dict]:
-    selected, rest = [], [c for c in cands if c.get("values")]
+    """MMR vectorisé : normalisation unique, max de similarité courant mis à jour à chaque choix."""
+    rest = [c for c in cands if c.get("values") is not None and len(c["values"])]
     if not rest: return cands[:k]
     rest.sort(key=lambda x: x["score"], reverse=True)
-    selected.append(rest.pop(0))
-    while rest and len(selected) < k:
-        best, best_val = None, -1e9
-        for c in rest:
-            sim_to_sel = max(_cos(c["values"], s["values"]) for s in selected)
-            val = lam*c["score"] - (1-lam)*sim_to_sel
-            if val > best_val:
-                best_val, best = val, c
-        selected.append(best)
-        rest.remove(best)
-    return selected
-
-def search(query: str, top_k: int = TOP_K) -> List[Dict]:
-    qvec = embed(query)
+    n = len(rest)
+    k = min(max(k, 1), n)  # comme avant : au moins le meilleur candidat
+
+    mat = np.asarray([c["values"] for c in rest], dtype=np.float64)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    mat = np.divide(mat, norms, out=np.zeros_like(mat), where=norms > 0)  # norme nulle -> cos 0
+    rel = lam * np.asarray([c["score"] for c in rest], dtype=np.float64)
+
+    picked = [0]
+    taken = np.zeros(n, dtype=bool); taken[0] = True
+    max_sim = mat @ mat[0]  # une ligne de la matrice n×n par élément choisi (k ≪ n)
+    while len(picked) < k:
+        val = rel - (1-lam)*max_sim
+        val[taken] = -np.inf
+        best = int(np.argmax(val))  # premier maximum = même départage que la boucle d'origine
+        picked.append(best); taken[best] = True
+        np.maximum(max_sim, mat @ mat[best], out=max_sim)
+    return [rest[i] for i in picked]
+
+def _candidate(mid: str, score: float, meta: Dict, values) -> Dict:
+    return {
+        "id": mid,
+        "score": score,
+        "text": meta.get("text", ""),
+        "section": meta.get("section", ""),
+        "subsection": meta.get("subsection", ""),
+        "chunk_index": meta.get("chunk_index", None),
+        "source": meta.get("source", ""),
+        "overlap_text": meta.get("overlap_text", ""),
+        "values": values,
+        "is_db": True
+    }
+
+def _fetch_into(pool: Dict[str, Dict], ids: List[str], namespace: str) -> None:
+    """Un seul idx.fetch : ajoute les ids absents du pool, complète les valeurs des autres."""
+    if not ids:
+        return
+    with metrics.stage("vector_fetch"):
+        vectors = getattr(idx.fetch(ids=ids, namespace=namespace), "vectors", {}) or {}
+    for doc_id in ids:
+        v = vectors.get(doc_id)
+        if v is None:
+            continue
+        if doc_id in pool:
+            pool[doc_id]["values"] = getattr(v, "values", None)
+        else:
+            pool[doc_id] = _candidate(doc_id, 0.0, getattr(v, "metadata", {}) or {}, getattr(v, "values", None))
+
+def _search_namespace(namespace: str, query: str, qvec: List[float], depth: int) -> List[Dict]:
+    """Candidats d'un namespace (vecteur, + BM25 fusionné en RRF si disponible), triés par score."""
     pool: Dict[str, Dict] = {}
-    res = idx.query(vector=qvec, top_k=top_k*2, include_metadata=True, include_values=True, namespace=NAMESPACE)
+    codes = vector_codes.get(namespace)
+    with metrics.stage("vector_query"):
+        # avec des vecteurs locaux, la réponse ne transporte que ids, scores et métadonnées
+        res = idx.query(vector=qvec, top_k=depth, include_metadata=True, include_values=codes is None,
+                        namespace=namespace)
     for m in getattr(res, "matches", []):
         mid = getattr(m, "id", "")
         if not mid: continue
         meta = getattr(m, "metadata", {}) or {}
-        pool[mid] = {
-            "id": mid,
-            "score": getattr(m, "score", 0.0),
-            "text": meta.get("text", ""),
-            "section": meta.get("section", ""),
-            "subsection": meta.get("subsection", ""),
-            "chunk_index": meta.get("chunk_index", None),
-            "source": meta.get("source", ""),
-            "values": getattr(m, "values", None),
-            "is_db": True
-        }
-    return mmr_select(list(pool.values()), k=top_k)
+        # sans include_values, Pinecone renvoie values=[] : traité comme absent
+        pool[mid] = _candidate(mid, getattr(m, "score", 0.0), meta, getattr(m, "values", None) or None)
+    lex_index = bm25.get(namespace)
+    if lex_index is not None:
+        with metrics.stage("bm25"):
+            lexical = [doc_id for doc_id, _ in lex_index.search(query, depth)]
+        fused = rrf_fuse([list(pool), lexical])
+        # les hits BM25 absents du pool vectoriel : un seul fetch pour valeurs + métadonnées
+        _fetch_into(pool, [doc_id for doc_id in lexical if doc_id not in pool], namespace)
+        for doc_id, score in fused:
+            if doc_id in pool:
+                pool[doc_id]["score"] = score
+    if codes is not None:
+        lacking = [doc_id for doc_id, c in pool.items() if c["values"] is None]
+        with metrics.stage("vector_lookup"):
+            found = codes.lookup(lacking)
+        for doc_id, vec in found.items():
+            pool[doc_id]["values"] = vec
+        # fichier de codes plus ancien que l'index : les ids inconnus repassent par fetch
+        _fetch_into(pool, [doc_id for doc_id in lacking if doc_id not in found], namespace)
+    return sorted(pool.values(), key=lambda c: c["score"], reverse=True)
+
+def search(query: str, top_k: int = TOP_K) -> List[Dict]:
+    with metrics.stage("embed"):
+        qvec = embed(query)
+    # un namespace par langue, interrogés en parallèle ; scores normalisés puis pondérés par langue
+    # MMR garde la moitié du pool : top_k, ou les RERANK_MAX_CANDIDATES passages à noter avec le rerank
+    keep = max(top_k, RERANK_MAX_CANDIDATES) if USE_LLM_RERANK else top_k
+    depth = keep * 2
+    per_ns = fan_out(lambda ns: _search_namespace(ns, query, qvec, depth), NAMESPACES)
+    pool: Dict[str, Dict] = {}
+    for ns, cand, score in merge_namespaces(per_ns, detect_lang(query), depth):
+        key = cand["id"] if len(NAMESPACES) == 1 else f"{ns}:{cand['id']}"
+        pool[key] = dict(cand, score=score, namespace=ns)
+    metrics.pool_size("candidates", len(pool))
+    with metrics.stage("mmr"):
+        hits = mmr_select(list(pool.values()), k=keep)
+    if not USE_LLM_RERANK:
+        return _with_neighbours(hits)
+    # voisins ajoutés avant la note : le LLM écarte aussi les voisins hors sujet (sinon
+    # l'expansion remplit de nouveau le budget de contexte) ; top_k passages au total.
+    # Budget dépassé / erreur : top_k de MMR et leurs voisins, comme sans rerank
+    return rerank(client, query, _with_neighbours(hits), top_k, max_candidates=RERANK_MAX_EXPANDED,
+                  fallback=lambda: _with_neighbours(hits[:top_k]))
+
+def _with_neighbours(hits: List[Dict]) -> List[Dict]:
+    return neighbours.expand(hits) if neighbours is not None else hits
 
 def build_prompt(question: str, hits: List[Dict], history: List[Dict]) -> List[Dict]:
     lang = detect_lang(question)
-    ctx = ""
-    for i, h in enumerate(hits):
-        h["is_db"] = True
-        ctx += f"[{i+1}] [DB] {h['text']}\n"
-    hist_msgs = [{"role": turn["role"], "content": turn["content"]} for turn in history[-MEMORY_TURNS:]] if history else []
+    # budget de tokens exact (tiktoken) : doublons/overlaps retirés, voisins fusionnés
+    with metrics.stage("context_pack"):
+        ctx, _, stats = pack_context(hits, MAX_CONTEXT_TOKENS, template="[{n}] [DB] {text}", sep="\n")
+    if SHOW_CONTEXT_STATS:
+        print("TARS ▶", format_stats(stats))
+    # historique déjà compacté (session_store.history_messages) : résumé + tours récents sous budget
+    hist_msgs = [{"role": turn["role"], "content": turn["content"]} for turn in history] if history else []
     sys_msg = f"You are TARS, expert RAG assistant. Answer in {lang} using only the database context. Ignore external sources."
     return [{"role": "system", "content": sys_msg}] + hist_msgs + [{"role": "user", "content": f"Question: {question}\n\n{ctx}"}]
 
 def compose_answer(messages: List[Dict]) -> str:
     try:
-        r = client.chat.completions.create(
-            model=MODEL_CHAT,
-            temperature=0.5,
-            top_p=0.9,
-            max_tokens=MAX_OUTPUT_TOKENS,
-            messages=messages
-        )
+        with metrics.stage("generate"):
+            r = client.chat.completions.create(
+                model=MODEL_CHAT,
+                temperature=0.5,
+                top_p=0.9,
+                max_tokens=MAX_OUTPUT_TOKENS,
+                messages=messages
+            )
+        metrics.usage_tokens(r)
         return (r.choices[0].message.content or "").strip()
     except Exception as e:
         return f"(Erreur génération: {e})"
 
 def answer(question: str, history: List[Dict]) -> Tuple[str, List[str]]:
     hits = search(question)
+    cited_ids = [h.get("id") for h in hits]
+    # cache sémantique uniquement sans historique : une relance dépend du tour précédent
+    use_cache = ANSWER_CACHE_ENABLED and not history
+    if use_cache:
+        qvec, lang = embed(question), detect_lang(question)
+        cached = answer_cache.lookup(qvec, lang, cited_ids)
+        if cached:
+            return cached["answer"], cited_ids
     msgs = build_prompt(question, hits, history)
     text = compose_answer(msgs)
-    cited_ids = [h.get("id") for h in hits]
+    if use_cache and not text.startswith("(Erreur"):
+        answer_cache.put(qvec, lang, cited_ids, text, question=question)
     return text, cited_ids
 
+def warm_up_steps():
+    return [("openai", lambda: warm_openai(client.get(), MODEL_EMB)),
+            ("index", lambda: warm_index(idx.get(), NAMESPACES)),
+            ("local_caches", warm_local_caches)]
+
 def main_cli():
-    history=[]
+    sessions, session_id = SessionStore(db_path=""), new_session_id()
+    summarize = openai_summarizer(client, MODEL_CHAT)
+    # connexions ouvertes pendant que l'utilisateur tape sa première question
+    readiness.start(warm_up_steps())
     print("Hi, I am a AI database about ayahuasca and master plants dieta.")
     while True:
         try: q = input("? Question: ").strip()
         except (EOFError, KeyboardInterrupt): break
         if not q: break
-        reply, sources = answer(q, history)
+        reply, sources = answer(q, history_messages(sessions.get(session_id)))
         print("\nAnswer:\n"+reply)
         if SHOW_SOURCES: print("\nSources:", ", ".join(sources) if sources else "(aucune)")
-        history.append({"role":"user","content":q})
-        history.append({"role":"assistant","content":reply})
+        sessions.append(session_id, q, reply)
+        # résumé des anciens tours pendant que l'utilisateur tape la question suivante
+        compact_in_background(sessions, session_id, summarize)
 
 if __name__ == "__main__":
     main_cli()
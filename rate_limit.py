@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# rate_limit.py — Limiteur à seaux de jetons (RPM + TPM) recalé sur les en-têtes OpenAI
+#
+# Remplace les pauses fixes : chaque appel réserve 1 requête + N tokens, attend
+# seulement si le budget est épuisé, et les en-têtes x-ratelimit-* des réponses
+# (ou un 429) recalent le budget sur ce que l'API voit réellement.
+
+import re, time, threading
+from typing import Mapping, Optional
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """'6m0s', '1.5s', '20ms' -> secondes (format des en-têtes x-ratelimit-reset-*)."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT[u] for n, u in parts)
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    v = headers.get(name)
+    try:
+        return float(v) if v is not None else None
+    except ValueError:
+        return None
+
+class RateLimiter:
+    """Double seau à jetons, sûr entre threads."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm, self.tpm = float(rpm), float(tpm)
+        self._requests, self._tokens = float(rpm), float(tpm)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last
+        self._last = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Bloque jusqu'à ce qu'1 requête + `tokens` soient disponibles. Renvoie le temps attendu."""
+        tokens = min(float(tokens), self.tpm)
+        waited = 0.0
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._requests >= 1 and self._tokens >= tokens:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return waited
+                    wait = max((1 - self._requests) * 60.0 / self.rpm,
+                               (tokens - self._tokens) * 60.0 / self.tpm)
+                wait = max(wait, 0.005)
+                self._cond.wait(wait)
+                waited += wait
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Recale les seaux sur x-ratelimit-limit-* / x-ratelimit-remaining-*."""
+        limit_req = _header_float(headers, "x-ratelimit-limit-requests")
+        limit_tok = _header_float(headers, "x-ratelimit-limit-tokens")
+        rem_req = _header_float(headers, "x-ratelimit-remaining-requests")
+        rem_tok = _header_float(headers, "x-ratelimit-remaining-tokens")
+        with self._cond:
+            self._refill(time.monotonic())
+            if limit_req: self.rpm = limit_req
+            if limit_tok: self.tpm = limit_tok
+            # les en-têtes incluent les appels des autres processus : on garde le plus prudent
+            if rem_req is not None: self._requests = min(self._requests, rem_req)
+            if rem_tok is not None: self._tokens = min(self._tokens, rem_tok)
+            self._cond.notify_all()
+
+    def penalize(self, headers: Optional[Mapping[str, str]] = None, default: float = 2.0) -> float:
+        """Après un 429 : suspend tout le monde pendant retry-after (ou le reset annoncé)."""
+        headers = headers or {}
+        delay = (_header_float(headers, "retry-after")
+                 or parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                 or parse_duration(headers.get("x-ratelimit-reset-requests"))
+                 or default)
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._cond.notify_all()
+        return delay
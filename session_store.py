@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# session_store.py — Sessions de conversation côté serveur (historique compacté sous budget de tokens)
+#
+# Une session = résumé glissant + derniers échanges mot pour mot. Le prompt ne
+# reçoit que : résumé (≤ SUMMARY_MAX_TOKENS) + les tours les plus récents qui
+# tiennent dans HISTORY_MAX_TOKENS : sa taille ne croît plus avec la conversation.
+#
+# Le résumé est incrémental : quand HISTORY_RECENT_TURNS + SUMMARY_EVERY échanges
+# sont en attente, les plus anciens sont fondus dans le résumé précédent en un
+# seul appel LLM (hors du chemin critique, après la réponse), pas à chaque tour.
+#
+# Stockage : mémoire (TTLCache : LRU + expiration) par défaut ; SESSION_DB=sessions.sqlite
+# pour un stockage SQLite (WAL) partagé entre les workers gunicorn et persistant.
+
+import os, json, time, uuid, sqlite3, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from cachetools import TTLCache
+import metrics
+
+# ================= CONFIG =================
+SESSION_MAX: int = int(os.getenv("SESSION_MAX", "1000"))                    # sessions en mémoire (LRU)
+SESSION_TTL: float = float(os.getenv("SESSION_TTL", "3600"))                # secondes d'inactivité
+SESSION_DB: str = os.getenv("SESSION_DB", "")                               # "" = mémoire seule
+HISTORY_MAX_TOKENS: int = int(os.getenv("HISTORY_MAX_TOKENS", "600"))       # tours récents dans le prompt
+HISTORY_RECENT_TURNS: int = int(os.getenv("HISTORY_RECENT_TURNS", "3"))     # échanges gardés mot pour mot
+SUMMARY_EVERY: int = int(os.getenv("SUMMARY_EVERY", "3"))                   # échanges fondus par résumé
+SUMMARY_MAX_TOKENS: int = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+# garde-fou si le résumé échoue en boucle : au-delà, les tours les plus anciens sont oubliés
+HISTORY_HARD_CAP: int = HISTORY_RECENT_TURNS + 4 * SUMMARY_EVERY
+# une compaction réservée depuis plus longtemps (worker tué pendant le résumé) peut être reprise
+FOLD_LEASE: float = 120.0
+
+Summarizer = Callable[[str, List[Dict]], str]
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+def _new_session(sid: str) -> Dict:
+    # turns = [{"n": numéro, "user": question, "assistant": réponse}] ; un élément = un échange
+    return {"id": sid, "summary": "", "turns": [], "folded": 0, "seq": 0, "updated": time.time()}
+
+def _turn_key(turn: Dict):
+    # sessions enregistrées avant la numérotation : le contenu sert de clé
+    return turn.get("n", (turn["user"], turn["assistant"]))
+
+# ================= PROMPT =================
+def history_messages(session: Optional[Dict], budget: int = HISTORY_MAX_TOKENS) -> List[Dict]:
+    """Résumé + tours récents sous `budget` tokens, au format messages (role/content)."""
+    from context_packer import count_tokens, truncate_tokens
+    if not session:
+        return []
+    recent: List[Dict] = []
+    used = 0
+    for turn in reversed(session["turns"]):
+        pair = [{"role": "user", "content": turn["user"]}, {"role": "assistant", "content": turn["assistant"]}]
+        cost = sum(count_tokens(m["content"]) for m in pair)
+        if recent and used + cost > budget:
+            break
+        if not recent and cost > budget:
+            # dernier échange trop long à lui seul : la réponse est tronquée, la question gardée
+            pair[1]["content"] = truncate_tokens(pair[1]["content"], max(budget - count_tokens(turn["user"]), 0))
+            cost = budget
+        recent = pair + recent
+        used += cost
+    msgs = []
+    if session["summary"]:
+        msgs.append({"role": "system",
+                     "content": "Summary of the earlier conversation: " + truncate_tokens(session["summary"], SUMMARY_MAX_TOKENS)})
+    metrics.add("history_tokens", used)
+    return msgs + recent
+
+def render_history(messages: List[Dict]) -> str:
+    """Messages d'historique -> bloc texte (prompts à chaîne unique de chat_core)."""
+    labels = {"user": "User: ", "assistant": "Assistant: "}
+    return "\n".join(labels.get(m["role"], "") + m["content"] for m in messages)
+
+def summary_messages(summary: str, turns: List[Dict]) -> List[Dict]:
+    """Prompt de compaction : résumé précédent + échanges à y fondre."""
+    convo = "\n".join(f"User: {t['user']}\nAssistant: {t['assistant']}" for t in turns)
+    return [
+        {"role": "system", "content": (
+            "You maintain a running summary of a conversation between a user and TARS, a RAG assistant. "
+            "Merge the new exchanges into the previous summary. Keep the topics, entities, facts already "
+            f"given and open questions the user may refer back to. At most {SUMMARY_MAX_TOKENS} tokens, "
+            "in the language of the conversation. Reply with the summary only.")},
+        {"role": "user", "content": f"PREVIOUS SUMMARY:\n{summary or '(none)'}\n\nNEW EXCHANGES:\n{convo}"},
+    ]
+
+def openai_summarizer(client, model: str) -> Summarizer:
+    """Résumeur synchrone (chat.completions) ; `client` peut être un Lazy."""
+    def summarize(summary: str, turns: List[Dict]) -> str:
+        with metrics.stage("summarize"):
+            r = client.chat.completions.create(model=model, temperature=0, max_tokens=SUMMARY_MAX_TOKENS,
+                                               messages=summary_messages(summary, turns))
+        metrics.usage_tokens(r)
+        return (r.choices[0].message.content or "").strip()
+    return summarize
+
+# ================= STOCKAGE =================
+class SessionStore:
+    """Sessions en mémoire (LRU/TTL) ou dans SQLite ; compaction incrémentale de l'historique."""
+
+    def __init__(self, maxsize: int = SESSION_MAX, ttl: float = SESSION_TTL, db_path: Optional[str] = SESSION_DB):
+        self.ttl = ttl
+        self._mem: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.db_path = db_path or None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._folding: set = set()   # compactions en cours (mémoire ; avec SQLite : colonne folding)
+        self._puts = 0
+
+    # ---- niveau disque ----
+    def _db(self) -> sqlite3.Connection:
+        # une connexion par processus : gunicorn forke après l'import
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                         "updated REAL NOT NULL, folding REAL)")
+            if "folding" not in {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}:
+                conn.execute("ALTER TABLE sessions ADD COLUMN folding REAL")   # base créée avant la colonne
+            conn.commit()
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def _load(self, sid: str) -> Optional[Dict]:
+        if not self.db_path:
+            return self._mem.get(sid)
+        try:
+            row = self._db().execute("SELECT data, updated FROM sessions WHERE id = ?", (sid,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"[Sessions] lecture échouée: {e}")
+            return None
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def _save(self, session: Dict) -> None:
+        session["updated"] = time.time()
+        if not self.db_path:
+            self._mem[session["id"]] = session
+            return
+        try:
+            conn = self._db()
+            # upsert (pas INSERT OR REPLACE) : la réservation de compaction (folding) est conservée
+            conn.execute("INSERT INTO sessions (id, data, updated) VALUES (?, ?, ?) "
+                         "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                         (session["id"], json.dumps(session, ensure_ascii=False), session["updated"]))
+            self._puts += 1
+            if self._puts % 100 == 0:   # purge des sessions expirées, de temps en temps
+                conn.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"[Sessions] écriture échouée: {e}")
+
+    # ---- API ----
+    def get(self, sid: Optional[str]) -> Dict:
+        """Session `sid` (copie) ; nouvelle session si absente, expirée ou sid vide."""
+        with self._lock:
+            session = self._load(sid) if sid else None
+        if session is None:
+            return _new_session(sid or new_session_id())
+        return json.loads(json.dumps(session))
+
+    def append(self, sid: str, question: str, answer: str) -> Dict:
+        with self._lock:
+            session = self._load(sid) or _new_session(sid)
+            seq = session.get("seq", session["folded"] + len(session["turns"]))
+            session["turns"].append({"n": seq, "user": question, "assistant": answer})
+            session["seq"] = seq + 1
+            if len(session["turns"]) > HISTORY_HARD_CAP:
+                del session["turns"][:len(session["turns"]) - HISTORY_HARD_CAP]
+            self._save(session)
+            return session
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._mem.pop(sid, None)
+            if self.db_path:
+                try:
+                    conn = self._db()
+                    conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+                    conn.commit()
+                except sqlite3.Error as e:
+                    print(f"[Sessions] suppression échouée: {e}")
+
+    # ---- compaction ----
+    def _claim_fold(self, sid: str) -> bool:
+        """Réserve la compaction de `sid` ; avec SQLite, la réservation est dans la ligne de la
+        session (UPDATE conditionnel atomique) : un seul worker gunicorn résume à la fois."""
+        if not self.db_path:
+            if sid in self._folding:
+                return False
+            self._folding.add(sid)
+            return True
+        now = time.time()
+        try:
+            conn = self._db()
+            cur = conn.execute("UPDATE sessions SET folding = ? WHERE id = ? AND (folding IS NULL OR folding < ?)",
+                               (now, sid, now - FOLD_LEASE))
+            conn.commit()
+            return cur.rowcount == 1
+        except sqlite3.Error as e:
+            print(f"[Sessions] réservation échouée: {e}")
+            return False
+
+    def _release_fold(self, sid: str) -> None:
+        if not self.db_path:
+            self._folding.discard(sid)
+            return
+        try:
+            conn = self._db()
+            conn.execute("UPDATE sessions SET folding = NULL WHERE id = ?", (sid,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"[Sessions] libération échouée: {e}")
+
+    def _begin_fold(self, sid: str) -> Optional[Tuple[str, List[Dict]]]:
+        """(résumé actuel, échanges à fondre) si une compaction est due, sinon None."""
+        with self._lock:
+            session = self._load(sid)
+            if session is None or len(session["turns"]) < HISTORY_RECENT_TURNS + SUMMARY_EVERY:
+                return None
+            if not self._claim_fold(sid):
+                return None
+            return session["summary"], session["turns"][:len(session["turns"]) - HISTORY_RECENT_TURNS]
+
+    def _end_fold(self, sid: str, folded: List[Dict], summary: Optional[str]) -> None:
+        with self._lock:
+            try:
+                self._fold_into(sid, folded, summary)
+            finally:
+                self._release_fold(sid)
+
+    def _fold_into(self, sid: str, folded: List[Dict], summary: Optional[str]) -> None:
+        """Remplace les échanges fondus (encore présents) par le résumé."""
+        session = self._load(sid)
+        if session is None or not summary:
+            return
+        # seuls les échanges fondus encore présents sont retirés : append() a pu en couper
+        # une partie (HISTORY_HARD_CAP) pendant l'appel au résumeur
+        done = {_turn_key(t) for t in folded}
+        kept = [t for t in session["turns"] if _turn_key(t) not in done]
+        session["summary"] = summary
+        session["folded"] += len(session["turns"]) - len(kept)
+        session["turns"] = kept
+        self._save(session)
+
+    def compact(self, sid: str, summarize: Summarizer) -> bool:
+        """Fond les échanges anciens dans le résumé si c'est dû ; True si le résumé a changé."""
+        todo = self._begin_fold(sid)
+        if todo is None:
+            return False
+        summary = None
+        try:
+            summary = summarize(*todo)
+        except Exception as e:
+            print(f"[Sessions] résumé échoué: {e}")
+        finally:
+            self._end_fold(sid, todo[1], summary)
+        return bool(summary)
+
+    async def acompact(self, sid: str, summarize: Callable[[str, List[Dict]], Awaitable[str]]) -> bool:
+        """Variante asyncio de compact() (lectures/écritures du stockage dans un thread)."""
+        todo = await asyncio.to_thread(self._begin_fold, sid)
+        if todo is None:
+            return False
+        summary = None
+        try:
+            summary = await summarize(*todo)
+        except Exception as e:
+            print(f"[Sessions] résumé échoué: {e}")
+        finally:
+            await asyncio.to_thread(self._end_fold, sid, todo[1], summary)
+        return bool(summary)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def compact_in_background(store: SessionStore, sid: str, summarize: Summarizer) -> None:
+    """Compaction après la réponse, sans retarder la requête."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="session-summary")
+    _executor.submit(store.compact, sid, summarize)
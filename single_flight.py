@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# single_flight.py — Coalescence des calculs identiques en cours (embed, retrieval, génération)
+#
+# Une rafale de la même question (lien partagé dans un groupe) = un seul embedding,
+# une seule requête vectorielle, un seul appel LLM : le premier arrivé calcule,
+# les suivants attendent son résultat. En streaming, la génération tourne dans un
+# thread (ou une tâche) à part et chaque client suit le même flux de tokens, depuis
+# le début (les tokens déjà émis sont rejoués à un client arrivé en cours de route).
+#
+#   SingleFlight / StreamFlight             threads d'un worker (Flask, CLI)
+#   AsyncSingleFlight / AsyncStreamFlight   tâches asyncio d'un worker (ASGI)
+#
+# Entre workers gunicorn (optionnel) : COALESCE_DIR=/tmp/tars_flight active un verrou
+# fichier (flock) pour les générations non streamées ; le premier worker écrit la réponse,
+# ceux qui attendaient le verrou la relisent. Les verrous sont un jeu fixe de COALESCE_LOCKS
+# fichiers (clé hachée : deux questions du même lot s'attendent), les résultats sont
+# supprimés après une minute. POSIX seulement.
+# C'est de la coalescence en vol, pas un cache : seule une réponse écrite pendant l'attente
+# est reprise. COALESCE_RESULT_TTL > 0 reprend aussi une réponse récente, ce qui recouvre
+# le cache sémantique de réponses (answer_cache) ; à réserver aux questions hors cache.
+
+import os, json, time, asyncio, hashlib, threading, contextvars
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from embedding_cache import normalize_text
+import metrics
+
+COALESCE_ENABLED: bool = os.getenv("COALESCE_ENABLED", "1") == "1"
+COALESCE_DIR: str = os.getenv("COALESCE_DIR", "")                      # "" = coalescence par worker seulement
+COALESCE_RESULT_TTL: float = float(os.getenv("COALESCE_RESULT_TTL", "0"))     # 0 = calcul en vol seulement
+COALESCE_LOCKS: int = int(os.getenv("COALESCE_LOCKS", "256"))                 # fichiers de verrou par nom
+RESULT_GRACE: float = 60.0   # durée de vie d'un résultat sur disque (largement > la relecture des suiveurs)
+
+def flight_key(question: str, *parts: Any) -> str:
+    """Clé de coalescence : question normalisée + tout ce qui change la réponse (langue, historique, web...)."""
+    raw = "\x1f".join([normalize_text(question)] + [str(p) for p in parts])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+def _count(name: str, shared: bool) -> None:
+    metrics.cache_event(f"coalesce_{name}", shared)
+
+# ================= THREADS =================
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result, self.error = None, None
+
+class SingleFlight:
+    """do(key, fn) : un seul fn() par clé à la fois ; les appels concurrents partagent son résultat."""
+
+    def __init__(self, name: str, cross_process: bool = False):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._dir = COALESCE_DIR if cross_process else ""
+        self._swept = 0.0
+        if self._dir:
+            try:
+                import fcntl  # noqa: F401
+                os.makedirs(self._dir, exist_ok=True)
+            except (ImportError, OSError) as e:
+                print(f"[Config] COALESCE_DIR ignoré ({e}) : coalescence par worker seulement")
+                self._dir = ""
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """(résultat, partagé) ; partagé=True si le résultat vient d'un autre appel."""
+        if not COALESCE_ENABLED:
+            return fn(), False
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            _count(self.name, True)
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        shared = False
+        try:
+            if self._dir:
+                call.result, shared = self._across_workers(key, fn)
+            else:
+                call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        _count(self.name, shared)
+        return call.result, shared
+
+    def _across_workers(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Verrou fichier (lot de la clé) : le premier worker calcule et écrit le résultat (JSON),
+        ceux qui attendaient le relisent."""
+        import fcntl
+        stripe = int(key[:8], 16) % max(COALESCE_LOCKS, 1)
+        path = os.path.join(self._dir, f"{self.name}-{key}.json")
+        arrived = time.time()
+        with open(os.path.join(self._dir, f"{self.name}-{stripe:04d}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    # écrit pendant notre attente (ou depuis moins de COALESCE_RESULT_TTL s)
+                    if os.path.getmtime(path) >= arrived - COALESCE_RESULT_TTL:
+                        with open(path, "r", encoding="utf-8") as f:
+                            return json.load(f), True
+                except (OSError, ValueError):
+                    pass
+                result = fn()
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(result, f, ensure_ascii=False)
+                os.replace(tmp, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self._sweep()
+        return result, False
+
+    def _sweep(self) -> None:
+        """Supprime les résultats périmés (au plus une fois par minute et par processus)."""
+        now = time.time()
+        if now - self._swept < RESULT_GRACE:
+            return
+        self._swept = now
+        horizon = now - max(COALESCE_RESULT_TTL, RESULT_GRACE)
+        prefix = self.name + "-"
+        for entry in os.scandir(self._dir):
+            if entry.name.startswith(prefix) and entry.name.endswith((".json", ".tmp")):
+                try:
+                    if entry.stat().st_mtime < horizon:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+
+class _Broadcast:
+    """Éléments d'un flux, rejouables depuis le début par chaque abonné."""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.cond = threading.Condition()
+
+    def push(self, item: Any) -> None:
+        with self.cond:
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        with self.cond:
+            self.finished, self.error = True, error
+            self.cond.notify_all()
+
+    def subscribe(self) -> Iterator[Any]:
+        i = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.items) > i or self.finished)
+                batch, finished, error = self.items[i:], self.finished, self.error
+            yield from batch
+            i += len(batch)
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+class StreamFlight:
+    """open(key, source_fn) : un seul flux source par clé, lu dans un thread ; chaque client s'y abonne."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._streams: Dict[str, _Broadcast] = {}
+        self._lock = threading.Lock()
+
+    def _pump(self, key: str, stream: _Broadcast, source_fn: Callable[[], Iterator[Any]]) -> None:
+        error = None
+        try:
+            for item in source_fn():
+                stream.push(item)
+        except BaseException as e:
+            error = e
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+            stream.close(error)
+
+    def open(self, key: str, source_fn: Callable[[], Iterator[Any]]) -> Tuple[Iterator[Any], bool]:
+        """(itérateur des éléments, partagé) ; le flux continue même si le premier client se déconnecte."""
+        if not COALESCE_ENABLED:
+            return source_fn(), False
+        with self._lock:
+            stream = self._streams.get(key)
+            shared = stream is not None
+            if not shared:
+                stream = self._streams[key] = _Broadcast()
+                # contexte copié : la trace (metrics) du premier client suit dans le thread
+                ctx = contextvars.copy_context()
+                threading.Thread(target=ctx.run, args=(self._pump, key, stream, source_fn),
+                                 name=f"flight-{self.name}", daemon=True).start()
+        _count(self.name, shared)
+        return stream.subscribe(), shared
+
+# ================= ASYNCIO =================
+class AsyncSingleFlight:
+    """Version asyncio de SingleFlight (une boucle par worker : pas de verrou nécessaire)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        if not COALESCE_ENABLED:
+            return await fn(), False
+        fut = self._calls.get(key)
+        if fut is not None:
+            _count(self.name, True)
+            # shield : l'annulation d'un suiveur (client parti) n'annule pas le calcul partagé
+            return await asyncio.shield(fut), True
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        _count(self.name, False)
+        return await asyncio.shield(task), False
+
+class _AsyncBroadcast:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.cond = asyncio.Condition()
+
+    async def push(self, item: Any) -> None:
+        async with self.cond:
+            self.items.append(item)
+            self.cond.notify_all()
+
+    async def close(self, error: Optional[BaseException] = None) -> None:
+        async with self.cond:
+            self.finished, self.error = True, error
+            self.cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        i = 0
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(lambda: len(self.items) > i or self.finished)
+                batch, finished, error = self.items[i:], self.finished, self.error
+            for item in batch:
+                yield item
+            i += len(batch)
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+class AsyncStreamFlight:
+    """Version asyncio de StreamFlight : la source est lue par une tâche indépendante des clients."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._streams: Dict[str, _AsyncBroadcast] = {}
+        self._tasks: set = set()
+
+    async def _pump(self, key: str, stream: _AsyncBroadcast, source_fn: Callable[[], AsyncIterator[Any]]) -> None:
+        error = None
+        try:
+            async for item in source_fn():
+                await stream.push(item)
+        except asyncio.CancelledError as e:
+            # arrêt du worker / flux amont abandonné : les abonnés reçoivent une erreur, pas une
+            # réponse tronquée présentée comme complète (CancelledError elle-même ne doit pas
+            # sortir dans la tâche d'un autre client)
+            error = RuntimeError("génération interrompue (tâche annulée)")
+            error.__cause__ = e
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            self._streams.pop(key, None)
+            await stream.close(error)
+
+    def open(self, key: str, source_fn: Callable[[], AsyncIterator[Any]]) -> Tuple[AsyncIterator[Any], bool]:
+        if not COALESCE_ENABLED:
+            return source_fn(), False
+        stream = self._streams.get(key)
+        shared = stream is not None
+        if not shared:
+            stream = self._streams[key] = _AsyncBroadcast()
+            task = asyncio.ensure_future(self._pump(key, stream, source_fn))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        _count(self.name, shared)
+        return stream.subscribe(), shared
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# test_batch_query.py — Validation des entrées du batch (parse_questions, /api/chat/batch)
+# Usage: python -m pytest -q test_batch_query.py
+
+import os
+import pytest
+from batch_query import parse_questions
+
+def test_parse_questions_mixed_lines():
+    lines = ['{"id": "a", "question": " Q1 "}', "texte brut", "", '{"message": "Q3"}', '"Q4"', '{"question": ""}']
+    assert parse_questions(lines) == [
+        {"id": "a", "question": "Q1"},
+        {"id": "2", "question": "texte brut"},
+        {"id": "4", "question": "Q3"},
+        {"id": "5", "question": "Q4"},
+    ]
+
+@pytest.mark.parametrize("line", ["123", "null", '["a", "b"]', '{"question": 5}', '{"message": ["x"]}'])
+def test_parse_questions_rejects_non_objects(line):
+    with pytest.raises(ValueError):
+        parse_questions(["ok", line])
+
+@pytest.fixture
+def client(monkeypatch):
+    pytest.importorskip("flask")
+    monkeypatch.setenv("WARMUP", "off")
+    monkeypatch.setenv("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY", "test"))
+    import app_flask_backend
+    monkeypatch.setattr(app_flask_backend, "run_batch", lambda *a, **kw: iter([{"ok": True}]))
+    return app_flask_backend.app.test_client()
+
+@pytest.mark.parametrize("body", ["123", "null", '["a","b"]', 'ok\n{"question": 5}'])
+def test_batch_jsonl_bad_lines(client, body):
+    r = client.post("/api/chat/batch", data=body, content_type="text/plain")
+    assert r.status_code == 400 and "error" in r.get_json()
+
+@pytest.mark.parametrize("body", [{"questions": [1, 2]}, {"questions": [{"question": 5}]}, {"questions": "abc"},
+                                  {"questions": ["q"], "top_k": "x"}, {"questions": ["q"], "top_k": 0}])
+def test_batch_json_bad_input(client, body):
+    r = client.post("/api/chat/batch", json=body)
+    assert r.status_code == 400 and "error" in r.get_json()
+
+def test_batch_ok(client):
+    r = client.post("/api/chat/batch", json={"questions": ["q1", {"id": "x", "question": "q2"}]})
+    assert r.status_code == 200
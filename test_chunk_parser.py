@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# test_chunk_parser.py — Parité chunk_parser (1 passe, flux) / ancien parseur regex
+# Usage: python -m pytest -q test_chunk_parser.py
+
+import os
+import pytest
+from chunk_parser import parse_file, iter_chunks, detect_text_encoding
+from bench_chunk_parser import legacy_parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FIXTURE = """Préambule ignoré (avant le premier chunk)
+[CHUNK: 1]
+[SECTION: Introduction]
+[SUBSECTION: Contexte]
+Première ligne du chunk.
+   Ligne indentée, espaces retirés.
+
+[OVERLAP] fin du chunk précédent [/OVERLAP]
+⟦CHUNK - 02⟧
+⟦SECTION: Méthode⟧
+[SUBSECTION: Étapes]
+[SUBSUBSECTION: Détail]
+Texte sur
+plusieurs lignes.\r
+[[CHUNK 3]]
+[section: casse mixte]
+Dernier chunk, sans overlap.
+"""
+
+def as_strings(rows):
+    return [{k: str(v) for k, v in r.items()} for r in rows]
+
+def test_fixture_parity(tmp_path):
+    path = tmp_path / "fixture.txt"
+    path.write_text(FIXTURE, encoding="utf-8")
+    got = as_strings(parse_file(str(path), encoding="utf-8", source="fixture.txt"))
+    expected = as_strings(legacy_parse(FIXTURE, source="fixture.txt"))
+    assert len(got) == 3
+    assert got == expected
+
+def test_iter_chunks_matches_parse_file(tmp_path):
+    path = tmp_path / "fixture.txt"
+    path.write_text(FIXTURE, encoding="utf-8")
+    lines = FIXTURE.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    assert (as_strings(iter_chunks(lines, source="fixture.txt"))
+            == as_strings(parse_file(str(path), encoding="utf-8", source="fixture.txt")))
+
+def test_document_parity():
+    path = os.path.join(HERE, "aya_db_v1.txt")
+    if not os.path.exists(path):
+        pytest.skip("aya_db_v1.txt absent")
+    got = as_strings(parse_file(path, source="aya_db_v1.txt"))
+    with open(path, "r", encoding=detect_text_encoding(path)) as f:
+        expected = as_strings(legacy_parse(f.read(), source="aya_db_v1.txt"))
+    assert got and got == expected
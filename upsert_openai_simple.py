@@ -1,31 +1,25 @@
 # -*- coding: utf-8 -*-
 # TARS: chunks.csv -> embeddings (OpenAI) -> upsert Pinecone (aya-1536)
+# Incrémental : seuls les chunks nouveaux/modifiés sont ré-embeddés (--full pour tout refaire)
+# Pipeline : embeddings sur un pool de workers (limités par RPM/TPM réels), upserts en parallèle
+#
+# Usage: python upsert_openai_simple.py [--csv chunks.csv|aya_db_v1.docx] [--namespace en_v1] [--full]
 
-import csv, time, sys
-from typing import List
-from openai import OpenAI
+import csv, time, sys, json, hashlib, argparse, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+from openai import OpenAI, RateLimitError
 from pinecone import Pinecone
 from tenacity import retry, wait_exponential, stop_after_attempt
 import tiktoken
+import numpy as np
+from vector_store import save_local_index, load_local_index, VECTOR_BACKEND, LOCAL_INDEX_DIR, INDEX_MANIFEST
+from rate_limit import RateLimiter
+from bm25_index import BM25Index, BM25_FILE
+from vector_codes import VectorCodes, VECTOR_QUANT, CODES_FILE
 
-# === CHARGER LES CLES DE index_key.env ===
 import os
 
-# Vérifie que le fichier existe
-env_file = "index_key.env"
-if not os.path.exists(env_file):
-    raise FileNotFoundError(f"{env_file} introuvable. Crée-le avec tes clés.")
-
-# Lecture ligne par ligne
-with open(env_file, "r") as f:
-    for line in f:
-        if line.startswith("OPENAI_API_KEY"):
-            OPENAI_API_KEY = line.strip().split("=",1)[1].strip()
-        elif line.startswith("PINECONE_API_KEY"):
-            PINECONE_API_KEY = line.strip().split("=",1)[1].strip()
-# ==============================
-
-
 CSV_PATH   = r"C:\Users\HONOR\OneDrive\Desktop\Aya_db\chunks.csv"
 INDEX_NAME = "aya-1536"           # ton index doit être en 1536 dims
 NAMESPACE  = "en_v1"
@@ -33,14 +27,17 @@ MODEL      = "text-embedding-3-small"   # 1536 dims
 
 # Limite sûre par requête embeddings (sous le TPM 40k) :
 TOKENS_PER_REQUEST_MAX = 8000
-PAUSE_BETWEEN_REQUESTS = 0.4  # petite sieste pour lisser les quotas
 UPSERT_BATCH = 50             # upsert vers Pinecone par paquets (sans risque TPM)
+WRITE_LOCAL_INDEX = True      # écrit aussi l'index local NumPy (VECTOR_BACKEND=local)
+
+# Budgets réels du compte OpenAI (recalés ensuite sur les en-têtes x-ratelimit-*)
+EMBED_TPM      = int(os.getenv("OPENAI_EMBED_TPM", "40000"))
+EMBED_RPM      = int(os.getenv("OPENAI_EMBED_RPM", "3000"))
+EMBED_WORKERS  = int(os.getenv("EMBED_WORKERS", "4"))
+UPSERT_WORKERS = int(os.getenv("UPSERT_WORKERS", "4"))
 
-# --- Init clients
-client = OpenAI(api_key=OPENAI_API_KEY)
-pc     = Pinecone(api_key=PINECONE_API_KEY)
-idx    = pc.Index(INDEX_NAME)
-print(f"TARS ▶ OK Pinecone index '{INDEX_NAME}'")
+# Indexation incrémentale : manifeste id -> empreinte (texte + métadonnées + modèle)
+MANIFEST_PATH = INDEX_MANIFEST   # sa date d'écriture versionne aussi le cache de réponses (vector_store.index_version)
 
 # --- Encodage tokens
 try:
@@ -48,6 +45,22 @@ try:
 except Exception:
     enc = tiktoken.get_encoding("cl100k_base")
 
+client  = None   # créés dans main() : le module reste importable (bucketize_by_tokens...)
+limiter = RateLimiter(rpm=EMBED_RPM, tpm=EMBED_TPM)
+
+def load_keys(env_file: str = "index_key.env") -> Dict[str, str]:
+    """Lit les clés de index_key.env (ligne par ligne)."""
+    if not os.path.exists(env_file):
+        raise FileNotFoundError(f"{env_file} introuvable. Crée-le avec tes clés.")
+    keys = {}
+    with open(env_file, "r") as f:
+        for line in f:
+            if line.startswith("OPENAI_API_KEY"):
+                keys["OPENAI_API_KEY"] = line.strip().split("=",1)[1].strip()
+            elif line.startswith("PINECONE_API_KEY"):
+                keys["PINECONE_API_KEY"] = line.strip().split("=",1)[1].strip()
+    return keys
+
 def count_tokens(s: str) -> int:
     return len(enc.encode(s or ""))
 
@@ -59,7 +72,9 @@ def bucketize_by_tokens(items: List[str], max_tokens: int = TOKENS_PER_REQUEST_M
         ct = count_tokens(t)
 
         # Si un chunk est énorme, tronque prudemment (option simple & safe).
+        # Pour ne rien perdre : redécouper avec auto_chunker.py.
         if ct > max_tokens:
+            print(f"TARS ⚠ chunk de {ct} tokens tronqué à {max_tokens - 200} (voir auto_chunker.py)")
             ids = enc.encode(t)
             # marge 200 tokens
             t   = enc.decode(ids[:max_tokens - 200])
@@ -74,66 +89,227 @@ def bucketize_by_tokens(items: List[str], max_tokens: int = TOKENS_PER_REQUEST_M
         yield batch
 
 @retry(wait=wait_exponential(min=2, max=60), stop=stop_after_attempt(6))
-def _embed_call(texts: List[str]):
-    """Appel OpenAI protégé par backoff (429, réseaux...)."""
-    return client.embeddings.create(model=MODEL, input=texts)
+def _embed_call(texts: List[str], tokens: int):
+    """Appel OpenAI : réserve le budget RPM/TPM, recale sur les en-têtes, backoff sur erreur."""
+    limiter.acquire(tokens)
+    try:
+        raw = client.embeddings.with_raw_response.create(model=MODEL, input=texts)
+    except RateLimitError as e:
+        delay = limiter.penalize(getattr(e.response, "headers", None))
+        print(f"TARS ⚠ 429 embeddings, pause {delay:.1f}s")
+        raise
+    limiter.update_from_headers(raw.headers)
+    return raw.parse()
 
-def embed_token_aware(texts: List[str]) -> List[List[float]]:
-    """Découpe automatiquement en sous-paquets < TOKENS_PER_REQUEST_MAX."""
-    out = []
+def embed_token_aware(texts: List[str]) -> Tuple[List[List[float]], int]:
+    """Découpe automatiquement en sous-paquets < TOKENS_PER_REQUEST_MAX. Renvoie (vecteurs, tokens)."""
+    out, total = [], 0
     for bucket in bucketize_by_tokens(texts, TOKENS_PER_REQUEST_MAX):
-        resp = _embed_call(bucket)
+        tokens = sum(count_tokens(t) for t in bucket)
+        resp = _embed_call(bucket, tokens)
         out.extend([d.embedding for d in resp.data])
-        time.sleep(PAUSE_BETWEEN_REQUESTS)
-    return out
+        total += tokens
+    return out, total
 
 def chunked(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i+n]
 
-# --- Lire CSV (robuste Windows)
-rows = []
-with open(CSV_PATH, "r", encoding="utf-8", newline="") as f:
-    reader = csv.DictReader(f)
-    for r in reader:
-        txt = (r.get("text") or "").strip()
-        if txt:
-            rows.append(r)
-
-if not rows:
-    print("TARS ❌ Aucun chunk trouvé dans le CSV (colonne 'text' vide?).")
-    sys.exit(1)
-
-print("TARS ▶ chunks à upserter:", len(rows))
-
-# --- Pipeline: embeddings -> upsert Pinecone
-processed = 0
-for part in chunked(rows, UPSERT_BATCH):
-    texts = [r.get("text","") for r in part]
-    # embeddings (token-aware)
-    embs = embed_token_aware(texts)
-
-    vecs = []
-    for r, e in zip(part, embs):
-        # métadonnées propres
-        md = {
-            "section":        r.get("section",""),
-            "subsection":     r.get("subsection",""),
-            "subsubsection":  r.get("subsubsection",""),
-            "chunk_index":    int(r.get("chunk_index") or 0),
-            "language":       r.get("language","en"),
-            "source":         r.get("source","")
-        }
-        ov = (r.get("overlap_text") or "").strip()
-        if ov:
-            md["overlap_text"] = ov
-
-        vid = r.get("id") or f"doc-{processed:08d}"
-        vecs.append({"id": vid, "values": e, "metadata": md})
-
-    # upsert vers Pinecone
-    idx.upsert(vectors=vecs, namespace=NAMESPACE)
-    processed += len(part)
-    print(f"TARS ▶ upsert {processed - len(part) + 1}-{processed} / {len(rows)}")
-
-print("TARS ✅ Upsert terminé.")
+def build_metadata(r) -> dict:
+    """Métadonnées propres d'une ligne CSV, texte inclus (plus besoin de backfill_text_metadata.py)."""
+    md = {
+        "text":           r.get("text",""),
+        "section":        r.get("section",""),
+        "subsection":     r.get("subsection",""),
+        "subsubsection":  r.get("subsubsection",""),
+        "chunk_index":    int(r.get("chunk_index") or 0),
+        "language":       r.get("language","en"),
+        "source":         r.get("source","")
+    }
+    ov = (r.get("overlap_text") or "").strip()
+    if ov:
+        md["overlap_text"] = ov
+    return md
+
+def content_hash(md: dict) -> str:
+    """Empreinte texte + métadonnées + modèle d'embedding."""
+    payload = json.dumps({"model": MODEL, **md}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_manifest(path: str, namespace: str) -> dict:
+    # lu même avec --full : c'est le seul registre des ids à supprimer de l'index
+    if not os.path.exists(path):
+        return {"model": MODEL, "namespace": namespace, "chunks": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(path: str, namespace: str, chunks: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        # quant : encodage de vector_codes.npz, pour le reconstruire si VECTOR_QUANT change
+        json.dump({"model": MODEL, "namespace": namespace, "quant": VECTOR_QUANT, "chunks": chunks},
+                  f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def read_rows(csv_path: str) -> List[dict]:
+    """Lire CSV (robuste Windows, BOM compris), ou directement un .docx/.txt balisé via chunk_parser."""
+    if not csv_path.lower().endswith(".csv"):
+        from chunk_parser import parse_file
+        return [r for r in parse_file(csv_path) if r["text"].strip()]
+    rows = []
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        for r in reader:
+            txt = (r.get("text") or "").strip()
+            if txt:
+                rows.append(r)
+    return rows
+
+class Progress:
+    """Compteurs partagés entre workers + affichage du débit."""
+    def __init__(self, total: int):
+        self.total, self.chunks, self.tokens, self.upserted = total, 0, 0, 0
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def embedded(self, n_chunks: int, n_tokens: int) -> None:
+        with self._lock:
+            self.chunks += n_chunks; self.tokens += n_tokens
+            dt = max(time.perf_counter() - self.t0, 1e-9)
+            print(f"TARS ▶ embeddings {self.chunks}/{self.total} | "
+                  f"{self.chunks/dt:.1f} chunks/s | {self.tokens/dt:.0f} tokens/s")
+
+    def stored(self, n: int) -> None:
+        with self._lock:
+            self.upserted += n
+
+def run_pipeline(to_embed: List[str], current: Dict[str, tuple], idx, namespace: str,
+                 local_vecs: Dict[str, list]) -> Progress:
+    """Étage 1 : embeddings en parallèle (pool borné + limiteur). Étage 2 : upserts en parallèle."""
+    progress = Progress(len(to_embed))
+
+    def embed_part(part):
+        embs, tokens = embed_token_aware([current[vid][0]["text"] for vid in part])
+        return part, embs, tokens
+
+    def upsert_part(vecs):
+        idx.upsert(vectors=vecs, namespace=namespace)
+        progress.stored(len(vecs))
+
+    with ThreadPoolExecutor(EMBED_WORKERS, thread_name_prefix="embed") as emb_pool, \
+         ThreadPoolExecutor(UPSERT_WORKERS, thread_name_prefix="upsert") as up_pool:
+        emb_futs = [emb_pool.submit(embed_part, part) for part in chunked(to_embed, UPSERT_BATCH)]
+        up_futs = []
+        for fut in as_completed(emb_futs):
+            part, embs, tokens = fut.result()
+            vecs = []
+            for vid, e in zip(part, embs):
+                vecs.append({"id": vid, "values": e, "metadata": current[vid][0]})
+                local_vecs[vid] = e
+            progress.embedded(len(part), tokens)
+            if idx is not None:
+                up_futs.append(up_pool.submit(upsert_part, vecs))
+        for fut in up_futs:
+            fut.result()
+    return progress
+
+def main():
+    global client
+    ap = argparse.ArgumentParser(description="chunks.csv -> embeddings -> Pinecone / index local")
+    ap.add_argument("--csv", default=CSV_PATH)
+    ap.add_argument("--namespace", default=NAMESPACE)
+    ap.add_argument("--full", action="store_true", help="ré-embedde tout (les chunks retirés du CSV sont quand même supprimés)")
+    args = ap.parse_args()
+    namespace = args.namespace
+    manifest_path = MANIFEST_PATH.format(namespace=namespace)
+
+    # --- Init clients
+    keys = load_keys()
+    client = OpenAI(api_key=keys.get("OPENAI_API_KEY"))
+    idx    = None
+    if VECTOR_BACKEND != "local":
+        pc  = Pinecone(api_key=keys.get("PINECONE_API_KEY"))
+        idx = pc.Index(INDEX_NAME)
+        print(f"TARS ▶ OK Pinecone index '{INDEX_NAME}'")
+
+    rows = read_rows(args.csv)
+    if not rows:
+        print("TARS ❌ Aucun chunk trouvé dans le CSV (colonne 'text' vide?).")
+        sys.exit(1)
+
+    # --- Diff avec le manifeste : seuls les chunks nouveaux/modifiés sont ré-embeddés
+    current = {}   # id -> (metadata, hash)
+    for i, r in enumerate(rows):
+        vid = r.get("id") or f"doc-{i:08d}"
+        md = build_metadata(r)
+        current[vid] = (md, content_hash(md))
+
+    manifest = load_manifest(manifest_path, namespace)
+    recorded = manifest.get("chunks", {})
+    # modèle changé : empreintes périmées, mais les ids restent valables pour les suppressions
+    previous = recorded if manifest.get("model") == MODEL else {}
+
+    local_prev = load_local_index(namespace, LOCAL_INDEX_DIR) if WRITE_LOCAL_INDEX else None
+    had_local  = local_prev is not None
+    local_vecs = {}
+    if had_local:
+        prev_ids, prev_mat, _ = local_prev
+        prev_mat = np.array(prev_mat)  # copie en RAM : le fichier mappé va être remplacé
+        local_vecs = {vid: prev_mat[i] for i, vid in enumerate(prev_ids)}
+        local_prev = None
+
+    added     = [vid for vid in current if vid not in previous]
+    changed   = [vid for vid in current if vid in previous and previous[vid] != current[vid][1]]
+    unchanged = [vid for vid in current if vid in previous and previous[vid] == current[vid][1]]
+    deleted   = [vid for vid in recorded if vid not in current]
+    # un chunk inchangé absent de l'index local doit quand même être embeddé (1re écriture locale)
+    missing_local = [vid for vid in unchanged if WRITE_LOCAL_INDEX and vid not in local_vecs]
+    # --full : tout est ré-embeddé, mais le diff sert toujours à supprimer les chunks disparus
+    to_embed = list(current) if args.full else added + changed + missing_local
+
+    print(f"TARS ▶ chunks: {len(current)} | ajoutés: {len(added)} | modifiés: {len(changed)} | "
+          f"inchangés: {len(unchanged)} | supprimés: {len(deleted)}"
+          + (f" | à compléter (index local): {len(missing_local)}" if missing_local else ""))
+
+    # --- Pipeline: embeddings -> upsert Pinecone (+ index local)
+    progress = run_pipeline(to_embed, current, idx, namespace, local_vecs)
+
+    if deleted and idx is not None:
+        for part in chunked(deleted, UPSERT_BATCH):
+            idx.delete(ids=part, namespace=namespace)
+        print(f"TARS ▶ supprimés de Pinecone: {len(deleted)}")
+
+    if WRITE_LOCAL_INDEX and (to_embed or deleted or not had_local or len(local_vecs) != len(current)):
+        ids = list(current)
+        folder = save_local_index(ids, [local_vecs[vid] for vid in ids], [current[vid][0] for vid in ids],
+                                  namespace=namespace, root=LOCAL_INDEX_DIR)
+        print(f"TARS ▶ index local écrit: {folder} ({len(ids)} vecteurs)")
+
+    # vecteurs quantifiés pour le MMR : rag_chat interroge alors l'index sans include_values
+    codes_path = os.path.join(LOCAL_INDEX_DIR, namespace, CODES_FILE)
+    quant_changed = manifest.get("quant") != VECTOR_QUANT
+    if WRITE_LOCAL_INDEX and VECTOR_QUANT == "off" and os.path.exists(codes_path):
+        os.remove(codes_path)   # sinon rag_chat servirait l'ancien encodage
+        print(f"TARS ▶ VECTOR_QUANT=off : {codes_path} supprimé")
+    if WRITE_LOCAL_INDEX and VECTOR_QUANT != "off" and (to_embed or deleted or quant_changed
+                                                         or not os.path.exists(codes_path)):
+        ids = list(current)
+        codes = VectorCodes.build(ids, [local_vecs[vid] for vid in ids], VECTOR_QUANT)
+        print(f"TARS ▶ vecteurs {VECTOR_QUANT} écrits: {codes.save(namespace, LOCAL_INDEX_DIR)} "
+              f"({codes.nbytes / 1e6:.2f} Mo)")
+
+    # index lexical BM25 (recherche hybride), reconstruit dès que le corpus change
+    bm25_path = os.path.join(LOCAL_INDEX_DIR, namespace, BM25_FILE)
+    if to_embed or deleted or not os.path.exists(bm25_path):   # to_embed contient déjà les modifiés
+        ids = list(current)
+        bm25 = BM25Index.build(ids, (current[vid][0] for vid in ids))
+        print(f"TARS ▶ index BM25 écrit: {bm25.save(namespace, LOCAL_INDEX_DIR)} ({len(bm25.vocab)} termes)")
+
+    save_manifest(manifest_path, namespace, {vid: h for vid, (_, h) in current.items()})
+    dt = max(time.perf_counter() - progress.t0, 1e-9)
+    print(f"TARS ✅ Upsert terminé en {dt:.1f}s. ajoutés={len(added)} modifiés={len(changed)} "
+          f"inchangés={len(unchanged)} supprimés={len(deleted)} | "
+          f"{progress.chunks/dt:.1f} chunks/s, {progress.tokens/dt:.0f} tokens/s")
+
+if __name__ == "__main__":
+    main()
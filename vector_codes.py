@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# vector_codes.py — Vecteurs des chunks en local, quantifiés (float16 / int8 / binaire), par id
+#
+# Sert au MMR : rag_chat interroge l'index SANS include_values (la réponse Pinecone
+# ne transporte plus top_k*2 × 1536 floats) puis relit les vecteurs ici, en un
+# seul décodage vectorisé. Écrit à l'indexation par upsert_openai_simple.py dans
+# <LOCAL_INDEX_DIR>/<namespace>/vector_codes.npz (tableau contigu + ids).
+#
+#   float32  4 o/dim   référence
+#   float16  2 o/dim   ×2,  erreur de cosinus ~1e-4
+#   int8     1 o/dim   ×4,  une échelle float32 par vecteur (max |x| / 127)
+#   binary   1 bit/dim ×32, signe seul (cosinus ≈ angulaire) ; trop grossier pour le MMR
+#            sur des embeddings denses, à réserver aux très gros corpus
+#
+# Compromis précision / mémoire mesuré par bench_quant.py.
+# Usage: python vector_codes.py build [--namespace en_v1] [--level int8]
+
+import os, json, sys, argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from vector_store import LOCAL_INDEX_DIR, DEFAULT_NAMESPACE
+
+CODES_FILE = "vector_codes.npz"
+QUANT_LEVELS = ("float32", "float16", "int8", "binary")
+VECTOR_QUANT: str = os.getenv("VECTOR_QUANT", "float16").strip().lower()   # "off" = pas de fichier écrit
+
+def encode(mat: np.ndarray, level: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Matrice N×D (float) -> (codes contigus, échelles par ligne ou None)."""
+    mat = np.asarray(mat, dtype=np.float32)
+    if level == "float32":
+        return np.ascontiguousarray(mat), None
+    if level == "float16":
+        return mat.astype(np.float16), None
+    if level == "int8":
+        scale = np.abs(mat).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        return np.round(mat / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+    if level == "binary":
+        return np.packbits(mat > 0, axis=1), None
+    raise ValueError(f"niveau de quantification inconnu: {level!r} (attendu: {', '.join(QUANT_LEVELS)})")
+
+def decode(codes: np.ndarray, scale: Optional[np.ndarray], level: str, dim: int) -> np.ndarray:
+    """Codes -> float32 (N×D). Le binaire redonne ±1/sqrt(D) : vecteurs unitaires."""
+    if level == "int8":
+        return codes.astype(np.float32) * scale[:, None]
+    if level == "binary":
+        bits = np.unpackbits(codes, axis=1, count=dim).astype(np.float32)
+        return (bits * 2.0 - 1.0) / np.sqrt(dim)
+    return codes.astype(np.float32)
+
+class VectorCodes:
+    """Vecteurs quantifiés en tableau contigu, accès par id."""
+
+    def __init__(self, ids: List[str], codes: np.ndarray, scale: Optional[np.ndarray], level: str, dim: int):
+        self.ids, self.codes, self.scale, self.level, self.dim = ids, codes, scale, level, dim
+        self._pos: Dict[str, int] = {vid: i for i, vid in enumerate(ids)}
+
+    @classmethod
+    def build(cls, ids: Sequence[str], embeddings, level: str = VECTOR_QUANT) -> "VectorCodes":
+        mat = np.asarray(embeddings, dtype=np.float32)
+        codes, scale = encode(mat, level)
+        return cls(list(ids), codes, scale, level, mat.shape[1] if mat.ndim == 2 else 0)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, vid: str) -> bool:
+        return vid in self._pos
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def lookup(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        """{id: vecteur float32} pour les ids connus (les absents sont omis)."""
+        found = [(vid, self._pos[vid]) for vid in ids if vid in self._pos]
+        if not found:
+            return {}
+        rows = np.fromiter((i for _, i in found), dtype=np.int64, count=len(found))
+        mat = decode(self.codes[rows], self.scale[rows] if self.scale is not None else None, self.level, self.dim)
+        return {vid: mat[j] for j, (vid, _) in enumerate(found)}
+
+    # ---- persistance ----
+    def save(self, namespace: str = DEFAULT_NAMESPACE, root: str = LOCAL_INDEX_DIR) -> str:
+        folder = os.path.join(root, namespace)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, CODES_FILE)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, codes=self.codes, scale=self.scale if self.scale is not None else np.zeros(0, np.float32),
+                 ids=np.asarray(json.dumps(self.ids, ensure_ascii=False)),
+                 level=np.asarray(self.level), dim=np.asarray(self.dim))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, namespace: str = DEFAULT_NAMESPACE, root: str = LOCAL_INDEX_DIR) -> Optional["VectorCodes"]:
+        path = os.path.join(root, namespace, CODES_FILE)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as z:
+            level = str(z["level"])
+            return cls(json.loads(str(z["ids"])), z["codes"], z["scale"] if level == "int8" else None,
+                       level, int(z["dim"]))
+
+def main():
+    ap = argparse.ArgumentParser(description="Vecteurs quantifiés par id (MMR sans include_values)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="depuis l'index local (vectors.npy) du namespace")
+    b.add_argument("--namespace", default=DEFAULT_NAMESPACE)
+    b.add_argument("--level", choices=QUANT_LEVELS, default=VECTOR_QUANT if VECTOR_QUANT in QUANT_LEVELS else "float16")
+    args = ap.parse_args()
+
+    from vector_store import load_local_index
+    loaded = load_local_index(args.namespace)
+    if loaded is None:
+        print(f"❌ Index local introuvable pour '{args.namespace}', lancer: python upsert_openai_simple.py")
+        sys.exit(1)
+    ids, mat, _ = loaded
+    codes = VectorCodes.build(ids, mat, args.level)
+    print(f"TARS ✅ {len(ids)} vecteurs {args.level}: {codes.nbytes / 1e6:.2f} Mo "
+          f"(float32: {mat.nbytes / 1e6:.2f} Mo) -> {codes.save(args.namespace)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# vector_store.py — Backend de recherche vectorielle : Pinecone ou index local NumPy
+#
+# Le backend est choisi par VECTOR_BACKEND ("pinecone" par défaut, ou "local").
+# L'index local est écrit par upsert_openai_simple.py à partir des mêmes lignes
+# de chunks.csv, puis mappé en mémoire au démarrage : une requête top-k = un
+# seul produit matrice-vecteur, sans aller-retour réseau.
+
+import os, json
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+
+# ================= CONFIG =================
+VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "pinecone").strip().lower()
+LOCAL_INDEX_DIR: str = os.getenv("LOCAL_INDEX_DIR", "local_index")
+DEFAULT_NAMESPACE: str = os.getenv("LOCAL_INDEX_NAMESPACE", "en_v1")
+INDEX_VERSION: str = os.getenv("INDEX_VERSION", "")   # forçage manuel, en plus du manifeste
+# manifeste écrit par upsert_openai_simple.py à chaque indexation : sa date versionne l'index Pinecone
+INDEX_MANIFEST: str = os.getenv("INDEX_MANIFEST", "index_manifest_{namespace}.json")
+
+VECTORS_FILE = "vectors.npy"
+META_FILE    = "meta.json"
+
+# ================= RESULTATS =================
+class Match:
+    """Résultat compatible Pinecone : accès m["id"] ou m.id (et m.values, m.metadata)."""
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def __setitem__(self, key, value):
+        self.__dict__[key] = value
+
+    def __contains__(self, key):
+        return key in self.__dict__
+
+    def get(self, key, default=None):
+        return self.__dict__.get(key, default)
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+# ================= ECRITURE =================
+def save_local_index(ids: List[str], embeddings: List[List[float]], metadatas: List[Dict],
+                     namespace: str = DEFAULT_NAMESPACE, root: str = LOCAL_INDEX_DIR) -> str:
+    """Écrit la matrice normalisée (float32) + les métadonnées d'un namespace. Renvoie le dossier."""
+    if not (len(ids) == len(embeddings) == len(metadatas)):
+        raise ValueError("ids, embeddings et metadatas doivent avoir la même longueur")
+    folder = os.path.join(root, namespace or DEFAULT_NAMESPACE)
+    os.makedirs(folder, exist_ok=True)
+    mat = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+    # écriture atomique : un lecteur ne voit jamais un fichier à moitié écrit
+    tmp_vec = os.path.join(folder, VECTORS_FILE + ".tmp")
+    with open(tmp_vec, "wb") as f:
+        np.save(f, mat)
+    tmp_meta = os.path.join(folder, META_FILE + ".tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump({"ids": list(ids), "metadata": list(metadatas)}, f, ensure_ascii=False)
+    os.replace(tmp_vec, os.path.join(folder, VECTORS_FILE))
+    os.replace(tmp_meta, os.path.join(folder, META_FILE))
+    return folder
+
+def load_local_index(namespace: str = DEFAULT_NAMESPACE, root: str = LOCAL_INDEX_DIR):
+    """(ids, matrice mappée, métadonnées) d'un namespace, ou None s'il n'existe pas encore."""
+    try:
+        return LocalIndex(root=root)._load(namespace or DEFAULT_NAMESPACE)
+    except FileNotFoundError:
+        return None
+
+# ================= INDEX LOCAL =================
+class LocalIndex:
+    """Index en mémoire, même interface query() que pinecone.Index."""
+
+    def __init__(self, root: str = LOCAL_INDEX_DIR, default_namespace: str = DEFAULT_NAMESPACE):
+        self.root = root
+        self.default_namespace = default_namespace
+        self._namespaces: Dict[str, Tuple[List[str], np.ndarray, List[Dict]]] = {}
+        self._id_pos: Dict[str, Dict[str, int]] = {}
+
+    def _load(self, namespace: str) -> Tuple[List[str], np.ndarray, List[Dict]]:
+        if namespace in self._namespaces:
+            return self._namespaces[namespace]
+        folder = os.path.join(self.root, namespace)
+        vec_path = os.path.join(folder, VECTORS_FILE)
+        if not os.path.exists(vec_path):
+            raise FileNotFoundError(f"Index local introuvable pour le namespace '{namespace}': {vec_path}")
+        mat = np.load(vec_path, mmap_mode="r")
+        with open(os.path.join(folder, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        entry = (meta["ids"], mat, meta["metadata"])
+        self._namespaces[namespace] = entry
+        return entry
+
+    def query(self, vector: List[float], top_k: int = 5, include_metadata: bool = False,
+              include_values: bool = False, namespace: Optional[str] = None, **_) -> Match:
+        return self.query_many([vector], top_k, include_metadata, include_values, namespace)[0]
+
+    def query_many(self, vectors: List[List[float]], top_k: int = 5, include_metadata: bool = False,
+                   include_values: bool = False, namespace: Optional[str] = None, **_) -> List[Match]:
+        """Plusieurs requêtes en un seul produit matriciel (mode batch) ; une réponse par vecteur."""
+        ns = namespace or self.default_namespace
+        ids, mat, metas = self._load(ns)
+        if not ids or top_k <= 0 or not len(vectors):
+            return [Match(matches=[], namespace=ns) for _ in vectors]
+
+        q = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        qn = np.linalg.norm(q, axis=1, keepdims=True)
+        q = np.divide(q, qn, out=q, where=qn > 0)
+        all_scores = q @ mat.T
+
+        k = min(top_k, len(ids))
+        out = []
+        for scores in all_scores:
+            if k < len(ids):
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top], kind="stable")]
+            else:
+                top = np.argsort(-scores, kind="stable")
+
+            matches = []
+            for i in top:
+                m = Match(id=ids[i], score=float(scores[i]))
+                if include_metadata:
+                    m["metadata"] = dict(metas[i])
+                if include_values:
+                    m["values"] = mat[i].tolist()
+                matches.append(m)
+            out.append(Match(matches=matches, namespace=ns))
+        return out
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None, **_) -> Match:
+        """Vecteurs + métadonnées par id (même forme que pinecone.Index.fetch)."""
+        ns = namespace or self.default_namespace
+        all_ids, mat, metas = self._load(ns)
+        pos = self._positions(ns, all_ids)
+        vectors = {}
+        for vid in ids:
+            i = pos.get(vid)
+            if i is not None:
+                vectors[vid] = Match(id=vid, values=mat[i].tolist(), metadata=dict(metas[i]))
+        return Match(vectors=vectors, namespace=ns)
+
+    def _positions(self, namespace: str, ids: List[str]) -> Dict[str, int]:
+        if namespace not in self._id_pos:
+            self._id_pos[namespace] = {vid: i for i, vid in enumerate(ids)}
+        return self._id_pos[namespace]
+
+    def describe_index_stats(self, **_) -> Dict:
+        stats = {}
+        if os.path.isdir(self.root):
+            for ns in sorted(os.listdir(self.root)):
+                if os.path.exists(os.path.join(self.root, ns, VECTORS_FILE)):
+                    stats[ns] = {"vector_count": len(self._load(ns)[0])}
+        return {"namespaces": stats}
+
+def index_version(namespace: Optional[str] = None, backend: Optional[str] = None) -> str:
+    """Identifiant de version de l'index : namespace + date d'écriture (index local, ou manifeste
+    d'indexation pour Pinecone) + INDEX_VERSION."""
+    ns = namespace or DEFAULT_NAMESPACE
+    version = ns
+    if (backend or VECTOR_BACKEND).strip().lower() == "local":
+        path = os.path.join(LOCAL_INDEX_DIR, ns, VECTORS_FILE)
+    else:
+        path = INDEX_MANIFEST.format(namespace=ns)
+    try:
+        version += f"@{os.stat(path).st_mtime_ns}"
+    except OSError:
+        pass
+    if INDEX_VERSION:
+        version += f"#{INDEX_VERSION}"
+    return version
+
+def namespaces_version(namespaces: List[str], backend: Optional[str] = None) -> str:
+    """Version combinée de plusieurs namespaces : change dès que l'un d'eux est ré-indexé."""
+    return "|".join(index_version(ns, backend) for ns in namespaces)
+
+# ================= FABRIQUE =================
+def open_index(backend: Optional[str] = None, api_key: Optional[str] = None,
+               name: Optional[str] = None, host: Optional[str] = None,
+               environment: Optional[str] = None):
+    """Renvoie un index interrogeable (.query) selon le backend configuré."""
+    backend = (backend or VECTOR_BACKEND).strip().lower()
+    if backend == "local":
+        return LocalIndex()
+    if backend == "pinecone":
+        from pinecone import Pinecone
+        kwargs = {"api_key": api_key}
+        if environment:
+            kwargs["environment"] = environment
+        pc = Pinecone(**kwargs)
+        return pc.Index(name=name, host=host) if host else pc.Index(name)
+    raise ValueError(f"VECTOR_BACKEND inconnu: {backend!r} (attendu: 'pinecone' ou 'local')")
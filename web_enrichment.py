@@ -1,21 +1,101 @@
 # web_enrichment.py — Recherche Google + filtrage cohérence avec base RAG
-import os
+#
+# Jamais la latence de queue d'une requête de chat :
+#   - session HTTP partagée (keep-alive, pool de connexions) et timeouts connexion/lecture
+#   - cache des résultats (TTL) avec cache négatif : résultat vide gardé WEB_NEGATIVE_TTL,
+#     erreur (timeout, 429, 5xx) gardée WEB_ERROR_TTL pour ne pas repayer une panne à chaque requête
+#   - spéculatif : start_web() lance recherche + embeddings des snippets en parallèle du
+#     retrieval vectoriel ; web_context() attend au plus jusqu'à l'échéance (WEB_BUDGET_MS)
+#     puis rend la main avec le contexte DB seul. Une recherche en retard finit en tâche de
+#     fond et remplit le cache pour la question suivante.
+#   - embeddings des snippets via `embed_fn` : le backend ASGI passe son client AsyncOpenAI
+#     (sous openai_sem), par défaut le client OpenAI synchrone partagé (clients.get_openai)
+import os, time, threading, contextvars
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Callable, List, Dict, Optional, Tuple
 import requests
-from openai import OpenAI
-from typing import List, Dict
+from requests.adapters import HTTPAdapter
+import numpy as np
+from embedding_cache import cached_embeddings, normalize_text
+from clients import get_openai
+import metrics
 
 # ========= CONFIGURATION VIA VARIABLES D'ENVIRONNEMENT =========
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")       # Ta clé Google dans index_key.env
 GOOGLE_CX_ID   = os.getenv("GOOGLE_CX_ID")        # Ton CX ID Google
 MODEL_EMB      = "text-embedding-3-small"         # Pour vérifier la cohérence
+GOOGLE_URL     = "https://www.googleapis.com/customsearch/v1"
+
+WEB_BUDGET_MS: float    = float(os.getenv("WEB_BUDGET_MS", "1200"))      # attente max après le lancement
+WEB_CONNECT_TIMEOUT: float = float(os.getenv("WEB_CONNECT_TIMEOUT", "1.0"))
+WEB_READ_TIMEOUT: float = float(os.getenv("WEB_READ_TIMEOUT", "3.0"))    # borne le thread de fond
+WEB_CACHE_SIZE: int     = int(os.getenv("WEB_CACHE_SIZE", "1000"))
+WEB_CACHE_TTL: float    = float(os.getenv("WEB_CACHE_TTL", "3600"))
+WEB_NEGATIVE_TTL: float = float(os.getenv("WEB_NEGATIVE_TTL", "600"))   # aucun résultat
+WEB_ERROR_TTL: float    = float(os.getenv("WEB_ERROR_TTL", "30"))       # échec réseau / quota
+WEB_WORKERS: int        = int(os.getenv("WEB_WORKERS", "8"))
 # ============================================================
 
-# Initialisation client OpenAI via clé d'environnement
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+EmbedFn = Callable[[List[str]], List[List[float]]]
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+def _http() -> requests.Session:
+    """Session partagée du processus (recréée après un fork gunicorn)."""
+    global _session, _session_pid
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WEB_WORKERS, max_retries=0)
+            s.mount("https://", adapter)
+            _session, _session_pid = s, os.getpid()
+        return _session
+
+class _SearchCache:
+    """LRU borné ; chaque entrée porte sa propre échéance (positive, vide ou erreur)."""
+
+    def __init__(self, maxsize: int = WEB_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, results: List[Dict], ttl: float) -> None:
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.time() + ttl, results)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+search_cache = _SearchCache()
 
 def google_search(query: str, num_results: int = 5) -> List[Dict]:
-    """Recherche Google et retourne les snippets et URLs."""
-    url = "https://www.googleapis.com/customsearch/v1"
+    """Recherche Google et retourne les snippets et URLs (cache TTL, échecs en cache court)."""
+    key = f"{num_results}:{normalize_text(query)}"
+    cached = search_cache.get(key)
+    metrics.cache_event("web", cached is not None)
+    if cached is not None:
+        return cached
     params = {
         "q": query,
         "key": GOOGLE_API_KEY,
@@ -23,9 +103,10 @@ def google_search(query: str, num_results: int = 5) -> List[Dict]:
         "num": num_results
     }
     try:
-        res = requests.get(url, params=params)
-        data = res.json()
-        items = data.get("items", [])
+        with metrics.stage("google_search"):
+            res = _http().get(GOOGLE_URL, params=params, timeout=(WEB_CONNECT_TIMEOUT, WEB_READ_TIMEOUT))
+        res.raise_for_status()
+        items = res.json().get("items", [])
         results = []
         for item in items:
             results.append({
@@ -33,39 +114,126 @@ def google_search(query: str, num_results: int = 5) -> List[Dict]:
                 "snippet": item.get("snippet"),
                 "link": item.get("link")
             })
+        search_cache.put(key, results, WEB_CACHE_TTL if results else WEB_NEGATIVE_TTL)
         return results
     except Exception as e:
         print(f"[ERREUR Google API] {e}")
+        search_cache.put(key, [], WEB_ERROR_TTL)
+        return []
+
+def _unit_rows(vectors) -> np.ndarray:
+    mat = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return np.divide(mat, norms, out=np.zeros_like(mat), where=norms > 0)
+
+def default_embed(texts: List[str]) -> List[List[float]]:
+    """Embeddings via le client OpenAI synchrone partagé (et le cache d'embeddings)."""
+    return cached_embeddings(get_openai(), MODEL_EMB, texts)
+
+def fetch_web(query: str, num_results: int = 8,
+              embed_fn: Optional[EmbedFn] = None) -> Tuple[List[Dict], Optional[List[List[float]]]]:
+    """Recherche + embeddings des snippets (indépendants du retrieval DB) ; vecteurs None si l'embedding échoue."""
+    snippets = [s for s in google_search(query, num_results) if s.get("snippet")]
+    if not snippets:
+        return [], None
+    try:
+        return snippets, (embed_fn or default_embed)([s["snippet"] for s in snippets])
+    except Exception as e:
+        print(f"[ERREUR Cohérence] {e}")
+        return snippets, None
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WEB_WORKERS, thread_name_prefix="web")
+        return _executor
+
+def start_web(query: str, num_results: int = 8, embed_fn: Optional[EmbedFn] = None) -> Future:
+    """Lance fetch_web en tâche de fond (à appeler avant le retrieval vectoriel)."""
+    return _pool().submit(contextvars.copy_context().run, fetch_web, query, num_results, embed_fn)
+
+def deadline_in(budget_ms: float = WEB_BUDGET_MS) -> float:
+    return time.perf_counter() + budget_ms / 1000.0
+
+def time_left(deadline: float) -> float:
+    return max(deadline - time.perf_counter(), 0.0)
+
+def missed_deadline() -> None:
+    print("[Web] échéance dépassée, contexte DB seul")
+    metrics.add("web_timeouts")
+
+def filter_coherent(snippets: List[Dict], snippet_vectors, rag_vectors, threshold: float = 0.75) -> List[Dict]:
+    """Snippets dont le meilleur cosinus avec un passage de la base atteint `threshold` (matrice S×P)."""
+    if not snippets or snippet_vectors is None or rag_vectors is None or not len(rag_vectors):
         return []
+    t0 = time.perf_counter()
+    max_sim = (_unit_rows(snippet_vectors) @ _unit_rows(rag_vectors).T).max(axis=1)
+    valid = [s for s, sim in zip(snippets, max_sim) if sim >= threshold]
+    metrics.record("coherence_score", time.perf_counter() - t0)
+    metrics.pool_size("web_snippets", len(snippets))
+    return valid
 
-def check_coherence(rag_passages: List[str], web_snippets: List[Dict], threshold: float = 0.75) -> List[Dict]:
+def check_coherence(rag_passages: List[str], web_snippets: List[Dict], threshold: float = 0.75,
+                    rag_vectors: Optional[List[List[float]]] = None,
+                    timings: Optional[Dict[str, float]] = None,
+                    embed_fn: Optional[EmbedFn] = None) -> List[Dict]:
     """
     Compare les snippets web avec les passages de la base via similarité sémantique.
     Ne garde que les snippets compatibles (non contradictoires).
+    Un seul appel embeddings pour tous les textes (les vecteurs déjà renvoyés par
+    le retrieval peuvent être passés via rag_vectors), puis une matrice S×P.
+    Si `timings` est fourni, il reçoit la durée de chaque phase (secondes).
     """
-    valid_snippets = []
-    for snip in web_snippets:
-        try:
-            emb_web = client.embeddings.create(model=MODEL_EMB, input=snip["snippet"]).data[0].embedding
-            similarities = []
-            for passage in rag_passages:
-                emb_rag = client.embeddings.create(model=MODEL_EMB, input=passage).data[0].embedding
-                dot = sum(a*b for a, b in zip(emb_web, emb_rag))
-                norm_web = sum(a*a for a in emb_web) ** 0.5
-                norm_rag = sum(a*a for a in emb_rag) ** 0.5
-                sim = dot / (norm_web * norm_rag)
-                similarities.append(sim)
-
-            max_sim = max(similarities) if similarities else 0
-            if max_sim >= threshold:
-                valid_snippets.append(snip)
-        except Exception as e:
-            print(f"[ERREUR Cohérence] {e}")
-            continue
+    snippets = [s for s in web_snippets if s.get("snippet")]
+    if not snippets or not rag_passages:
+        return []
+    t0 = time.perf_counter()
+    try:
+        reuse = rag_vectors is not None and len(rag_vectors) == len(rag_passages)
+        texts = [s["snippet"] for s in snippets] + ([] if reuse else list(rag_passages))
+        embs = (embed_fn or default_embed)(texts)
+    except Exception as e:
+        print(f"[ERREUR Cohérence] {e}")
+        return []
+    t1 = time.perf_counter()
+    valid_snippets = filter_coherent(snippets, embs[:len(snippets)], rag_vectors if reuse else embs[len(snippets):],
+                                     threshold)
+    t2 = time.perf_counter()
+
+    metrics.record("coherence_embed", t1 - t0)
+    if timings is not None:
+        timings["coherence_embed"] = t1 - t0
+        timings["coherence_score"] = t2 - t1
     return valid_snippets
 
-def get_web_context(question: str, rag_passages: List[str], top_n: int = 3) -> List[str]:
-    """Recherche sur Google et filtre les résultats cohérents avec le RAG."""
-    raw_snippets = google_search(question, num_results=8)
-    valid_snippets = check_coherence(rag_passages, raw_snippets)
+def web_context(pending: Future, deadline: float, rag_vectors, top_n: int = 3,
+                threshold: float = 0.75) -> List[str]:
+    """Lignes web cohérentes, ou [] si start_web n'a pas fini avant `deadline` (contexte DB seul)."""
+    t0 = time.perf_counter()
+    try:
+        snippets, vectors = pending.result(timeout=time_left(deadline))
+    except FutureTimeout:
+        missed_deadline()
+        return []
+    finally:
+        metrics.record("web_wait", time.perf_counter() - t0)
+    valid = filter_coherent(snippets, vectors, rag_vectors, threshold)
+    return [f"{s['snippet']} (source: {s['link']})" for s in valid[:top_n]]
+
+def get_web_context(question: str, rag_passages: List[str], top_n: int = 3,
+                    rag_vectors: Optional[List[List[float]]] = None,
+                    timings: Optional[Dict[str, float]] = None,
+                    budget_ms: float = WEB_BUDGET_MS) -> List[str]:
+    """Recherche sur Google et filtre les résultats cohérents avec le RAG, sous `budget_ms`."""
+    t0 = time.perf_counter()
+    deadline = deadline_in(budget_ms)
+    try:
+        raw_snippets = _pool().submit(google_search, question, 8).result(timeout=time_left(deadline))
+    except FutureTimeout:
+        missed_deadline()
+        raw_snippets = []
+    if timings is not None:
+        timings["google_search"] = time.perf_counter() - t0
+    valid_snippets = check_coherence(rag_passages, raw_snippets, rag_vectors=rag_vectors, timings=timings)
     return [f"{s['snippet']} (source: {s['link']})" for s in valid_snippets[:top_n]]